@@ -0,0 +1,17 @@
+"""
+Entry of `python -m py_five_in_row`: `analyze ...` runs the headless analysis CLI of
+src/analyze.py, anything else starts the GUI of main.py. The GUI modules are imported only in
+the second case, so analysis never needs a display stack.
+"""
+import os
+import sys
+
+# main.py and src import game_config and src.* from the project root.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+if len(sys.argv) > 1 and sys.argv[1] == "analyze":
+    from src.analyze import main
+    main(sys.argv[2:])
+else:
+    from main import main
+    main()
@@ -0,0 +1,73 @@
+"""
+Cold start benchmark of the headless analysis CLI (src/analyze.py).
+
+Each run is a fresh interpreter, timed from spawn to exit:
+    import      python -c "import src.analyze"; also checks no GUI module got imported
+    analyze     python -m src.analyze on a small position with a 1 iteration search, i.e. the
+                whole start-up cost of a one-shot batch job
+
+The median of --repeat runs is reported; with --target-ms the script exits with 1 when the
+analyze median exceeds it.
+
+    python benchmarks/import_time.py --repeat 10 --target-ms 400
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GUI_MODULES = {"sdl2", "imgui_bundle", "OpenGL", "rich"}
+
+POSITION = "\n".join(["." * 15] * 6 + [".......x.......", ".......xo......"] + ["." * 15] * 7) + "\n"
+
+
+def timed_run(args: list[str], stdin: str | None = None):
+    """
+    Return: (seconds, stdout) of running python with args from the project root.
+    """
+    time1 = time.perf_counter()
+    res = subprocess.run([sys.executable] + args, cwd=ROOT_DIR, input=stdin, capture_output=True,
+                         text=True, check=True)
+    return time.perf_counter() - time1, res.stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start time of the analysis CLI.")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--target-ms", type=float, default=None, help="exit with 1 if analyze median is above")
+    parser.add_argument("-o", "--output", help="JSON file to write results")
+    args = parser.parse_args()
+
+    check = f"import json, sys, src.analyze; print(json.dumps(sorted(m for m in sys.modules if m.split('.')[0] in {GUI_MODULES!r})))"
+    _, loaded = timed_run(["-c", check])
+    gui_loaded = json.loads(loaded)
+    if gui_loaded:
+        print(f"GUI modules imported by src.analyze: {gui_loaded}")
+        sys.exit(1)
+
+    cases = {
+        "baseline": (["-c", "pass"], None),
+        "import": (["-c", "import src.analyze"], None),
+        "analyze": (["-m", "src.analyze", "--board", "-", "--iterations", "1"], POSITION),
+    }
+    results = {}
+    for name, (case_args, stdin) in cases.items():
+        times = [timed_run(case_args, stdin)[0] * 1000 for _ in range(args.repeat)]
+        results[name] = {"median_ms": statistics.median(times), "min_ms": min(times)}
+        print(f"{name:>9}: median {results[name]['median_ms']:.1f} ms, min {results[name]['min_ms']:.1f} ms",
+              flush=True)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.target_ms is not None and results["analyze"]["median_ms"] > args.target_ms:
+        print(f"analyze cold start {results['analyze']['median_ms']:.1f} ms is above target {args.target_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Benchmark suite of the C++ py_MCTS engine and the python MonteCarloTreeSearch.
+
+Every case searches a fixed position with a fixed seed in its own subprocess, so peak RSS
+belongs to that case only. A case is run --repeat times and the best run is kept to damp
+timing noise. Results are written as JSON; --compare flags regressions against a saved
+result file.
+
+    python benchmarks/run_benchmarks.py -o bench.json
+    python benchmarks/run_benchmarks.py -o new.json --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# fixed positions, stones given as (offset_x, offset_y, stone_id) from the board center.
+POSITIONS = {
+    "opening": {
+        "stones": [(0, 0, 1)],
+        "stone_id": 2,
+    },
+    "midgame": {
+        "stones": [(0, 0, 1), (1, 1, 2), (1, 0, 1), (-1, 0, 2), (0, 1, 1), (2, 2, 2),
+                   (-1, -1, 1), (0, -1, 2), (2, 0, 1), (3, 0, 2), (-1, 2, 1), (1, -2, 2)],
+        "stone_id": 1,
+    },
+    "tactical": { # black has an open three, white to move
+        "stones": [(0, -1, 1), (0, 0, 1), (0, 1, 1), (1, 0, 2), (-1, 1, 2)],
+        "stone_id": 2,
+    },
+}
+
+# (name, playout policy name, near_playout_policy_distance)
+CPP_POLICIES = [
+    ("uniform", "UniformPlayout", 0),
+    ("near1", "NearPlacePlayout", 1),
+    ("near2", "NearPlacePlayout", 2),
+    ("threat2", "ThreatPlayout", 2),
+]
+
+# metrics where a larger value is better, the others are better when smaller.
+HIGHER_IS_BETTER = {"iterations_per_sec", "rollouts_per_sec", "nodes_per_sec"}
+COMPARED_METRICS = ["iterations_per_sec", "rollouts_per_sec", "nodes_per_sec", "peak_rss_bytes", "bytes_per_node"]
+
+
+def make_board(board_size: int, position: str):
+    import numpy as np
+    board = np.zeros((board_size, board_size), dtype=np.int32)
+    center = board_size // 2
+    for dx, dy, stone in POSITIONS[position]["stones"]:
+        board[center + dx, center + dy] = stone
+    return board
+
+
+def max_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def list_cases(engines: list[str], sizes: list[int], cpp_iterations: int, py_iterations: int):
+    cases = []
+    for board_size in sizes:
+        for position in POSITIONS:
+            if "cpp" in engines:
+                for policy, policy_name, distance in CPP_POLICIES:
+                    cases.append({"engine": "cpp", "board_size": board_size, "position": position,
+                                  "policy": policy, "policy_name": policy_name, "distance": distance,
+                                  "iterations": cpp_iterations, "seed": 0})
+            if "python" in engines:
+                # the python engine only has uniform playout.
+                cases.append({"engine": "python", "board_size": board_size, "position": position,
+                              "policy": "uniform", "iterations": py_iterations, "seed": 0})
+    return cases
+
+
+def case_key(case: dict):
+    return f"{case['engine']}/{case['board_size']}x{case['board_size']}/{case['position']}/{case['policy']}"
+
+
+def run_cpp_case(case: dict):
+    import py_MCTS
+    tree = py_MCTS.MonteCarloTreeSearch(make_board(case["board_size"], case["position"]),
+                                        POSITIONS[case["position"]]["stone_id"])
+    tree.random_seed = case["seed"]
+    tree.early_stop = False
+    tree.playout_policy = getattr(py_MCTS, case["policy_name"])
+    if case["distance"] > 0:
+        tree.near_playout_policy_distance = case["distance"]
+    rss_before = max_rss_bytes()
+    time1 = time.perf_counter()
+    tree.SearchMove(case["iterations"])
+    elapsed = time.perf_counter() - time1
+    num_nodes = tree.GetTreeNodesNumbers()
+    return {
+        "elapsed_sec": elapsed,
+        "iterations": tree.last_search_iterations,
+        "rollouts": tree.last_search_rollouts,
+        "nodes": num_nodes,
+        "rss_growth_bytes": max_rss_bytes() - rss_before,
+        "arena_bytes_per_node": tree.GetMemoryUsage() / num_nodes,
+    }
+
+
+def run_python_case(case: dict):
+    from src.monte_carlo_tree_search import MonteCarloTreeSearch
+    import numpy as np
+    random.seed(case["seed"])
+    np.random.seed(case["seed"])
+    tree = MonteCarloTreeSearch(make_board(case["board_size"], case["position"]),
+                                POSITIONS[case["position"]]["stone_id"])
+    rss_before = max_rss_bytes()
+    time1 = time.perf_counter()
+    tree.search_move(case["iterations"])
+    elapsed = time.perf_counter() - time1
+    return {
+        "elapsed_sec": elapsed,
+        "iterations": case["iterations"],
+        "rollouts": tree.num_rollouts,
+        "nodes": tree.num_nodes,
+        "rss_growth_bytes": max_rss_bytes() - rss_before,
+    }
+
+
+def run_case_in_subprocess(case: dict):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        result_file = os.path.join(tmp_dir, "result.json")
+        # engines print search progress, keep it out of the benchmark output.
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--case", json.dumps(case),
+                        "--result-file", result_file],
+                       cwd=ROOT_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       env=dict(os.environ, PYTHONPATH=ROOT_DIR + os.pathsep + os.environ.get("PYTHONPATH", "")))
+        with open(result_file) as f:
+            return json.load(f)
+
+
+def case_main(case: dict, result_file: str):
+    raw = run_cpp_case(case) if case["engine"] == "cpp" else run_python_case(case)
+    elapsed = raw["elapsed_sec"]
+    metrics = {
+        "iterations_per_sec": raw["iterations"] / elapsed,
+        "rollouts_per_sec": raw["rollouts"] / elapsed,
+        "nodes_per_sec": raw["nodes"] / elapsed,
+        "peak_rss_bytes": max_rss_bytes(),
+        "bytes_per_node": raw["rss_growth_bytes"] / raw["nodes"],
+    }
+    metrics.update(raw)
+    with open(result_file, "w") as f:
+        json.dump(metrics, f)
+
+
+def best_of(runs: list[dict]):
+    """
+    Keep the best value of every metric over repeated runs of a case.
+    """
+    best = dict(runs[0])
+    for run in runs[1:]:
+        for metric in COMPARED_METRICS:
+            pick = max if metric in HIGHER_IS_BETTER else min
+            best[metric] = pick(best[metric], run[metric])
+    return best
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """
+    Return: list of (case key, metric, baseline value, current value) of regressed metrics.
+    """
+    base_by_key = {r["key"]: r["metrics"] for r in baseline["results"]}
+    regressions = []
+    for r in results["results"]:
+        base = base_by_key.get(r["key"])
+        if base is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = base.get(metric), r["metrics"].get(metric)
+            if old is None or new is None or old <= 0:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                regressed = new < old * (1 - threshold)
+            else:
+                regressed = new > old * (1 + threshold)
+            if regressed:
+                regressions.append((r["key"], metric, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MCTS engines on fixed positions.")
+    parser.add_argument("-o", "--output", default="bench_output.json", help="JSON file to write results")
+    parser.add_argument("--compare", help="baseline JSON file, exit with 1 if a metric regressed")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as regression")
+    parser.add_argument("--engines", nargs="+", default=["cpp", "python"], choices=["cpp", "python"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[9, 15], help="board sizes")
+    parser.add_argument("--cpp-iterations", type=int, default=5000)
+    parser.add_argument("--py-iterations", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each case, the best one is kept")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        case_main(json.loads(args.case), args.result_file)
+        return
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "repeat": args.repeat,
+        },
+        "results": [],
+    }
+    print(f"{'case':<40}{'iter/s':>12}{'rollout/s':>12}{'node/s':>12}{'peak RSS MB':>13}{'B/node':>9}")
+    for case in list_cases(args.engines, args.sizes, args.cpp_iterations, args.py_iterations):
+        metrics = best_of([run_case_in_subprocess(case) for _ in range(max(1, args.repeat))])
+        results["results"].append({"key": case_key(case), "case": case, "metrics": metrics})
+        print(f"{case_key(case):<40}{metrics['iterations_per_sec']:>12.0f}{metrics['rollouts_per_sec']:>12.0f}"
+              f"{metrics['nodes_per_sec']:>12.0f}{metrics['peak_rss_bytes'] / 2**20:>13.1f}"
+              f"{metrics['bytes_per_node']:>9.0f}", flush=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for key, metric, old, new in regressions:
+            print(f"REGRESSION {key} {metric}: {old:.4g} -> {new:.4g} ({(new - old) / old:+.1%})")
+        if regressions:
+            sys.exit(1)
+        print("no regression")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,35 @@
-import py_MCTS
-
 board_size = 15 # numbers of rows / cols of chess board
 
 # config AI
 tree_search_steps = 20000
-list_policy = [py_MCTS.NearPlacePlayout, py_MCTS.UniformPlayout]
+# search time of each AI move in milliseconds, overrides tree_search_steps if > 0
+move_time_ms = 0
+# max number of nodes in search tree, 0 for no limit
+tree_search_max_nodes = 0
+# nodes the search tree may hold, least visited subtrees are collapsed to stay under it, 0 for no limit
+tree_search_node_budget = 0
+# keep searching from the AI's move during the player's turn
+ponder = True
+# max number of nodes in search tree while pondering
+ponder_max_nodes = 2000000
+# create tree nodes on demand as they gain visits, instead of all children at once
+progressive_widening = False
+# opening book file built by src/opening_book.py, consulted before searching, None to always search
+opening_book_path = None
+# min total rounds of a book move to be played without search
+opening_book_min_visits = 100
+# append-only log receiving every finished game, see src/game_records.py, None to keep no record
+game_record_path = "game_records.bin"
+# show search progress bar, root children statistics and tree shape of each AI move
+search_verbose = False
+# names of py_MCTS playout policies, kept as strings so importing the config doesn't load py_MCTS
+list_policy = ["NearPlacePlayout", "UniformPlayout", "ThreatPlayout"]
 tree_search_policy = list_policy[0]
 
 
 # UI related
-screen_bg_col = [76/255,68/255,139/255]
\ No newline at end of file
+screen_bg_col = [76/255,68/255,139/255]
+# render only on input, sleeping on SDL events while the window is idle; otherwise render at 60 fps
+event_driven_rendering = True
+# while waiting for the AI's move, a frame is rendered at least this often to poll it
+ai_poll_interval_ms = 50
\ No newline at end of file
@@ -87,9 +87,19 @@ def main():
 
     game = Game()
     imgui_io: imgui.IO = imgui.get_io()
+    # imgui settles hover and click state over the frames following an input, keep rendering these.
+    settle_frames = 3
+    frames_to_render = settle_frames
     while running and game.status != Game.GameStatus.EXIT:
+        if game_config.event_driven_rendering and frames_to_render == 0:
+            # sleep until an input arrives, waking up to poll the AI while it thinks.
+            timeout = game_config.ai_poll_interval_ms if game.needs_update() else 1000
+            if SDL_WaitEventTimeout(None, timeout) == 0 and not game.needs_update():
+                continue
+        frames_to_render = max(0, frames_to_render - 1)
         tick = SDL_GetTicks64()
         while SDL_PollEvent(ctypes.byref(event)) != 0:
+            frames_to_render = settle_frames
             if event.type == SDL_QUIT or \
                 (event.type == SDL_KEYDOWN and event.key.keysym.scancode == SDL_SCANCODE_Q):
                 running = False
@@ -104,7 +114,11 @@ def main():
         imgui.new_frame()
 
         # render ui
+        was_waiting_ai = game.needs_update()
         game.render_ui()
+        if was_waiting_ai and not game.needs_update():
+            # the AI's move is placed after the board was drawn, show it in the next frames.
+            frames_to_render = settle_frames
 
         # debug layout
         # if imgui.button("debug", (50, 0)):
@@ -129,6 +143,7 @@ def main():
             SDL_Delay(int(ms_per_frame - (tick2 - tick)))
 
 
+    game.shutdown()
     impl.shutdown()
     SDL_GL_DeleteContext(gl_context)
     SDL_DestroyWindow(window)
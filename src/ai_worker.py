@@ -0,0 +1,127 @@
+"""
+AI engine hosted in a persistent worker process, so searches neither hold the GUI's GIL nor
+outlive the game they were started for.
+
+The frontend talks to the worker over a duplex pipe. Requests and responses are tuples:
+
+    ("move", request_id, board, stone_id, budget) -> ("move", request_id, move)
+    ("ponder", request_id)                          -> nothing
+    ("cancel", request_id)                          -> nothing, stops requests up to request_id
+    ("close",)
+
+board is a snapshot of the board, budget the iter_steps / time_limit_ms / max_nodes of the
+search or None for the ones of game_config. move is None if the request was cancelled.
+Request ids increase, a cancel stops the running request and drops the queued ones with an id
+not above it, so the engine never spends time on an abandoned position.
+"""
+import multiprocessing
+import queue
+import threading
+
+import numpy as np
+
+
+class AIWorker:
+    """
+    Frontend side of the worker process. Not thread safe, meant to be driven by the GUI loop.
+    """
+    def __init__(self) -> None:
+        # spawn: the GUI process holds SDL / OpenGL state that must not be forked.
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main, args=(child_conn,), daemon=True, name="ai_worker")
+        self.process.start()
+        child_conn.close()
+        self.last_request_id = 0
+        self.pending_move_id: int | None = None # id of the move request whose answer is awaited
+
+    def request_move(self, board_state: np.ndarray, stone_id: int, budget: dict | None = None):
+        """
+        Ask for a move on a copy of board_state, the answer is returned by poll_move.
+        budget: iter_steps, time_limit_ms and max_nodes of the search, None for game_config's.
+        """
+        self.last_request_id += 1
+        self.pending_move_id = self.last_request_id
+        self.conn.send(("move", self.last_request_id, np.array(board_state, dtype=np.int8), stone_id, budget))
+
+    def ponder(self):
+        """
+        Keep searching from the position after the last move given, until cancel.
+        """
+        self.last_request_id += 1
+        self.conn.send(("ponder", self.last_request_id))
+
+    def cancel(self):
+        """
+        Stop every request sent so far, a pending move is dropped. Does not wait for the worker.
+        """
+        if self.last_request_id > 0:
+            self.conn.send(("cancel", self.last_request_id))
+        self.pending_move_id = None
+
+    def poll_move(self):
+        """
+        Non-blocking.
+        Return: the move answering the pending request, None if it is not ready yet.
+        """
+        while self.pending_move_id is not None and self.conn.poll():
+            _, request_id, move = self.conn.recv()
+            # answers of cancelled requests arrive late, they belong to another board.
+            if request_id == self.pending_move_id and move is not None:
+                self.pending_move_id = None
+                return move
+        return None
+
+    def close(self):
+        if self.process.is_alive():
+            self.cancel()
+            self.conn.send(("close",))
+            self.process.join(timeout=5)
+        self.conn.close()
+
+
+def worker_main(conn):
+    """
+    Entry of the worker process. A receiver thread reads the pipe so a cancel reaches the
+    engine while it searches; requests run one at a time on the main thread.
+    """
+    from . import game_AI
+    requests = queue.Queue()
+    lock = threading.Lock()
+    state = {"cancelled_id": 0, "running_id": 0}
+
+    def receive():
+        while True:
+            try:
+                msg = conn.recv()
+            except EOFError:
+                msg = ("close",)
+            if msg[0] == "cancel":
+                with lock:
+                    state["cancelled_id"] = max(state["cancelled_id"], msg[1])
+                    if state["running_id"] <= msg[1]:
+                        game_AI.session.cancel()
+                continue
+            requests.put(msg)
+            if msg[0] == "close":
+                return
+
+    threading.Thread(target=receive, daemon=True).start()
+    while True:
+        msg = requests.get()
+        if msg[0] == "close":
+            return
+        request_id = msg[1]
+        with lock:
+            cancelled = request_id <= state["cancelled_id"]
+            if not cancelled:
+                state["running_id"] = request_id
+                game_AI.session.start()
+        move = None
+        if msg[0] == "move":
+            if not cancelled:
+                _, _, board, stone_id, budget = msg
+                move = game_AI.AI_step(board, stone_id, budget)
+            conn.send(("move", request_id, None if move is None else (int(move[0]), int(move[1]))))
+        elif msg[0] == "ponder" and not cancelled:
+            game_AI.ponder()
@@ -0,0 +1,138 @@
+"""
+One-shot headless analysis: best move of a position read from a file.
+
+    python -m py_five_in_row analyze --board position.txt --time 500ms
+    python -m src.analyze --board - --iterations 20000 --top 5 < position.txt
+
+Line i of the board file holds row i of the board state (board_state[i] as in Game), one
+character per place: ".", "-", "+" or "0" for empty, "x", "b" or "1" for black, "o", "w" or
+"2" for white; blanks are ignored. The side to move is black if both sides have as many
+stones, white otherwise, unless --stone is given. The move is printed as "x,y". A board
+which is full or already has five in a row is rejected with exit status 2.
+
+Batch jobs start this thousands of times, so it keeps its import graph small: no GUI module,
+no rich, and py_MCTS with numpy are imported only once the board has been read.
+benchmarks/import_time.py checks that cold start stays under a target.
+"""
+import argparse
+import json
+import sys
+
+STONE_CHARS = {".": 0, "-": 0, "+": 0, "0": 0, "x": 1, "b": 1, "1": 1, "o": 2, "w": 2, "2": 2}
+
+
+def parse_board(text: str):
+    """
+    Return: board state as a list of rows, see the module docstring for the format.
+    """
+    rows = []
+    for line in text.splitlines():
+        cells = [c for c in line.lower() if not c.isspace()]
+        if not cells:
+            continue
+        unknown = [c for c in cells if c not in STONE_CHARS]
+        if unknown:
+            raise ValueError(f"unknown place {unknown[0]!r} in board line {line!r}")
+        rows.append([STONE_CHARS[c] for c in cells])
+    if not rows or any(len(row) != len(rows) for row in rows):
+        raise ValueError(f"board is not square: {len(rows)} lines of lengths {sorted({len(r) for r in rows})}")
+    if len(rows) < 5 or len(rows) > 32:
+        raise ValueError(f"unsupported board size {len(rows)}")
+    return rows
+
+
+def parse_time_ms(text: str):
+    """
+    "500ms", "2s", "1.5s" or a number of milliseconds.
+    """
+    text = text.strip().lower()
+    if text.endswith("ms"):
+        return int(float(text[:-2]))
+    if text.endswith("s"):
+        return int(float(text[:-1]) * 1000)
+    return int(float(text))
+
+
+def stone_to_move(rows: list[list[int]]):
+    black = sum(row.count(1) for row in rows)
+    white = sum(row.count(2) for row in rows)
+    return 1 if black == white else 2
+
+
+def five_in_row(rows: list[list[int]]):
+    """
+    Return: stone id having five in a row on the board, 0 if none has.
+    """
+    n = len(rows)
+    for i in range(n):
+        for j in range(n):
+            stone = rows[i][j]
+            if stone == 0:
+                continue
+            for dx, dy in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                if all(0 <= i + k * dx < n and 0 <= j + k * dy < n and rows[i + k * dx][j + k * dy] == stone
+                       for k in range(1, 5)):
+                    return stone
+    return 0
+
+
+def analyze(rows: list[list[int]], stone_id: int, time_limit_ms: int = 0, iter_steps: int = 0,
+            num_threads: int = 1, playout_policy: str = "NearPlacePlayout", top: int = 1):
+    """
+    Return: list of the top most visited moves as dicts of move, visits and win_rate of stone_id.
+    """
+    import numpy as np
+    import py_MCTS
+    tree = py_MCTS.MonteCarloTreeSearch(np.array(rows, dtype=np.int8), stone_id)
+    tree.playout_policy = getattr(py_MCTS, playout_policy)
+    tree.near_playout_policy_distance = 1
+    tree.num_threads = num_threads
+    tree.SearchMove(iter_steps, time_limit_ms)
+    children = sorted(tree.GetRootChildren(), key=lambda ch: -ch.total_rounds)
+    return [{"move": list(ch.from_moving), "visits": ch.total_rounds,
+             "win_rate": ch.win_rounds / ch.total_rounds if ch.total_rounds > 0 else None}
+            for ch in children[:top]]
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="py_five_in_row analyze", description="Best move of a position.")
+    parser.add_argument("--board", required=True, help="board file, - for stdin")
+    parser.add_argument("--stone", type=int, choices=[1, 2], default=None,
+                        help="side to move, 1 black / 2 white, default from stone counts")
+    parser.add_argument("--time", type=parse_time_ms, default=None, help="search time, e.g. 500ms or 2s")
+    parser.add_argument("--iterations", type=int, default=0, help="search iterations, 0 for no limit")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--policy", default="NearPlacePlayout",
+                        choices=["NearPlacePlayout", "UniformPlayout", "ThreatPlayout"])
+    parser.add_argument("--top", type=int, default=1, help="number of candidate moves to print")
+    parser.add_argument("--json", action="store_true", help="print candidates with their statistics as JSON")
+    args = parser.parse_args(argv)
+
+    text = sys.stdin.read() if args.board == "-" else open(args.board).read()
+    try:
+        rows = parse_board(text)
+    except ValueError as e:
+        parser.error(str(e))
+    time_limit_ms = args.time if args.time is not None else (0 if args.iterations > 0 else 1000)
+    if time_limit_ms <= 0 and args.iterations <= 0:
+        parser.error("--time should be positive unless --iterations is given")
+    stone_id = args.stone or stone_to_move(rows)
+    winner = five_in_row(rows)
+    if winner != 0:
+        parser.error(f"game is over, {'black' if winner == 1 else 'white'} has five in a row")
+    if all(all(row) for row in rows):
+        parser.error("board is full")
+    try:
+        candidates = analyze(rows, stone_id, time_limit_ms, args.iterations, args.threads, args.policy, max(1, args.top))
+    except RuntimeError as e:
+        sys.exit(f"error: search failed: {e}")
+    if args.json:
+        print(json.dumps({"stone_id": stone_id, "candidates": candidates}))
+    else:
+        for c in candidates:
+            print(f"{c['move'][0]},{c['move'][1]}" if args.top <= 1 else
+                  f"{c['move'][0]},{c['move'][1]} visits {c['visits']} win_rate {c['win_rate']:.3f}")
+
+
+if __name__ == "__main__":
+    main()
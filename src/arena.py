@@ -0,0 +1,224 @@
+"""
+Headless engine-vs-engine matches, no SDL / OpenGL / imgui is imported.
+
+Games are spread over a process pool, first player alternates between games following
+Game.who_first: 0 -> engine A moves first with black stones, 1 -> engine B moves first.
+Results are streamed as games finish, and a summary of win rate, Elo difference of A
+over B with 95% confidence interval and games per hour is printed at the end.
+
+    python -m src.arena --engine-a '{"engine": "cpp", "iter_steps": 3000}' \
+        --engine-b '{"engine": "cpp", "iter_steps": 3000, "playout_policy": "UniformPlayout"}' \
+        --games 100 --workers 4 --output arena.jsonl
+"""
+import argparse
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .bit_board import BitBoard
+
+
+class CppEngine:
+    """
+    py_MCTS engine, the search tree follows the game through AdvanceRoot.
+    spec keys (all optional): iter_steps, time_limit_ms, max_nodes, playout_policy
+    ("NearPlacePlayout" / "UniformPlayout" / "ThreatPlayout"), reuse_tree, and the tree attributes in TREE_OPTIONS.
+    """
+    TREE_OPTIONS = ["near_playout_policy_distance", "num_threads", "progressive_widening",
+                    "widening_coef", "widening_exponent", "widening_prior", "node_budget"]
+
+    def __init__(self, spec: dict, seed: int) -> None:
+        self.spec = spec
+        self.seed = seed
+        self.tree = None
+
+    def new_game(self, board_state: np.ndarray, stone_id: int):
+        import py_MCTS
+        self.tree = py_MCTS.MonteCarloTreeSearch(board_state, stone_id)
+        self.tree.random_seed = self.seed
+        self.tree.playout_policy = getattr(py_MCTS, self.spec.get("playout_policy", "NearPlacePlayout"))
+        self.tree.near_playout_policy_distance = 1
+        for option in self.TREE_OPTIONS:
+            if option in self.spec:
+                setattr(self.tree, option, self.spec[option])
+        self.stone_id = stone_id
+
+    def get_move(self, board_state: np.ndarray):
+        if not self.spec.get("reuse_tree", True):
+            self.new_game(board_state, self.stone_id)
+        return self.tree.SearchMove(self.spec.get("iter_steps", 0 if "time_limit_ms" in self.spec else 5000),
+                                    self.spec.get("time_limit_ms", 0), self.spec.get("max_nodes", 0))
+
+    def observe(self, move: tuple[int, int]):
+        if self.spec.get("reuse_tree", True):
+            self.tree.AdvanceRoot(move)
+
+
+class PythonEngine:
+    """
+    python MonteCarloTreeSearch, a new tree is built for every move.
+    spec keys (all optional): iter_steps, transposition_table_size, progressive_widening, batch_size.
+    """
+    def __init__(self, spec: dict, seed: int) -> None:
+        self.spec = spec
+        self.seed = seed
+
+    def new_game(self, board_state: np.ndarray, stone_id: int):
+        random.seed(self.seed)
+        np.random.seed(self.seed % 2**32)
+        self.stone_id = stone_id
+
+    def get_move(self, board_state: np.ndarray):
+        from .monte_carlo_tree_search import MonteCarloTreeSearch
+        tree = MonteCarloTreeSearch(board_state, self.stone_id,
+                                    self.spec.get("transposition_table_size", 1 << 18),
+                                    self.spec.get("progressive_widening", False),
+                                    batch_size=self.spec.get("batch_size", 8))
+        return tree.search_move(self.spec.get("iter_steps", 1000))
+
+    def observe(self, move: tuple[int, int]):
+        pass
+
+
+ENGINES = {
+    "cpp": CppEngine,
+    "python": PythonEngine,
+}
+
+
+def make_engine(spec: dict, seed: int):
+    return ENGINES[spec.get("engine", "cpp")](spec, seed)
+
+
+def play_game(game_index: int, engine_a: dict, engine_b: dict, board_size: int, seed: int):
+    """
+    Play one game, engine A takes the role of the player in Game: its stone is 1 + who_first.
+    Return: dict of the game result, winner is "A", "B" or None for a draw.
+    """
+    who_first = game_index % 2
+    stone_a = 1 + who_first
+    players = {stone_a: make_engine(engine_a, seed * 2), 3 - stone_a: make_engine(engine_b, seed * 2 + 1)}
+    board = BitBoard(board_size)
+    empty_state = np.zeros((board_size, board_size), dtype=np.int32)
+    for stone_id, engine in players.items():
+        engine.new_game(empty_state, stone_id)
+
+    time1 = time.time()
+    stone_id = 1
+    result = 0
+    while result == 0:
+        move = players[stone_id].get_move(board.to_numpy(np.int32))
+        move = (int(move[0]), int(move[1]))
+        if move[0] < 0 or board.at(*move) != 0:
+            raise RuntimeError(f"engine of stone {stone_id} made an illegal move {move}")
+        board.place(*move, stone_id)
+        for engine in players.values():
+            engine.observe(move)
+        result = board.check_is_game_end(move)
+        if result == 0:
+            stone_id = 3 - stone_id
+    winner = None
+    if result == 1:
+        winner = "A" if stone_id == stone_a else "B"
+    return {"game": game_index, "who_first": who_first, "winner": winner,
+            "moves": [list(m) for m in board.moves], "seconds": time.time() - time1}
+
+
+def elo_estimate(wins: int, draws: int, losses: int, z: float = 1.96):
+    """
+    Elo difference from the score of A, with the Wilson interval of the score converted to Elo.
+    Unlike the normal approximation, the interval doesn't collapse for a score of 0 or 1.
+    Return: (score, elo, elo_lower, elo_upper), None where the Elo is unbounded: elo for a
+    score of 0 or 1, the lower bound for a score of 0, the upper one for 1, both without games.
+    """
+    n = wins + draws + losses
+    if n == 0:
+        return 0.5, 0.0, None, None
+    score = (wins + 0.5 * draws) / n
+    denom = 1 + z * z / n
+    center = (score + z * z / (2 * n)) / denom
+    margin = z / denom * math.sqrt(score * (1 - score) / n + z * z / (4 * n * n))
+
+    def to_elo(s: float):
+        if s <= 1e-12 or s >= 1 - 1e-12:
+            return None
+        return -400 * math.log10(1 / s - 1)
+    return score, to_elo(score), to_elo(center - margin), to_elo(center + margin)
+
+
+def format_elo(elo: float | None):
+    return "n/a" if elo is None else f"{elo:+.0f}"
+
+
+def silence_output():
+    """
+    Pool initializer, engines print search progress from C++, which would flood the arena output.
+    """
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+
+
+def run_arena(engine_a: dict, engine_b: dict, num_games: int, board_size: int = 15,
+              workers: int | None = None, seed: int = 0, output: str | None = None, verbose: bool = True):
+    """
+    Play num_games games on a process pool.
+    Return: summary dict with wins / draws / losses of A, score, Elo and games per hour.
+    """
+    wins = draws = losses = 0
+    time1 = time.time()
+    out_file = open(output, "w") if output is not None else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=silence_output) as pool:
+            futures = [pool.submit(play_game, i, engine_a, engine_b, board_size, seed + i)
+                       for i in range(num_games)]
+            for done, future in enumerate(as_completed(futures), 1):
+                res = future.result()
+                if res["winner"] == "A":
+                    wins += 1
+                elif res["winner"] == "B":
+                    losses += 1
+                else:
+                    draws += 1
+                if out_file is not None:
+                    out_file.write(json.dumps(res) + "\n")
+                    out_file.flush()
+                if verbose:
+                    score, elo, low, high = elo_estimate(wins, draws, losses)
+                    print(f"[{done}/{num_games}] game {res['game']}: winner {res['winner']}, "
+                          f"{len(res['moves'])} moves | A +{wins} ={draws} -{losses} "
+                          f"score {score:.3f} elo {format_elo(elo)} [{format_elo(low)}, {format_elo(high)}]", flush=True)
+    finally:
+        if out_file is not None:
+            out_file.close()
+
+    elapsed = time.time() - time1
+    score, elo, low, high = elo_estimate(wins, draws, losses)
+    return {"games": num_games, "wins": wins, "draws": draws, "losses": losses,
+            "score": score, "elo": elo, "elo_95_lower": low, "elo_95_upper": high,
+            "games_per_hour": num_games / elapsed * 3600, "seconds": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play engine A against engine B headlessly.")
+    parser.add_argument("--engine-a", type=json.loads, default={"engine": "cpp"}, help="JSON spec of engine A")
+    parser.add_argument("--engine-b", type=json.loads, default={"engine": "cpp"}, help="JSON spec of engine B")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--board-size", type=int, default=15)
+    parser.add_argument("--workers", type=int, default=None, help="processes, default cpu count")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON lines file receiving every finished game")
+    args = parser.parse_args()
+
+    summary = run_arena(args.engine_a, args.engine_b, args.games, args.board_size,
+                        args.workers, args.seed, args.output)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import numpy as np
+
+_MAX_SIZE = 32
+
+
+def _zobrist_keys():
+    """
+    Random keys of stones, same as BitBoard::ZobristKey in src/cpp/bit_board.h.
+    """
+    mask = (1 << 64) - 1
+    state = 0x5eed5eed5eed5eed
+    keys = []
+    for _ in range(2 * _MAX_SIZE * _MAX_SIZE):
+        # splitmix64
+        state = (state + 0x9e3779b97f4a7c15) & mask
+        z = state
+        z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & mask
+        z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & mask
+        keys.append(z ^ (z >> 31))
+    return keys
+
+
+_ZOBRIST_KEYS = _zobrist_keys()
+
+
+def zobrist_key(pos_x: int, pos_y: int, stone_id: int):
+    return _ZOBRIST_KEYS[((stone_id - 1) * _MAX_SIZE + pos_x) * _MAX_SIZE + pos_y]
+
+
+def _has_five(mask: int):
+    return (mask & (mask >> 1) & (mask >> 2) & (mask >> 3) & (mask >> 4)) != 0
+
+
+class BitBoard:
+    """
+    Gomoku board packed into per-line bit masks of each stone, python port of src/cpp/bit_board.h.
+    A five through the last move is found with a few shifts and ands, and placed stones
+    are kept on a move stack, thus place/undo are O(1). self.hash is the Zobrist hash of the position.
+    Board cells: 0 -> empty, 1 -> black stone, 2 -> white stone.
+    """
+    def __init__(self, board_size: int) -> None:
+        n = board_size
+        self.board_size = n
+        self.cells = [0] * (n * n) # cell (x, y) at index x * n + y
+        self.moves: list[tuple[int, int]] = []
+        self.hash = 0
+        # [stone_id][line index], bit k is the k-th cell along the line, index 0 is unused.
+        self.rows = [[0] * n for _ in range(3)]                  # row x, bit y
+        self.cols = [[0] * n for _ in range(3)]                  # column y, bit x
+        self.diags = [[0] * (2 * n - 1) for _ in range(3)]       # direction [+1, +1], index x - y + n - 1, bit x
+        self.anti_diags = [[0] * (2 * n - 1) for _ in range(3)]  # direction [+1, -1], index x + y, bit x
+
+    @classmethod
+    def from_state(cls, state: np.ndarray):
+        board = cls(state.shape[0])
+        for pos_x, pos_y in np.argwhere(state != 0):
+            board.place(int(pos_x), int(pos_y), int(state[pos_x, pos_y]))
+        return board
+
+    @property
+    def stone_count(self):
+        return len(self.moves)
+
+    def at(self, pos_x: int, pos_y: int):
+        return self.cells[pos_x * self.board_size + pos_y]
+
+    def is_full(self):
+        return len(self.moves) == self.board_size * self.board_size
+
+    def place(self, pos_x: int, pos_y: int, stone_id: int):
+        self.cells[pos_x * self.board_size + pos_y] = stone_id
+        self.__toggle(pos_x, pos_y, stone_id)
+        self.moves.append((pos_x, pos_y))
+
+    def undo(self):
+        pos_x, pos_y = self.moves.pop()
+        idx = pos_x * self.board_size + pos_y
+        self.__toggle(pos_x, pos_y, self.cells[idx])
+        self.cells[idx] = 0
+
+    def undo_to(self, num_moves: int):
+        """
+        Undo moves until only num_moves moves are left on the stack.
+        """
+        while len(self.moves) > num_moves:
+            self.undo()
+
+    def is_five(self, pos_x: int, pos_y: int):
+        s = self.cells[pos_x * self.board_size + pos_y]
+        if s == 0:
+            return False
+        return _has_five(self.rows[s][pos_x]) or _has_five(self.cols[s][pos_y]) or \
+            _has_five(self.diags[s][pos_x - pos_y + self.board_size - 1]) or \
+            _has_five(self.anti_diags[s][pos_x + pos_y])
+
+    def check_is_game_end(self, last_move_pos: tuple[int, int]):
+        """
+        Return: 0: not end; 1: win; 2. fair
+        """
+        if self.is_five(*last_move_pos):
+            return 1
+        return 2 if self.is_full() else 0
+
+    def empty_places(self):
+        n = self.board_size
+        return [(idx // n, idx % n) for idx, cell in enumerate(self.cells) if cell == 0]
+
+    def to_numpy(self, dtype=np.int8):
+        return np.array(self.cells, dtype=dtype).reshape(self.board_size, self.board_size)
+
+    def __toggle(self, pos_x: int, pos_y: int, stone_id: int):
+        self.rows[stone_id][pos_x] ^= 1 << pos_y
+        self.cols[stone_id][pos_y] ^= 1 << pos_x
+        self.diags[stone_id][pos_x - pos_y + self.board_size - 1] ^= 1 << pos_x
+        self.anti_diags[stone_id][pos_x + pos_y] ^= 1 << pos_x
+        self.hash ^= zobrist_key(pos_x, pos_y, stone_id)
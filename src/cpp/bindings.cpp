@@ -3,25 +3,161 @@
 #include <pybind11/stl.h>
 #include "monte_carlo_tree_search.h"
 
+#include <algorithm>
+#include <thread>
+
 namespace py = pybind11;
 
+namespace {
+
+template <typename T>
+py::array_t<T> ToNumpy(const std::vector<T> &data, std::vector<py::ssize_t> shape)
+{
+    py::array_t<T> array(shape);
+    std::copy(data.begin(), data.end(), array.mutable_data());
+    return array;
+}
+
+py::dict BatchSearchMove(const py::array_t<int, py::array::c_style | py::array::forcecast> &boards,
+     const py::array_t<int, py::array::c_style | py::array::forcecast> &stone_ids,
+     const MonteCarloTreeSearch::SearchConfig &config, int num_threads)
+{
+     if (boards.ndim() != 3 || boards.shape(1) != boards.shape(2)) {
+          throw std::invalid_argument("boards should be of shape (B, N, N)");
+     }
+     const py::ssize_t num_states = boards.shape(0);
+     const py::ssize_t board_sz = boards.shape(1);
+     if (stone_ids.size() != 1 && stone_ids.size() != num_states) {
+          throw std::invalid_argument("stone_ids should be a single id or one id for each board");
+     }
+     auto buf = boards.unchecked<3>();
+     std::vector<MonteCarloTreeSearch::StateType> states(num_states,
+          MonteCarloTreeSearch::StateType(board_sz, std::vector<int>(board_sz)));
+     std::vector<int> ids(num_states);
+     for (py::ssize_t b = 0; b < num_states; ++b) {
+          for (py::ssize_t i = 0; i < board_sz; ++i) {
+               for (py::ssize_t j = 0; j < board_sz; ++j) {
+                    states[b][i][j] = buf(b, i, j);
+               }
+          }
+          ids[b] = stone_ids.data()[stone_ids.size() == 1 ? 0 : b];
+     }
+     if (num_threads <= 0) {
+          num_threads = std::max(1u, std::thread::hardware_concurrency());
+     }
+
+     MonteCarloTreeSearch::BatchSearchResult res;
+     {
+          py::gil_scoped_release gil_release;
+          res = MonteCarloTreeSearch::BatchSearchMove(states, ids, config, num_threads);
+     }
+     py::dict out;
+     out["best_moves"] = ToNumpy(res.best_moves, {num_states, 2});
+     out["win_rounds"] = ToNumpy(res.win_rounds, {num_states});
+     out["total_rounds"] = ToNumpy(res.total_rounds, {num_states});
+     out["iterations"] = ToNumpy(res.iterations, {num_states});
+     out["visits"] = ToNumpy(res.visits, {num_states, board_sz, board_sz});
+     return out;
+}
+
+/**
+ * Read-only (N, N) array viewing data, which is kept alive by owner.
+ */
+template <typename T>
+py::array_t<T> BoardView(const T *data, int board_sz, const std::shared_ptr<const void> &owner)
+{
+     py::capsule base(new std::shared_ptr<const void>(owner),
+          [](void *p) { delete static_cast<std::shared_ptr<const void> *>(p); });
+     py::array_t<T> array({board_sz, board_sz}, data, base);
+     py::detail::array_proxy(array.ptr())->flags &= ~py::detail::npy_api::NPY_ARRAY_WRITEABLE_;
+     return array;
+}
+
+}
+
 PYBIND11_MODULE(py_MCTS, m) {
      py::class_<MonteCarloTreeSearch>(m, "MonteCarloTreeSearch",
           "Monte Carlo Tree Search object: used to search for the best move in Gomoku.")
+          .def(py::init<const py::array&, int>(),
+               py::arg("root_state"), py::arg("stone_id"),
+               "Constructor: root_state is the numpy array of board state, stone_id indicates current player's stone ID: 1->black; 2->white. int8, uint8 and int32 arrays are read in place without conversion.")
           .def(py::init<const py::array_t<int>&, int>(),
                py::arg("root_state"), py::arg("stone_id"),
-               "Constructor: root_state is the numpy array of board state, stone_id indicates current player's stone ID: 1->black; 2->white.")
+               "Constructor from a nested list or another array-like of board state.")
           // public data members (read/write)
           .def_readwrite("near_playout_policy_distance", &MonteCarloTreeSearch::near_playout_policy_distance)
           .def_readwrite("playout_policy", &MonteCarloTreeSearch::playout_policy)
+          .def_readwrite("num_threads", &MonteCarloTreeSearch::num_threads,
+               "Number of worker threads running tree-parallel search in SearchMove, default 1.")
+          .def_readwrite("virtual_loss", &MonteCarloTreeSearch::virtual_loss,
+               "Visits counted as losses on nodes of an in-flight path, used only when num_threads > 1.")
+          .def_readwrite("random_seed", &MonteCarloTreeSearch::random_seed,
+               "Seed of the random streams, each worker thread derives its own stream from it.")
+          .def_readwrite("transposition_table_size", &MonteCarloTreeSearch::transposition_table_size,
+               "Entries of the transposition table sharing nodes of positions reached by different move orders, 0 disables it. Default 1 << 20.")
+          .def_readwrite("progressive_widening", &MonteCarloTreeSearch::progressive_widening,
+               "Create children on demand as a node gains visits (progressive widening) instead of all at once when it is expanded, default False.")
+          .def_readwrite("widening_coef", &MonteCarloTreeSearch::widening_coef,
+               "With progressive widening, a node visited n times may have ceil(widening_coef * n ** widening_exponent) children. Default 2.0.")
+          .def_readwrite("widening_exponent", &MonteCarloTreeSearch::widening_exponent,
+               "See widening_coef, default 0.5.")
+          .def_readwrite("widening_prior", &MonteCarloTreeSearch::widening_prior,
+               "With progressive widening, create children best first by a prior favouring places near many stones, default True. If False, the order is pseudo-random.")
+          .def_readwrite("node_budget", &MonteCarloTreeSearch::node_budget,
+               "Most nodes the tree may hold during SearchMove, 0 for unlimited (default). When reached, the least visited subtrees are collapsed into their roots, whose statistics already include them, and their nodes are reused by new expansions; the search goes on. The transposition table is then capped at 2 * node_budget entries. May be exceeded by about one expansion per thread.")
+          .def_readwrite("early_stop", &MonteCarloTreeSearch::early_stop,
+               "Stop SearchMove once the most visited root child can't be overtaken within the remaining budget, default True.")
+          .def_readonly("last_search_iterations", &MonteCarloTreeSearch::last_search_iterations,
+               "Number of iterations run by the last SearchMove.")
+          .def_readonly("last_search_rollouts", &MonteCarloTreeSearch::last_search_rollouts,
+               "Number of rollouts run by the last SearchMove, iterations ending at a decided game run none.")
+          .def_property("stop_search",
+               [](const MonteCarloTreeSearch &self) { return self.stop_search.load(); },
+               [](MonteCarloTreeSearch &self, bool value) { self.stop_search.store(value); },
+               "Set to True from another thread to make a running SearchMove return early, cleared when SearchMove returns.")
+          .def_readwrite("verbose", &MonteCarloTreeSearch::verbose,
+               "Show a progress bar and print statistics of root children in SearchMove, default False.")
+          .def_readonly("last_search_stats", &MonteCarloTreeSearch::last_search_stats,
+               "SearchStats of the last SearchMove.")
           .def("SearchMove", &MonteCarloTreeSearch::SearchMove, py::arg("iter_steps") = 5000,
-               "Run MCTS search and return the best move.\nParameters: iter_steps (optional) - number of iteration steps, default 5000.\nReturn value: position or action representation of the best move.")
-          .def("Selection", &MonteCarloTreeSearch::Selection,
-               "Selection phase: Select nodes to expand from root node downward according to UCT policy.\nReturns: Selected node (or its index/pointer).")
-          .def("Expansion", &MonteCarloTreeSearch::Expansion,
+               py::arg("time_limit_ms") = 0, py::arg("max_nodes") = 0,
+               "Run MCTS search and return the best move found within the budget.\nParameters: iter_steps (optional) - number of iteration steps, default 5000; time_limit_ms (optional) - wall-clock budget in milliseconds; max_nodes (optional) - cap on tree nodes. A budget <= 0 is unlimited, at least one must be positive.\nReturn value: position or action representation of the best move.")
+          .def("AdvanceRoot", &MonteCarloTreeSearch::AdvanceRoot, py::arg("move"),
+               "Promote the child reached by move to be the new root, keeping its subtree statistics.\nReturn value: True if the subtree was reused, False if a fresh root was created.")
+          .def("SaveTree", &MonteCarloTreeSearch::SaveTree, py::arg("path"), py::arg("max_nodes") = 0,
+               "Write root board and the search tree under root to a binary file. With max_nodes > 0, only the most visited part of the tree holding max_nodes nodes is kept. Must not be called while SearchMove runs.")
+          .def("LoadTree", &MonteCarloTreeSearch::LoadTree, py::arg("path"),
+               "Replace root board and search tree by those of a file written by SaveTree, the next SearchMove resumes from the loaded statistics. The file is memory-mapped while the tree is built.")
+          .def_static("FromTreeFile", &MonteCarloTreeSearch::FromTreeFile, py::arg("path"),
+               "Return a MonteCarloTreeSearch loaded from a file written by SaveTree.")
+          .def("Selection", py::overload_cast<>(&MonteCarloTreeSearch::Selection),
+               "Selection phase: Select nodes to expand from root node downward according to UCT policy.\nReturns: index of selected node, -1 if the reached leaf ends the game.")
+          .def("Expansion", py::overload_cast<int>(&MonteCarloTreeSearch::Expansion), py::arg("leaf"),
                "Expansion phase: Generate child nodes (possible moves) for the selected node.")
-          .def("BackPropagation", &MonteCarloTreeSearch::BackPropagation,
+          .def("BackPropagation", py::overload_cast<int, int, int>(&MonteCarloTreeSearch::BackPropagation),
+               py::arg("node"), py::arg("leaf_stone_id"), py::arg("game_res"),
                "Backpropagation phase: Propagate simulation/game result back to root node, updating win/loss statistics and visit counts for passed nodes.")
+          .def_readonly("root", &MonteCarloTreeSearch::root, "Index of root node.")
+          .def("GetNode", &MonteCarloTreeSearch::GetNode, py::arg("index"),
+               "Return a snapshot of the node at index.")
+          .def("GetRootChildren", &MonteCarloTreeSearch::GetRootChildren,
+               "Return snapshots of the children of root node.")
+          .def("GetRootStats", [](MonteCarloTreeSearch &self) {
+                    auto stats = self.UpdateRootStats();
+                    const int board_sz = stats->board_size;
+                    py::dict d;
+                    d["visits"] = BoardView(stats->visits.data(), board_sz, stats);
+                    d["win_rates"] = BoardView(stats->win_rates.data(), board_sz, stats);
+                    d["ucb"] = BoardView(stats->ucb.data(), board_sz, stats);
+                    return d;
+               },
+               "Return statistics of root children as read-only (N, N) numpy arrays sharing memory with the tree: visits (int32), win_rates and ucb (float32) from the view of the player to move. Cells without a root child hold 0 visits and NaN. Arrays are refreshed in place by the next GetRootStats call.")
+          .def("GetNodeState", &MonteCarloTreeSearch::GetNodeState, py::arg("index"),
+               "Rebuild the board state at node index by replaying moves from root.")
+          .def("GetMemoryUsage", &MonteCarloTreeSearch::GetMemoryUsage,
+               "Bytes held by the node arena.")
+          .def("GetTranspositionTableSize", &MonteCarloTreeSearch::GetTranspositionTableSize,
+               "Number of positions stored in the transposition table.")
           .def("GetTreeNodesNumbers", &MonteCarloTreeSearch::GetTreeNodesNumbers,
                "Get numbers of nodes in tree")
           .def("GetTreeDepth", &MonteCarloTreeSearch::GetTreeDepth,
@@ -33,13 +169,98 @@ PYBIND11_MODULE(py_MCTS, m) {
      py::enum_<MonteCarloTreeSearch::PlayoutPolicy>(m, "PlayoutPolicy")
           .value("UniformPlayout", MonteCarloTreeSearch::PlayoutPolicy::UniformPlayout)
           .value("NearPlacePlayout", MonteCarloTreeSearch::PlayoutPolicy::NearPlacePlayout)
+          .value("ThreatPlayout", MonteCarloTreeSearch::PlayoutPolicy::ThreatPlayout)
           .export_values();
+
+     m.def("BatchSearchMove",
+          [](const py::array_t<int, py::array::c_style | py::array::forcecast> &boards,
+             const py::array_t<int, py::array::c_style | py::array::forcecast> &stone_ids,
+             int iter_steps, double time_limit_ms, int max_nodes, int num_threads,
+             MonteCarloTreeSearch::PlayoutPolicy playout_policy, int near_playout_policy_distance,
+             bool early_stop, int transposition_table_size, bool progressive_widening, double widening_coef,
+             double widening_exponent, py::object random_seed, int node_budget) {
+               MonteCarloTreeSearch::SearchConfig config;
+               config.iter_steps = iter_steps;
+               config.time_limit_ms = time_limit_ms;
+               config.max_nodes = max_nodes;
+               config.playout_policy = playout_policy;
+               config.near_playout_policy_distance = near_playout_policy_distance;
+               config.early_stop = early_stop;
+               config.transposition_table_size = transposition_table_size;
+               config.progressive_widening = progressive_widening;
+               config.widening_coef = widening_coef;
+               config.widening_exponent = widening_exponent;
+               config.node_budget = node_budget;
+               config.random_seed = random_seed.is_none() ? std::random_device{}() : random_seed.cast<unsigned int>();
+               return BatchSearchMove(boards, stone_ids, config, num_threads);
+          },
+          py::arg("boards"), py::arg("stone_ids"), py::arg("iter_steps") = 5000, py::arg("time_limit_ms") = 0,
+          py::arg("max_nodes") = 0, py::arg("num_threads") = 0,
+          py::arg("playout_policy") = MonteCarloTreeSearch::PlayoutPolicy::NearPlacePlayout,
+          py::arg("near_playout_policy_distance") = 2, py::arg("early_stop") = true,
+          py::arg("transposition_table_size") = 1 << 20, py::arg("progressive_widening") = false,
+          py::arg("widening_coef") = 2.0, py::arg("widening_exponent") = 0.5,
+          py::arg("random_seed") = py::none(), py::arg("node_budget") = 0,
+          "Search many positions at once, each with its own tree, on num_threads native threads (0 -> all cores) without holding the GIL.\nParameters: boards - (B, N, N) array or list of board states; stone_ids - id to move of each board, or a single id for all; budgets and policy as in MonteCarloTreeSearch.\nReturn value: dict of numpy arrays: best_moves (B, 2), win_rounds (B,) and total_rounds (B,) of the best move, iterations (B,), visits (B, N, N) total rounds of each root child. best_moves is -1 for full boards.");
     
-     py::class_<MonteCarloTreeSearch::TreeNode>(m, "TreeNode")
-          .def_readonly("state", &MonteCarloTreeSearch::TreeNode::state)
-          .def_readonly("parent", &MonteCarloTreeSearch::TreeNode::parent)
-          .def_readonly("stone_id", &MonteCarloTreeSearch::TreeNode::stone_id)
-          .def_readonly("from_moving", &MonteCarloTreeSearch::TreeNode::from_moving)
-          .def_readonly("win_rounds", &MonteCarloTreeSearch::TreeNode::win_rounds)
-          .def_readonly("total_rounds", &MonteCarloTreeSearch::TreeNode::total_rounds);
+     using SearchStats = MonteCarloTreeSearch::SearchStats;
+     py::class_<SearchStats>(m, "SearchStats",
+          "Counters of a search. Times are in seconds; phase times are summed over worker threads.")
+          .def_readonly("iterations", &SearchStats::iterations)
+          .def_readonly("selection_count", &SearchStats::selection_count)
+          .def_readonly("expansion_count", &SearchStats::expansion_count)
+          .def_readonly("rollout_count", &SearchStats::rollout_count)
+          .def_readonly("backprop_count", &SearchStats::backprop_count)
+          .def_readonly("selection_time", &SearchStats::selection_time)
+          .def_readonly("expansion_time", &SearchStats::expansion_time)
+          .def_readonly("rollout_time", &SearchStats::rollout_time)
+          .def_readonly("backprop_time", &SearchStats::backprop_time)
+          .def_readonly("total_time", &SearchStats::total_time, "Wall-clock seconds of the whole search.")
+          .def_readonly("rollout_moves", &SearchStats::rollout_moves, "Stones placed by all rollouts.")
+          .def_property_readonly("average_rollout_length", &SearchStats::AverageRolloutLength)
+          .def_readonly("terminal_hits", &SearchStats::terminal_hits,
+               "Iterations whose selected node already ends the game, no rollout is run for them.")
+          .def_readonly("nodes_allocated", &SearchStats::nodes_allocated)
+          .def_readonly("evictions", &SearchStats::evictions,
+               "Times the tree was shrunk for reaching node_budget.")
+          .def_readonly("nodes_evicted", &SearchStats::nodes_evicted,
+               "Nodes given back to the arena by those evictions.")
+          .def_readonly("peak_memory_bytes", &SearchStats::peak_memory_bytes,
+               "Bytes held by the node arena and the transposition table at the end of the search.")
+          .def("ToDict", [](const SearchStats &self) {
+               py::dict d;
+               d["iterations"] = self.iterations;
+               d["selection_count"] = self.selection_count;
+               d["expansion_count"] = self.expansion_count;
+               d["rollout_count"] = self.rollout_count;
+               d["backprop_count"] = self.backprop_count;
+               d["selection_time"] = self.selection_time;
+               d["expansion_time"] = self.expansion_time;
+               d["rollout_time"] = self.rollout_time;
+               d["backprop_time"] = self.backprop_time;
+               d["total_time"] = self.total_time;
+               d["rollout_moves"] = self.rollout_moves;
+               d["average_rollout_length"] = self.AverageRolloutLength();
+               d["terminal_hits"] = self.terminal_hits;
+               d["nodes_allocated"] = self.nodes_allocated;
+               d["evictions"] = self.evictions;
+               d["nodes_evicted"] = self.nodes_evicted;
+               d["peak_memory_bytes"] = self.peak_memory_bytes;
+               return d;
+          }, "Return the counters as a dict, e.g. to export them to telemetry.");
+
+     py::class_<MonteCarloTreeSearch::NodeInfo>(m, "TreeNode")
+          .def_readonly("index", &MonteCarloTreeSearch::NodeInfo::index)
+          .def_readonly("canonical", &MonteCarloTreeSearch::NodeInfo::canonical,
+               "Node holding statistics and children, differs from index when the node is a transposition.")
+          .def_readonly("parent", &MonteCarloTreeSearch::NodeInfo::parent)
+          .def_readonly("stone_id", &MonteCarloTreeSearch::NodeInfo::stone_id)
+          .def_readonly("from_moving", &MonteCarloTreeSearch::NodeInfo::from_moving)
+          .def_readonly("win_rounds", &MonteCarloTreeSearch::NodeInfo::win_rounds)
+          .def_readonly("total_rounds", &MonteCarloTreeSearch::NodeInfo::total_rounds)
+          .def_readonly("first_child", &MonteCarloTreeSearch::NodeInfo::first_child,
+               "Head of the children list, -1 if there is none.")
+          .def_readonly("next_sibling", &MonteCarloTreeSearch::NodeInfo::next_sibling,
+               "Next child of the same parent, -1 for the last one.")
+          .def_readonly("num_children", &MonteCarloTreeSearch::NodeInfo::num_children);
 }
\ No newline at end of file
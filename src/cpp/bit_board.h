@@ -0,0 +1,366 @@
+#ifndef __BIT_BOARD_H__
+#define __BIT_BOARD_H__
+
+#include <algorithm>
+#include <array>
+#include <bitset>
+#include <cstdint>
+#include <cstdlib>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+/**
+ * Gomoku board packed into per-line bit masks of each stone.
+ * Every row, column, diagonal and anti-diagonal of a stone is one uint32_t, so a five
+ * through the last move is found with a few shifts and ands. Placed stones are kept on
+ * a move stack, thus Place/Undo are O(1) and a search can unwind to any earlier position.
+ * A Zobrist hash of the position is updated along with the masks.
+ * With SetNearDistance(d), the empty cells within distance d of a stone (the candidate moves
+ * of NearPlacePlayout) are also kept up to date, so copies of the board and the positions
+ * reached from it by Place inherit them instead of rescanning the board.
+ * Board cells: 0 -> empty, 1 -> black stone, 2 -> white stone.
+ */
+class BitBoard {
+public:
+    static constexpr int kMaxSize = 32;
+
+    explicit BitBoard(int board_size = 15) : board_size_{board_size} {
+        if (board_size <= 0 || board_size > kMaxSize) {
+            throw std::invalid_argument("board size should be in [1, 32]");
+        }
+        moves_.reserve(board_size * board_size);
+    }
+
+    template <typename StateType>
+    static BitBoard FromState(const StateType &state) {
+        return FromCells(state.size(), [&state](int i, int j) { return state[i][j]; });
+    }
+
+    /**
+     * @return: board whose cell (i, j) holds cell(i, j), e.g. read straight from a NumPy buffer.
+     * Throws std::invalid_argument for a cell other than 0, 1 and 2.
+     */
+    template <typename CellFunc>
+    static BitBoard FromCells(int board_size, CellFunc &&cell) {
+        BitBoard board(board_size);
+        for (int i = 0; i < board_size; ++i) {
+            for (int j = 0; j < board_size; ++j) {
+                int stone_id = cell(i, j);
+                if (stone_id < 0 || stone_id > 2) {
+                    throw std::invalid_argument("board cells should be 0 (empty), 1 or 2, got " +
+                                                std::to_string(stone_id));
+                }
+                if (stone_id != 0) {
+                    board.Place(i, j, stone_id);
+                }
+            }
+        }
+        return board;
+    }
+
+    int Size() const {
+        return board_size_;
+    }
+
+    int At(int pos_x, int pos_y) const {
+        return cells_[pos_x * kMaxSize + pos_y];
+    }
+
+    bool IsEmpty(int pos_x, int pos_y) const {
+        return cells_[pos_x * kMaxSize + pos_y] == 0;
+    }
+
+    int StoneCount() const {
+        return moves_.size();
+    }
+
+    int NumMoves() const {
+        return moves_.size();
+    }
+
+    bool IsFull() const {
+        return StoneCount() == board_size_ * board_size_;
+    }
+
+    /**
+     * @return: Zobrist hash of the position, xor of ZobristKey of every stone.
+     */
+    std::uint64_t Hash() const {
+        return hash_;
+    }
+
+    /**
+     * Random key of a stone at (pos_x, pos_y), fixed across runs (and equal to bit_board.py).
+     */
+    static std::uint64_t ZobristKey(int pos_x, int pos_y, int stone_id) {
+        static const auto keys = [] {
+            std::array<std::uint64_t, 2 * kMaxSize * kMaxSize> k{};
+            std::uint64_t state = 0x5eed5eed5eed5eedULL;
+            for (auto &key : k) {
+                // splitmix64
+                std::uint64_t z = (state += 0x9e3779b97f4a7c15ULL);
+                z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+                z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+                key = z ^ (z >> 31);
+            }
+            return k;
+        }();
+        return keys[((stone_id - 1) * kMaxSize + pos_x) * kMaxSize + pos_y];
+    }
+
+    void Place(int pos_x, int pos_y, int stone_id) {
+        cells_[pos_x * kMaxSize + pos_y] = stone_id;
+        Toggle(pos_x, pos_y, stone_id);
+        moves_.push_back(Move{static_cast<std::int8_t>(pos_x), static_cast<std::int8_t>(pos_y)});
+        if (near_distance_ > 0) {
+            UpdateNear(pos_x, pos_y, 1);
+        }
+    }
+
+    void Undo() {
+        Move m = moves_.back();
+        moves_.pop_back();
+        Toggle(m.x, m.y, cells_[m.x * kMaxSize + m.y]);
+        cells_[m.x * kMaxSize + m.y] = 0;
+        if (near_distance_ > 0) {
+            UpdateNear(m.x, m.y, -1);
+        }
+    }
+
+    /**
+     * Undo moves until only `num_moves` moves are left on the stack.
+     */
+    void UndoTo(int num_moves) {
+        while (static_cast<int>(moves_.size()) > num_moves) {
+            Undo();
+        }
+    }
+
+    /**
+     * @return: true if the stone at (pos_x, pos_y) is part of five or more in a row.
+     */
+    bool IsFive(int pos_x, int pos_y) const {
+        const int s = cells_[pos_x * kMaxSize + pos_y] - 1;
+        if (s < 0) {
+            return false;
+        }
+        return HasFive(rows_[s][pos_x]) || HasFive(cols_[s][pos_y]) ||
+               HasFive(diags_[s][pos_x - pos_y + board_size_ - 1]) ||
+               HasFive(anti_diags_[s][pos_x + pos_y]);
+    }
+
+    /**
+     * @return: 0 -> not end; 1 -> stone at last_move_pos wins; 2 -> game draw.
+     */
+    int CheckIsGameEnd(const std::pair<int, int> &last_move_pos) const {
+        if (IsFive(last_move_pos.first, last_move_pos.second)) {
+            return 1;
+        }
+        return IsFull() ? 2 : 0;
+    }
+
+    /**
+     * Neighbours of (pos_x, pos_y) along a line, 4 cells on each side.
+     * @param direction: 0 -> row, 1 -> column, 2 -> diagonal [+1, +1], 3 -> anti-diagonal [+1, -1].
+     * @return: low byte marks stones of stone_id, high byte cells of the opponent or off the board.
+     * Bits 0..3 of each byte are cells -4..-1 along the line, bits 4..7 cells +1..+4.
+     */
+    std::uint16_t LineWindow(int pos_x, int pos_y, int direction, int stone_id) const {
+        const int s = stone_id - 1;
+        const int n = board_size_;
+        std::uint32_t own;
+        std::uint32_t opp;
+        int pos = pos_x; // bit of (pos_x, pos_y) in the line mask
+        int low = 0;     // valid bits of the line
+        int high = n - 1;
+        switch (direction) {
+        case 0:
+            own = rows_[s][pos_x];
+            opp = rows_[1 - s][pos_x];
+            pos = pos_y;
+            break;
+        case 1:
+            own = cols_[s][pos_y];
+            opp = cols_[1 - s][pos_y];
+            break;
+        case 2:
+            own = diags_[s][pos_x - pos_y + n - 1];
+            opp = diags_[1 - s][pos_x - pos_y + n - 1];
+            low = std::max(0, pos_x - pos_y);
+            high = std::min(n - 1, n - 1 + pos_x - pos_y);
+            break;
+        default:
+            own = anti_diags_[s][pos_x + pos_y];
+            opp = anti_diags_[1 - s][pos_x + pos_y];
+            low = std::max(0, pos_x + pos_y - n + 1);
+            high = std::min(n - 1, pos_x + pos_y);
+            break;
+        }
+        constexpr int kRadius = 4;
+        const std::uint64_t valid = (std::uint64_t{1} << (high + 1)) - (std::uint64_t{1} << low);
+        // shift by kRadius so that cells before the line start are blocked too.
+        const std::uint64_t own_line = std::uint64_t{own} << kRadius;
+        const std::uint64_t blocked_line = ((opp | ~valid) << kRadius) | ((1u << kRadius) - 1);
+        auto window = [&](std::uint64_t line) {
+            std::uint32_t w = (line >> pos) & 0x1FF; // cells pos - 4 .. pos + 4
+            return (w & 0xF) | ((w >> (kRadius + 1)) << kRadius);
+        };
+        return static_cast<std::uint16_t>(window(own_line) | window(blocked_line) << 8);
+    }
+
+    int NearDistance() const {
+        return near_distance_;
+    }
+
+    /**
+     * Track empty cells within `distance` (in both directions) of a stone, 0 stops tracking.
+     */
+    void SetNearDistance(int distance) {
+        distance = std::max(0, std::min(distance, kMaxSize));
+        if (distance == near_distance_) {
+            return;
+        }
+        near_distance_ = distance;
+        near_count_.fill(0);
+        near_rows_.fill(0);
+        if (distance > 0) {
+            for (const Move &m : moves_) {
+                UpdateNear(m.x, m.y, 1);
+            }
+        }
+    }
+
+    /**
+     * Needs SetNearDistance(d) with d > 0. On an empty board, cells within d of the center are given.
+     * @return: bit pos_y is set if (pos_x, pos_y) is empty and within NearDistance of a stone.
+     */
+    std::uint32_t NearEmptyMask(int pos_x) const {
+        if (moves_.empty()) {
+            const int center = board_size_ / 2;
+            return std::abs(pos_x - center) <= near_distance_ ? WindowMask(center) : 0;
+        }
+        return near_rows_[pos_x] & ~(rows_[0][pos_x] | rows_[1][pos_x]);
+    }
+
+    /**
+     * @return: number of cells of NearEmptyMask.
+     */
+    int NumNearEmpty() const {
+        int count = 0;
+        for (int i = 0; i < board_size_; ++i) {
+            count += std::bitset<32>(NearEmptyMask(i)).count();
+        }
+        return count;
+    }
+
+    /**
+     * @return: the k-th cell of NearEmptyMask in row-major order, k < NumNearEmpty().
+     */
+    std::pair<int, int> NearEmptyAt(int k) const {
+        for (int i = 0; i < board_size_; ++i) {
+            std::uint32_t mask = NearEmptyMask(i);
+            int count = std::bitset<32>(mask).count();
+            if (k < count) {
+                for (; k > 0; --k) {
+                    mask &= mask - 1;
+                }
+                return {i, LowestBit(mask)};
+            }
+            k -= count;
+        }
+        throw std::out_of_range("NearEmptyAt: k out of range");
+    }
+
+    /**
+     * Call func(pos_x, pos_y) on every cell of NearEmptyMask in row-major order.
+     */
+    template <typename Func>
+    void ForEachNearEmpty(Func &&func) const {
+        for (int i = 0; i < board_size_; ++i) {
+            for (std::uint32_t mask = NearEmptyMask(i); mask != 0; mask &= mask - 1) {
+                func(i, LowestBit(mask));
+            }
+        }
+    }
+
+    template <typename StateType = std::vector<std::vector<int>>>
+    StateType ToState() const {
+        StateType state(board_size_, typename StateType::value_type(board_size_));
+        for (int i = 0; i < board_size_; ++i) {
+            for (int j = 0; j < board_size_; ++j) {
+                state[i][j] = At(i, j);
+            }
+        }
+        return state;
+    }
+
+private:
+    struct Move {
+        std::int8_t x;
+        std::int8_t y;
+    };
+    using Lines = std::array<std::array<std::uint32_t, 2 * kMaxSize - 1>, 2>;
+
+    static bool HasFive(std::uint32_t m) {
+        return (m & (m >> 1) & (m >> 2) & (m >> 3) & (m >> 4)) != 0;
+    }
+
+    static int LowestBit(std::uint32_t m) {
+        return std::bitset<32>((m & (~m + 1)) - 1).count();
+    }
+
+    /**
+     * @return: bits of cells within near_distance_ of pos_y in a line of the board.
+     */
+    std::uint32_t WindowMask(int pos_y) const {
+        const int low = std::max(0, pos_y - near_distance_);
+        const int high = std::min(board_size_ - 1, pos_y + near_distance_);
+        return static_cast<std::uint32_t>((std::uint64_t{1} << (high + 1)) - (std::uint64_t{1} << low));
+    }
+
+    /**
+     * Add delta to the number of stones near each cell within near_distance_ of (pos_x, pos_y).
+     */
+    void UpdateNear(int pos_x, int pos_y, int delta) {
+        const int low_x = std::max(0, pos_x - near_distance_);
+        const int high_x = std::min(board_size_ - 1, pos_x + near_distance_);
+        const int low_y = std::max(0, pos_y - near_distance_);
+        const int high_y = std::min(board_size_ - 1, pos_y + near_distance_);
+        for (int i = low_x; i <= high_x; ++i) {
+            if (delta > 0) {
+                near_rows_[i] |= WindowMask(pos_y);
+            }
+            for (int j = low_y; j <= high_y; ++j) {
+                near_count_[i * kMaxSize + j] += delta;
+                if (near_count_[i * kMaxSize + j] == 0) {
+                    near_rows_[i] &= ~(1u << j);
+                }
+            }
+        }
+    }
+
+    void Toggle(int pos_x, int pos_y, int stone_id) {
+        const int s = stone_id - 1;
+        rows_[s][pos_x] ^= 1u << pos_y;
+        cols_[s][pos_y] ^= 1u << pos_x;
+        diags_[s][pos_x - pos_y + board_size_ - 1] ^= 1u << pos_x;
+        anti_diags_[s][pos_x + pos_y] ^= 1u << pos_x;
+        hash_ ^= ZobristKey(pos_x, pos_y, stone_id);
+    }
+
+    int board_size_;
+    std::array<std::int8_t, kMaxSize * kMaxSize> cells_{};
+    // [stone_id - 1][line index], bit k is the k-th cell along the line.
+    Lines rows_{};       // row pos_x, bit pos_y
+    Lines cols_{};       // column pos_y, bit pos_x
+    Lines diags_{};      // direction [+1, +1], index pos_x - pos_y + size - 1, bit pos_x
+    Lines anti_diags_{}; // direction [+1, -1], index pos_x + pos_y, bit pos_x
+    std::vector<Move> moves_;
+    std::uint64_t hash_ = 0;
+    int near_distance_ = 0;
+    std::array<std::uint16_t, kMaxSize * kMaxSize> near_count_{}; // stones within near_distance_ of each cell
+    std::array<std::uint32_t, kMaxSize> near_rows_{};              // bit pos_y of row pos_x: near_count_ > 0
+};
+
+#endif // __BIT_BOARD_H__
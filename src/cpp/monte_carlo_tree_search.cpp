@@ -1,421 +1,1295 @@
 #include "monte_carlo_tree_search.h"
+#include "threat_patterns.h"
 #include <pybind11/pybind11.h>
 #include "pgbar/ProgressBar.hpp"
 #include "pgbar/BlockBar.hpp"
 
 #include <algorithm>
 #include <iostream>
-#include <set>
 #include <chrono>
+#include <thread>
+#include <mutex>
+#include <condition_variable>
+#include <exception>
+#include <unordered_map>
+#include <tuple>
+#include <optional>
+#include <cstring>
 
 namespace {
 
-std::default_random_engine rand_engine;
+using RandEngine = MonteCarloTreeSearch::RandEngine;
+using Clock = std::chrono::steady_clock;
 
-bool IsBoardEmpty(const MonteCarloTreeSearch::StateType &state) {
-    const int board_sz = state.size();
-    for (int i = 0; i < board_sz; ++i) {
-        for (int j = 0; j < board_sz; ++j) {
-            if (state[i][j] != 0) {
-                return false;
-            }
-        }
-    }
-    return true;
+/**
+ * @return: seconds elapsed since `since`, which is then moved to now.
+ */
+double Lap(Clock::time_point &since)
+{
+    auto now = Clock::now();
+    double seconds = std::chrono::duration<double>(now - since).count();
+    since = now;
+    return seconds;
 }
 
 /**
- * @return: 0 -> not end; 1 -> stone_id win; 2 -> game draw.
+ * Stops the worker threads of a search between two iterations, so that one of them can
+ * change the tree while no other thread reads it.
  */
-int CheckIsGameEnd(const MonteCarloTreeSearch::StateType &state, const std::pair<int, int> &last_move_pos)
-{
-    const int board_sz = state.size();
-    // check any empty pos left.
-    bool no_empty = true;
-    for (int i = 0; i < board_sz; ++i) {
-        for (int j = 0; j < board_sz; ++j) {
-            if (state[i][j] == 0) {
-                no_empty = false;
-                break;
-            }
-        }
-        if (!no_empty) {
-            break;
-        }
-    }
-    if (no_empty) {
-        return 2;
+class SearchBarrier {
+public:
+    explicit SearchBarrier(int num_threads) : active_(num_threads) {
     }
 
-    auto [pos_x, pos_y] = last_move_pos;
-    int stone_id = state[pos_x][pos_y];
-    const int target_num = 5;
-    // check row
-    int count = 1;
-    for (int i = 1; i < target_num; ++i) {
-        if (pos_x + i >= board_sz || state[pos_x + i][pos_y] != stone_id) {
-            break;
-        }
-        ++count;
-    }
-    for (int i = 1; i < target_num; ++i) {
-        if (pos_x - i < 0 || state[pos_x - i][pos_y] != stone_id) {
-            break;
-        }
-        ++count;
+    /**
+     * Ask every thread to stop at its next Arrive.
+     */
+    void Request() {
+        requested_.store(true, std::memory_order_relaxed);
     }
-    if (count >= target_num) {
-        return 1;
+
+    bool Requested() const {
+        return requested_.load(std::memory_order_relaxed);
     }
 
-    // check col
-    count = 1;
-    for (int i = 1; i < target_num; ++i) {
-        if (pos_y + i >= board_sz || state[pos_x][pos_y+i] != stone_id) {
-            break;
+    /**
+     * Wait until the other active threads arrive or leave, the last one runs func.
+     */
+    void Arrive(const std::function<void()> &func) {
+        std::unique_lock<std::mutex> lock(mutex_);
+        if (!requested_.load(std::memory_order_relaxed)) {
+            return;
         }
-        ++count;
-    }
-    for (int i = 1; i < target_num; ++i) {
-        if (pos_y - i < 0 || state[pos_x][pos_y-i] != stone_id) {
-            break;
+        if (++arrived_ == active_) {
+            RunLocked(func);
+            return;
         }
-        ++count;
-    }
-    if (count >= target_num) {
-        return 1;
+        const int epoch = epoch_;
+        released_.wait(lock, [&]() { return epoch_ != epoch; });
     }
 
-    // check skew [1, 1]
-    count = 1;
-    for (int i = 1; i < target_num; ++i) {
-        if (pos_x+i>=board_sz || pos_y+i>=board_sz || state[pos_x+i][pos_y+i]!=stone_id) {
-            break;
+    /**
+     * A thread stops searching, func is run for the threads waiting on it.
+     */
+    void Leave(const std::function<void()> &func) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        --active_;
+        if (requested_.load(std::memory_order_relaxed) && arrived_ == active_) {
+            RunLocked(func);
         }
-        ++count;
-    }
-    for (int i = 1; i < target_num; ++i) {
-        if (pos_x-i<0 || pos_y-i<0 || state[pos_x-i][pos_y-i]!=stone_id) {
-            break;
-        }
-        ++count;
-    }
-    if (count >= target_num) {
-        return 1;
     }
 
-    // check skew [+1,-1]
-    count = 1;
-    for (int i = 1; i < target_num; ++i) {
-        if (pos_x+i>=board_sz || pos_y-i<0 || state[pos_x+i][pos_y-i]!=stone_id) {
-            break;
-        }
-        ++count;
+private:
+    std::mutex mutex_;
+    std::condition_variable released_;
+    std::atomic<bool> requested_{false};
+    int active_;
+    int arrived_ = 0;
+    int epoch_ = 0;
+
+    void RunLocked(const std::function<void()> &func) {
+        func();
+        requested_.store(false, std::memory_order_relaxed);
+        arrived_ = 0;
+        ++epoch_;
+        released_.notify_all();
     }
-    for (int i = 1; i < target_num; ++i) {
-        if (pos_x-i<0 || pos_y+i>=board_sz || state[pos_x-i][pos_y+i]!=stone_id) {
-            break;
+};
+
+/**
+ * Cheap prior of playing at (pos_x, pos_y): stones next to it count 2, stones two places away count 1.
+ */
+int PlacePrior(const BitBoard &board, int pos_x, int pos_y)
+{
+    const int board_sz = board.Size();
+    int prior = 0;
+    for (int i = std::max(0, pos_x - 2); i <= std::min(board_sz - 1, pos_x + 2); ++i) {
+        for (int j = std::max(0, pos_y - 2); j <= std::min(board_sz - 1, pos_y + 2); ++j) {
+            if (!board.IsEmpty(i, j)) {
+                prior += std::max(std::abs(i - pos_x), std::abs(j - pos_y)) == 1 ? 2 : 1;
+            }
         }
-        ++count;
     }
-    if (count >= target_num) {
-        return 1;
-    }
-    return 0;
+    return prior;
 }
 
 /**
+ * Play random stones on board until the game ends, then restore board.
+ * rollout_length receives the number of stones played.
  * @return 0 -> draw, 1 -> stone_id win, 2 -> stone_id loss
  */
-int UniformPlayoutPolicy(const MonteCarloTreeSearch::StateType &board_state, int stone_id)
+int UniformPlayoutPolicy(BitBoard &board, int stone_id, RandEngine &rand_engine, int &rollout_length)
 {
-    auto state = board_state;
-    const int board_sz = state.size();
+    const int board_sz = board.Size();
+    const int num_moves = board.NumMoves();
     std::vector<std::pair<int, int>> empty_pos;
     for (int i = 0; i < board_sz; ++i) {
         for (int j = 0; j < board_sz; ++j) {
-            if (state[i][j] == 0) {
+            if (board.IsEmpty(i, j)) {
                 empty_pos.emplace_back(i, j);
             }
         }
     }
 
+    int res = 0;
     int cur_stone_id = stone_id;
     int sz = empty_pos.size();
     for (int step = 0; step < sz; ++step) {
         std::uniform_int_distribution<int> randi(step, sz - 1);
         int rand_idx = randi(rand_engine);
         std::swap(empty_pos[step], empty_pos[rand_idx]);
-        state[empty_pos[step].first][empty_pos[step].second] = cur_stone_id;
-        int game_res = CheckIsGameEnd(state, empty_pos[step]);
+        board.Place(empty_pos[step].first, empty_pos[step].second, cur_stone_id);
+        int game_res = board.CheckIsGameEnd(empty_pos[step]);
         if (game_res == 1) {
-            return cur_stone_id == stone_id ? 1 : 2;
+            res = cur_stone_id == stone_id ? 1 : 2;
+            break;
         }
         if (game_res == 2) {
-            return 0;
+            break;
         }
         cur_stone_id = get_opponent_id(cur_stone_id);
     }
-    return 0;
+    rollout_length = board.NumMoves() - num_moves;
+    board.UndoTo(num_moves);
+    return res;
 }
 
 
-std::vector<std::pair<int, int>> GetListOfNearEmptyPlace(int pos_x, int pos_y,
-    const MonteCarloTreeSearch::StateType &board_state,
-    int distance = 2)
+/**
+ * place stones within certain distance to stones placed on board, then restore board.
+ * The candidate places are the near empty cells tracked by board, see BitBoard::SetNearDistance.
+ * rollout_length receives the number of stones played.
+ * @return 0 -> draw, 1 -> stone_id win, 2 -> stone_id loss
+ */
+int NearPlacePlayoutPolicy(BitBoard &board, int stone_id, RandEngine &rand_engine, int &rollout_length)
 {
-    std::vector<std::pair<int, int>> res;
-    const int board_sz = board_state.size();
-    int left = std::max(0, pos_x - distance);
-    int up = std::max(0, pos_y - distance);
-    int right = std::min(board_sz - 1, pos_x + distance);
-    int down = std::min(board_sz - 1, pos_y + distance);
-    for (int i = left; i <= right; ++i) {
-        for (int j = up; j <= down; ++j) {
-            if (board_state[i][j] == 0) {
-                res.emplace_back(i, j);
-            }
+    const int num_moves = board.NumMoves();
+    int res = 0;
+    int cur_stone_id = stone_id;
+    for (int sz = board.NumNearEmpty(); sz > 0; sz = board.NumNearEmpty()) {
+        std::uniform_int_distribution<int> rand_i(0, sz-1);
+        auto place = board.NearEmptyAt(rand_i(rand_engine));
+        board.Place(place.first, place.second, cur_stone_id);
+
+        int game_res = board.CheckIsGameEnd(place);
+        if (game_res == 1) {
+            res = cur_stone_id == stone_id ? 1 : 2;
+            break;
         }
+        if (game_res == 2) {
+            break;
+        }
+        cur_stone_id = get_opponent_id(cur_stone_id);
     }
+    rollout_length = board.NumMoves() - num_moves;
+    board.UndoTo(num_moves);
     return res;
 }
 
+/**
+ * Like NearPlacePlayoutPolicy, but each near place is picked with probability proportional to
+ * ThreatPatterns::Urgency, so rollouts make their fives and block the opponent's threats.
+ * @return 0 -> draw, 1 -> stone_id win, 2 -> stone_id loss
+ */
+int ThreatPlayoutPolicy(BitBoard &board, int stone_id, RandEngine &rand_engine, int &rollout_length)
+{
+    const int num_moves = board.NumMoves();
+    std::vector<std::pair<int, int>> candidates;
+    std::vector<double> urgency;
+    int res = 0;
+    int cur_stone_id = stone_id;
+    while (true) {
+        candidates.clear();
+        urgency.clear();
+        double total = 0;
+        board.ForEachNearEmpty([&](int i, int j) {
+            candidates.emplace_back(i, j);
+            urgency.push_back(ThreatPatterns::Urgency(board, i, j, cur_stone_id));
+            total += urgency.back();
+        });
+        if (candidates.empty()) {
+            break;
+        }
+        double r = std::uniform_real_distribution<double>(0, total)(rand_engine);
+        size_t idx = 0;
+        while (idx + 1 < candidates.size() && r >= urgency[idx]) {
+            r -= urgency[idx++];
+        }
+        board.Place(candidates[idx].first, candidates[idx].second, cur_stone_id);
 
-std::set<std::pair<int,int>> ScanForEmptyPlace(const MonteCarloTreeSearch::StateType &board_state,
-    int distance = 2)
+        int game_res = board.CheckIsGameEnd(candidates[idx]);
+        if (game_res == 1) {
+            res = cur_stone_id == stone_id ? 1 : 2;
+            break;
+        }
+        if (game_res == 2) {
+            break;
+        }
+        cur_stone_id = get_opponent_id(cur_stone_id);
+    }
+    rollout_length = board.NumMoves() - num_moves;
+    board.UndoTo(num_moves);
+    return res;
+}
+
+}
+/**
+ * Run search until one of the budgets is used up: iter_steps iterations, time_limit_ms
+ * milliseconds or max_nodes tree nodes. A budget <= 0 is unlimited, at least one must be set.
+ * With early_stop, search also ends once the most visited root child can no longer be
+ * overtaken within the remaining budget. The number of iterations run is kept in
+ * last_search_iterations, and the counters of the search in last_search_stats.
+ * Nothing is printed unless verbose is set.
+ * Setting stop_search ends the search at once, e.g. to cancel pondering. If it is set
+ * before root node is expanded, {-1, -1} is returned.
+ */
+std::pair<int, int> MonteCarloTreeSearch::SearchMove(int iter_steps, double time_limit_ms, int max_nodes)
 {
-    std::set<std::pair<int, int>> res;
-    const int board_sz = board_state.size();
-    auto append_space_around = [&](int pos_x, int pos_y) {
-        auto list = GetListOfNearEmptyPlace(pos_x, pos_y, board_state, distance);
-        for (auto &x:list) {
-            res.emplace(x);
+    if (iter_steps <= 0 && time_limit_ms <= 0 && max_nodes <= 0) {
+        throw std::invalid_argument("SearchMove needs one of iter_steps, time_limit_ms and max_nodes to be positive");
+    }
+    pybind11::gil_scoped_release gil_release;
+    std::optional<pgbar::BlockBar<>> pbar;
+    std::function<void()> tick;
+    if (verbose && iter_steps > 0) {
+        pbar.emplace();
+        pbar->config().prefix("search move ");
+        pbar->config().style( pgbar::config::Line::Entire ).tasks(iter_steps);
+        tick = [&pbar]() { pbar->tick(); };
+    }
+    int best_child = RunSearch(iter_steps, time_limit_ms, max_nodes, tick);
+    if (best_child < 0 || !verbose) {
+        return best_child < 0 ? std::make_pair(-1, -1) : nodes[best_child].GetMove();
+    }
+
+    const TreeNode &most_total_child = nodes[Resolve(best_child)];
+    std::cout << "win ratio: " << most_total_child.win_rounds.load() << "/"
+              << most_total_child.total_rounds.load() << "="
+              << (most_total_child.win_rounds.load() / most_total_child.total_rounds.load())
+              << "\tcost time: " << last_search_stats.total_time
+              << "s\titerations: " << last_search_iterations << std::endl;
+    ForEachChild(root, [&](int idx) {
+        const TreeNode &ch = nodes[Resolve(idx)];
+        std::cout << "[" << int(nodes[idx].move_x) << "," << int(nodes[idx].move_y)
+            << "|" << ch.win_rounds.load() << "/" << ch.total_rounds.load() << "="
+            << (ch.win_rounds.load() / ch.total_rounds.load())  <<"], ";
+    });
+    std::cout << std::endl;
+    return nodes[best_child].GetMove();
+}
+
+/**
+ * Search loop of SearchMove, runs without the GIL and prints nothing.
+ * tick (optional) is called after each iteration.
+ * @return: index of the most visited root child, -1 if stopped before root node is expanded.
+ */
+int MonteCarloTreeSearch::RunSearch(int iter_steps, double time_limit_ms, int max_nodes,
+    const std::function<void()> &tick)
+{
+    EnsureTranspositionTable();
+    PrepareBoard(root_board);
+    auto time1 = Clock::now();
+    const int nodes_before = nodes.Size();
+    const auto time_limit = std::chrono::duration<double, std::milli>(time_limit_ms);
+
+    // estimate iterations left in the budget, -1 if it can't be estimated.
+    auto remaining_iterations = [&](int done_itr) {
+        double remaining = -1;
+        if (iter_steps > 0) {
+            remaining = iter_steps - done_itr;
         }
+        if (time_limit_ms > 0) {
+            double elapsed = std::chrono::duration<double, std::milli>(Clock::now() - time1).count();
+            double by_time = done_itr * std::max(0.0, time_limit_ms - elapsed) / std::max(elapsed, 1e-3);
+            remaining = remaining < 0 ? by_time : std::min(remaining, by_time);
+        }
+        return remaining;
     };
-    
-    bool empty_flag = true;
-    for (int i = 0; i < board_sz; ++i) {
-        for (int j = 0; j < board_sz; ++j) {
-            if (board_state[i][j] != 0) {
-                empty_flag = false;
-                append_space_around(i, j);
+    auto budget_used_up = [&](int done_itr) {
+        if (iter_steps > 0 && done_itr >= iter_steps) {
+            return true;
+        }
+        if (time_limit_ms > 0 && Clock::now() - time1 >= time_limit) {
+            return true;
+        }
+        if (max_nodes > 0 && nodes.Size() >= max_nodes) {
+            return true;
+        }
+        if (early_stop && done_itr % kEarlyStopCheckInterval == 0) {
+            double remaining = remaining_iterations(done_itr);
+            return remaining >= 0 && IsBestMoveSettled(remaining);
+        }
+        return false;
+    };
+
+    const int n_threads = std::max(1, num_threads);
+    const int worker_virtual_loss = n_threads > 1 ? virtual_loss : 0;
+    const unsigned int search_index = search_count_++;
+    std::atomic<int> next_itr{0};
+    std::atomic<int> done_itr{0};
+    std::atomic<bool> stop{false};
+    SearchStats stats;
+    std::mutex stats_mutex;
+    // over node_budget, the tree is collapsed between iterations while every thread waits.
+    SearchBarrier barrier(n_threads);
+    int evictions = 0;
+    int nodes_evicted = 0;
+    auto evict = [&]() {
+        ++evictions;
+        nodes_evicted += CollapseTree(CollapseTarget());
+    };
+    auto run_worker = [&](unsigned int worker_id) {
+        std::seed_seq seed{random_seed, search_index, worker_id};
+        SearchWorker worker{RandEngine(seed), worker_virtual_loss, root_board, {}, {}};
+        while (!stop.load(std::memory_order_relaxed) && !stop_search.load(std::memory_order_relaxed)) {
+            if (barrier.Requested()) {
+                barrier.Arrive(evict);
+            }
+            if (iter_steps > 0 && next_itr.fetch_add(1, std::memory_order_relaxed) >= iter_steps) {
+                break;
+            }
+            SearchIteration(worker);
+            if (tick) {
+                tick();
+            }
+            if (node_budget > 0 && nodes.Size() >= node_budget) {
+                barrier.Request();
+            }
+            if (budget_used_up(done_itr.fetch_add(1, std::memory_order_relaxed) + 1)) {
+                stop.store(true, std::memory_order_relaxed);
             }
         }
+        barrier.Leave(evict);
+        std::lock_guard<std::mutex> lock(stats_mutex);
+        stats.Merge(worker.stats);
+    };
+    std::vector<std::thread> threads;
+    for (int i = 1; i < n_threads; ++i) {
+        threads.emplace_back(run_worker, i);
     }
-    if (empty_flag) {
-        append_space_around(board_sz / 2, board_sz / 2);
+    run_worker(0);
+    for (auto &th : threads) {
+        th.join();
     }
-    return res;
+    stats.iterations = done_itr.load();
+    stats.total_time = std::chrono::duration<double>(Clock::now() - time1).count();
+    stats.evictions = evictions;
+    stats.nodes_evicted = nodes_evicted;
+    stats.nodes_allocated = nodes.Size() - nodes_before + nodes_evicted;
+    stats.peak_memory_bytes = nodes.Bytes() + transposition_table_.Bytes();
+    last_search_stats = stats;
+    last_search_iterations = stats.iterations;
+    last_search_rollouts = stats.rollout_count;
+    if (stop_search.exchange(false) && !nodes[root].IsExpanded()) {
+        return -1;
+    }
+    return GetMostTotalRoundsChild();
+}
+
+/**
+ * Search each of states[i] for stone_ids[i] with its own tree, spreading the positions over
+ * num_threads threads. Parameters of each tree are copied from config, and its random seed
+ * is derived from config.random_seed and the position index.
+ * No lock of the Python interpreter is needed.
+ */
+MonteCarloTreeSearch::BatchSearchResult MonteCarloTreeSearch::BatchSearchMove(
+    const std::vector<StateType> &states, const std::vector<int> &stone_ids, const SearchConfig &config,
+    int num_threads)
+{
+    if (states.size() != stone_ids.size()) {
+        throw std::invalid_argument("BatchSearchMove: states and stone_ids differ in length");
+    }
+    if (config.iter_steps <= 0 && config.time_limit_ms <= 0 && config.max_nodes <= 0) {
+        throw std::invalid_argument("BatchSearchMove needs one of iter_steps, time_limit_ms and max_nodes to be positive");
+    }
+    const int num_states = states.size();
+    const int board_sz = num_states > 0 ? states[0].size() : 0;
+    for (const auto &state : states) {
+        if (static_cast<int>(state.size()) != board_sz) {
+            throw std::invalid_argument("BatchSearchMove: boards differ in size");
+        }
+    }
+
+    BatchSearchResult result;
+    result.board_size = board_sz;
+    result.best_moves.assign(num_states * 2, -1);
+    result.win_rounds.assign(num_states, 0);
+    result.total_rounds.assign(num_states, 0);
+    result.iterations.assign(num_states, 0);
+    result.visits.assign(num_states * board_sz * board_sz, 0);
+
+    std::atomic<int> next_state{0};
+    std::exception_ptr error;
+    std::mutex error_mutex;
+    auto run_worker = [&]() {
+        for (int i = next_state.fetch_add(1); i < num_states; i = next_state.fetch_add(1)) {
+            try {
+                MonteCarloTreeSearch tree(states[i], stone_ids[i]);
+                tree.near_playout_policy_distance = config.near_playout_policy_distance;
+                tree.playout_policy = config.playout_policy;
+                tree.early_stop = config.early_stop;
+                tree.transposition_table_size = config.transposition_table_size;
+                tree.progressive_widening = config.progressive_widening;
+                tree.widening_coef = config.widening_coef;
+                tree.widening_exponent = config.widening_exponent;
+                tree.node_budget = config.node_budget;
+                std::seed_seq seed{config.random_seed, static_cast<unsigned int>(i)};
+                seed.generate(&tree.random_seed, &tree.random_seed + 1);
+                if (tree.root_board.IsFull()) {
+                    continue;
+                }
+
+                int best_child = tree.RunSearch(config.iter_steps, config.time_limit_ms, config.max_nodes, {});
+                const TreeNode &best = tree.nodes[tree.Resolve(best_child)];
+                result.best_moves[2 * i] = tree.nodes[best_child].move_x;
+                result.best_moves[2 * i + 1] = tree.nodes[best_child].move_y;
+                result.win_rounds[i] = best.win_rounds.load();
+                result.total_rounds[i] = best.total_rounds.load();
+                result.iterations[i] = tree.last_search_iterations;
+                int *visits = result.visits.data() + static_cast<size_t>(i) * board_sz * board_sz;
+                tree.ForEachChild(tree.root, [&](int idx) {
+                    const TreeNode &ch = tree.nodes[idx];
+                    visits[ch.move_x * board_sz + ch.move_y] = tree.nodes[tree.Resolve(idx)].total_rounds.load();
+                });
+            } catch (...) {
+                std::lock_guard<std::mutex> lock(error_mutex);
+                if (!error) {
+                    error = std::current_exception();
+                }
+                next_state.store(num_states);
+            }
+        }
+    };
+    const int n_threads = std::max(1, std::min(num_threads, num_states));
+    std::vector<std::thread> threads;
+    for (int i = 1; i < n_threads; ++i) {
+        threads.emplace_back(run_worker);
+    }
+    run_worker();
+    for (auto &th : threads) {
+        th.join();
+    }
+    if (error) {
+        std::rethrow_exception(error);
+    }
+    return result;
 }
 
+void MonteCarloTreeSearch::SearchIteration(SearchWorker &worker)
+{
+    const int trans_game_res[3] = {0, 2, 1};
+    SearchStats &stats = worker.stats;
+    int leaf = Selection(worker);
+    if (leaf >= 0) {
+        const TreeNode &node = nodes[leaf];
+        auto time1 = Clock::now();
+        int game_res = node.move_x < 0 ? 0 : worker.board.CheckIsGameEnd(node.GetMove());
+        if (game_res != 0) {
+            ++stats.terminal_hits;
+            stats.selection_time += Lap(time1);
+            BackPropagation(worker.path, node.stone_id, game_res == 1 ? 1 : 0, worker.virtual_loss);
+        } else {
+            int rollout_length = 0;
+            game_res = RolloutPlay(worker.board, get_opponent_id(node.stone_id), worker.rand_engine, rollout_length);
+            ++stats.rollout_count;
+            stats.rollout_moves += rollout_length;
+            stats.rollout_time += Lap(time1);
+            // game_res == 1 means (3 - leaf.stone_id) win, thus leaf loss game.
+            BackPropagation(worker.path, node.stone_id, trans_game_res[game_res], worker.virtual_loss);
+        }
+        ++stats.backprop_count;
+        stats.backprop_time += Lap(time1);
+    }
+    // restore the board of root node.
+    worker.board.UndoTo(worker.board.NumMoves() - (static_cast<int>(worker.path.size()) - 1));
+    worker.path.clear();
+}
 
 /**
- * place stones within certain distance to stones placed on board.
- * @return 0 -> draw, 1 -> stone_id win, 2 -> stone_id loss
+ * Promote the child reached by `move` to be the new root, keeping the statistics of its subtree.
+ * The kept subgraph is copied into a fresh arena, so memory of discarded branches is released.
+ * A kept alias whose target lies in a discarded branch takes over the statistics of the target.
+ * If that child has not been expanded yet, a fresh root is created for the resulting state.
+ * @return: true if the subtree was reused, false if a fresh root was created.
  */
-int NearPlacePlayoutPolicy(const MonteCarloTreeSearch::StateType &board_state, int stone_id,
-                           int distance = 2)
+bool MonteCarloTreeSearch::AdvanceRoot(const std::pair<int, int> &move)
 {
-    auto state = board_state;
-    const size_t board_sz = board_state.size();
-    auto record_empty_place = ScanForEmptyPlace(board_state, distance);
-    std::vector<std::pair<int, int>> candidate_place(record_empty_place.begin(), record_empty_place.end());
+    int new_root = -1;
+    ForEachChild(root, [&](int ch) {
+        if (nodes[ch].GetMove() == move) {
+            new_root = ch;
+        }
+    });
+    int moved_stone_id = get_opponent_id(nodes[root].stone_id);
+    root_board.Place(move.first, move.second, moved_stone_id);
+    if (new_root < 0) {
+        ResetTree(moved_stone_id, move);
+        return false;
+    }
 
-    int cur_stone_id = stone_id;
-    while (!candidate_place.empty()) {
-        int sz = candidate_place.size();
-        std::uniform_int_distribution<int> rand_i(0, sz-1);
-        int idx = rand_i(rand_engine);
-        std::swap(candidate_place[idx], candidate_place[sz-1]);
-        state[candidate_place[sz-1].first][candidate_place[sz-1].second] = cur_stone_id;
+    auto records = FlattenTree(new_root, 0);
+    BuildTree(records.data(), records.size());
+    return true;
+}
 
-        int game_res = CheckIsGameEnd(state, candidate_place[sz-1]);
-        if (game_res == 1) {
-            return cur_stone_id == stone_id ? 1 : 2;
+/**
+ * Flatten the subgraph under node `from` into records of a tree file (see tree_file.h).
+ * A copied alias whose target is not copied yet takes over the statistics of the target.
+ * With max_nodes > 0 at most max_nodes records are written: children are copied for the most
+ * visited nodes first, a node whose children don't fit any more is written unexpanded.
+ */
+std::vector<TreeRecord> MonteCarloTreeSearch::FlattenTree(int from, int max_nodes) const
+{
+    std::vector<TreeRecord> records(1);
+    std::unordered_map<int, int> copied; // canonical node -> record
+    // copy node into records[to], return false if it became an alias of an already copied node.
+    auto copy_node = [&](int node, int to) {
+        const TreeNode &src = nodes[node];
+        const int target = Resolve(node);
+        TreeRecord &dst = records[to];
+        dst = TreeRecord{};
+        dst.first_child = -1;
+        dst.move_x = src.move_x;
+        dst.move_y = src.move_y;
+        dst.stone_id = src.stone_id;
+        auto it = copied.find(target);
+        if (it != copied.end()) {
+            dst.first_child = it->second;
+            dst.expand_state = kRecordAlias;
+            return false;
         }
-        if (game_res == 2) {
-            return 0;
+        copied.emplace(target, to);
+        dst.win_rounds = nodes[target].win_rounds.load();
+        dst.total_rounds = nodes[target].total_rounds.load();
+        dst.expand_state = kRecordUnexpanded;
+        return true;
+    };
+    copy_node(from, 0);
+
+    // (canonical node, record) whose children are not copied yet. Taken in breadth first
+    // order, or as a heap of the most visited when pruning.
+    std::vector<std::pair<int, int>> pending{{Resolve(from), 0}};
+    size_t head = 0;
+    auto fewer_visits = [this](const std::pair<int, int> &a, const std::pair<int, int> &b) {
+        return nodes[a.first].total_rounds.load(std::memory_order_relaxed) <
+            nodes[b.first].total_rounds.load(std::memory_order_relaxed);
+    };
+    while (head < pending.size()) {
+        std::pair<int, int> cur;
+        if (max_nodes > 0) {
+            std::pop_heap(pending.begin(), pending.end(), fewer_visits);
+            cur = pending.back();
+            pending.pop_back();
+        } else {
+            cur = pending[head++];
         }
+        auto [node, rec] = cur;
+        const TreeNode &src = nodes[node];
+        if (!src.IsExpanded()) {
+            continue;
+        }
+        std::vector<int> children;
+        ForEachChild(node, [&](int ch) { children.push_back(ch); });
+        const int num_children = children.size();
+        const int first = records.size();
+        if (max_nodes > 0 && first + num_children > max_nodes) {
+            continue;
+        }
+        records.resize(first + num_children);
+        records[rec].first_child = num_children > 0 ? first : -1;
+        records[rec].num_children = num_children;
+        records[rec].expand_state = src.expand_state.load() == TreeNode::kExpanded ?
+            kRecordExpanded : kRecordPartiallyExpanded;
+        for (int i = 0; i < num_children; ++i) {
+            if (copy_node(children[i], first + i)) {
+                pending.emplace_back(Resolve(children[i]), first + i);
+                if (max_nodes > 0) {
+                    std::push_heap(pending.begin(), pending.end(), fewer_visits);
+                }
+            }
+        }
+    }
+    return records;
+}
 
-        auto empty_list = GetListOfNearEmptyPlace(candidate_place[sz-1].first, candidate_place[sz-1].second, state, distance);
-        candidate_place.pop_back();
-        for (auto &x: empty_list) {
-            if (record_empty_place.find(x) == record_empty_place.end()) {
-                record_empty_place.emplace(x);
-                candidate_place.emplace_back(x);
+/**
+ * Replace the tree by the one of `records` (see tree_file.h), record 0 becomes root.
+ * Children of each record are allocated as one contiguous block.
+ */
+void MonteCarloTreeSearch::BuildTree(const TreeRecord *records, int num_records)
+{
+    NodeArena<TreeNode> new_nodes;
+    std::vector<int> node_of(num_records, -1);
+    node_of[0] = new_nodes.Allocate(1);
+    for (int i = 0; i < num_records; ++i) {
+        const TreeRecord &r = records[i];
+        TreeNode &n = new_nodes[node_of[i]];
+        n.move_x = r.move_x;
+        n.move_y = r.move_y;
+        n.stone_id = r.stone_id;
+        if (r.expand_state == kRecordAlias) {
+            n.first_child.store(node_of[r.first_child]);
+            n.expand_state.store(TreeNode::kAlias);
+            continue;
+        }
+        n.win_rounds.store(r.win_rounds);
+        n.total_rounds.store(r.total_rounds);
+        if (r.num_children > 0) {
+            const int first = new_nodes.Allocate(r.num_children);
+            for (int k = 0; k < r.num_children; ++k) {
+                node_of[r.first_child + k] = first + k;
+                new_nodes[first + k].parent = node_of[i];
+                new_nodes[first + k].next_sibling = k + 1 < r.num_children ? first + k + 1 : -1;
             }
+            n.first_child.store(first);
+            n.num_children.store(r.num_children);
         }
-        cur_stone_id = get_opponent_id(cur_stone_id);
+        n.expand_state.store(r.expand_state);
     }
-    return 0;
+    nodes = std::move(new_nodes);
+    root = node_of[0];
+    RebuildTranspositionTable();
 }
 
+/**
+ * Write root board and the tree under root to path, see tree_file.h for the format.
+ * With max_nodes > 0, only the most visited part of the tree holding max_nodes nodes is kept.
+ * Must not run concurrently with SearchMove.
+ */
+void MonteCarloTreeSearch::SaveTree(const std::string &path, int max_nodes) const
+{
+    auto records = FlattenTree(root, max_nodes);
+    const int board_sz = root_board.Size();
+    TreeFileHeader header{};
+    std::memcpy(header.magic, kTreeFileMagic, sizeof(header.magic));
+    header.version = kTreeFileVersion;
+    header.board_size = board_sz;
+    header.num_records = records.size();
+    header.root_stone_id = nodes[root].stone_id;
+    header.root_move_x = nodes[root].move_x;
+    header.root_move_y = nodes[root].move_y;
+    std::vector<std::int8_t> board(board_sz * board_sz);
+    for (int i = 0; i < board_sz; ++i) {
+        for (int j = 0; j < board_sz; ++j) {
+            board[i * board_sz + j] = root_board.At(i, j);
+        }
+    }
+    WriteTreeFile(path, header, board, records);
 }
 
+/**
+ * Replace root board and tree by those saved in path by SaveTree, the next SearchMove
+ * resumes from the loaded statistics. The file is memory-mapped while the tree is built.
+ */
+void MonteCarloTreeSearch::LoadTree(const std::string &path)
+{
+    TreeFileView file(path);
+    const TreeFileHeader &header = file.Header();
+    const int board_sz = header.board_size;
+    StateType state(board_sz, std::vector<int>(board_sz));
+    for (int i = 0; i < board_sz; ++i) {
+        for (int j = 0; j < board_sz; ++j) {
+            state[i][j] = file.BoardAt(i, j);
+        }
+    }
+    root_board = BitBoard::FromState(state);
+    stone_id = get_opponent_id(header.root_stone_id);
+    BuildTree(file.Records(), header.num_records);
+}
 
-std::pair<int, int> MonteCarloTreeSearch::SearchMove(int iter_steps)
+/**
+ * @return: a tree loaded from a file written by SaveTree.
+ */
+std::unique_ptr<MonteCarloTreeSearch> MonteCarloTreeSearch::FromTreeFile(const std::string &path)
 {
-    pybind11::gil_scoped_release gil_release;
-    pgbar::BlockBar<> pbar;
-    pbar.config().prefix("search move ");
-    pbar.config().style( pgbar::config::Line::Entire ).tasks(iter_steps);
+    auto tree = std::make_unique<MonteCarloTreeSearch>(StateType(1, std::vector<int>(1)), 1);
+    tree->LoadTree(path);
+    return tree;
+}
 
-    auto time1 = std::chrono::high_resolution_clock::now();
+/**
+ * Create the transposition table if its size changed, existing nodes are put into it.
+ */
+void MonteCarloTreeSearch::EnsureTranspositionTable()
+{
+    const int table_size = TranspositionTableSize();
+    if (TranspositionTable::RoundCapacity(table_size) == transposition_table_.Capacity()) {
+        return;
+    }
+    transposition_table_ = TranspositionTable(table_size);
+    RebuildTranspositionTable();
+}
 
-    const int trans_game_res[3] = {0, 2, 1};
-    for (int itr = 0; itr < iter_steps; ++itr) {
-        auto leaf = Selection();
-        if (leaf == nullptr) {
-            pbar.tick();
+/**
+ * @return: entries of the transposition table, transposition_table_size capped by 2 * node_budget
+ * so that the table stays within the memory the budget allows.
+ */
+int MonteCarloTreeSearch::TranspositionTableSize() const
+{
+    int table_size = std::max(transposition_table_size, 0);
+    if (node_budget > 0) {
+        table_size = static_cast<int>(std::min<std::int64_t>(table_size, 2 * std::int64_t{node_budget}));
+    }
+    return table_size;
+}
+
+/**
+ * Put every node reachable from root, except aliases, into the transposition table.
+ */
+void MonteCarloTreeSearch::RebuildTranspositionTable()
+{
+    transposition_table_.Clear();
+    if (transposition_table_.Capacity() == 0) {
+        return;
+    }
+    auto visits = [this](int node) { return nodes[node].total_rounds.load(std::memory_order_relaxed); };
+    std::vector<std::pair<int, std::uint64_t>> stack{{root, root_board.Hash()}};
+    while (!stack.empty()) {
+        auto [node, hash] = stack.back();
+        stack.pop_back();
+        transposition_table_.Store(hash, node, visits);
+        ForEachChild(node, [&](int ch) {
+            const TreeNode &n = nodes[ch];
+            if (n.expand_state.load(std::memory_order_relaxed) != TreeNode::kAlias) {
+                stack.emplace_back(ch, hash ^ BitBoard::ZobristKey(n.move_x, n.move_y, n.stone_id));
+            }
+        });
+    }
+}
+
+/**
+ * Shrink the tree under root to about max_nodes nodes in place, for node_budget. Children are
+ * kept for the most visited nodes first, like FlattenTree prunes; a node whose children don't
+ * fit any more is collapsed to an unexpanded leaf. Its statistics already sum those of the
+ * removed subtree, so nothing is lost above it. Root keeps its children whatever max_nodes is.
+ * Nodes of removed subtrees go back to the arena for later expansions and only their entries
+ * are erased from the transposition table. A kept alias whose target is removed takes over the
+ * statistics of the target and is stored in the table in its place.
+ * Must not run concurrently with other tree operations.
+ * @return: number of nodes released.
+ */
+int MonteCarloTreeSearch::CollapseTree(int max_nodes)
+{
+    auto fewer_visits = [this](int a, int b) {
+        return nodes[a].total_rounds.load(std::memory_order_relaxed) <
+            nodes[b].total_rounds.load(std::memory_order_relaxed);
+    };
+    std::vector<char> keeps_children(nodes.End(), 0);
+    std::vector<int> pending{root};
+    int num_kept = 1;
+    while (!pending.empty()) {
+        std::pop_heap(pending.begin(), pending.end(), fewer_visits);
+        const int node = pending.back();
+        pending.pop_back();
+        const TreeNode &n = nodes[node];
+        if (!n.IsExpanded() || (node != root && num_kept + n.NumChildren() > max_nodes)) {
             continue;
         }
-        int game_res = CheckIsGameEnd(leaf->state, leaf->from_moving);
-        if (game_res != 0) {
-            BackPropagation(leaf, leaf->stone_id, game_res == 1 ? 1 : 0);
-            pbar.tick();
-            continue;
+        num_kept += n.NumChildren();
+        keeps_children[node] = 1;
+        ForEachChild(node, [&](int ch) {
+            if (nodes[ch].expand_state.load(std::memory_order_relaxed) != TreeNode::kAlias) {
+                pending.push_back(ch);
+                std::push_heap(pending.begin(), pending.end(), fewer_visits);
+            }
+        });
+    }
+
+    std::vector<int> released;
+    std::vector<char> is_released(nodes.End(), 0);
+    // (node, Zobrist hash of its position), the key of its transposition table entry.
+    std::vector<std::pair<int, std::uint64_t>> kept_aliases;
+    std::vector<std::pair<int, std::uint64_t>> stack{{root, root_board.Hash()}};
+    while (!stack.empty()) {
+        const auto [node, hash] = stack.back();
+        stack.pop_back();
+        const bool keep = keeps_children[node];
+        ForEachChild(node, [&](int ch) {
+            const TreeNode &child = nodes[ch];
+            const bool alias = child.expand_state.load(std::memory_order_relaxed) == TreeNode::kAlias;
+            const std::uint64_t child_hash = hash ^ BitBoard::ZobristKey(child.move_x, child.move_y, child.stone_id);
+            if (!keep) {
+                released.push_back(ch);
+                is_released[ch] = 1;
+                if (!alias) {
+                    transposition_table_.Erase(child_hash, ch);
+                }
+            } else if (alias) {
+                kept_aliases.emplace_back(ch, child_hash);
+            }
+            if (!alias) {
+                stack.emplace_back(ch, child_hash);
+            }
+        });
+        TreeNode &n = nodes[node];
+        if (!keep && n.IsExpanded()) {
+            n.first_child.store(-1, std::memory_order_relaxed);
+            n.num_children.store(0, std::memory_order_relaxed);
+            n.expand_state.store(TreeNode::kUnexpanded, std::memory_order_relaxed);
+        }
+    }
+    auto visits = [this](int node) { return nodes[node].total_rounds.load(std::memory_order_relaxed); };
+    for (const auto [alias, hash] : kept_aliases) {
+        TreeNode &n = nodes[alias];
+        const int target = n.first_child.load(std::memory_order_relaxed);
+        if (is_released[target]) {
+            n.win_rounds.store(nodes[target].win_rounds.load(std::memory_order_relaxed), std::memory_order_relaxed);
+            n.total_rounds.store(nodes[target].total_rounds.load(std::memory_order_relaxed), std::memory_order_relaxed);
+            n.first_child.store(-1, std::memory_order_relaxed);
+            n.expand_state.store(TreeNode::kUnexpanded, std::memory_order_relaxed);
+            transposition_table_.Store(hash, alias, visits);
         }
-        game_res = RolloutPlay(leaf->state, get_opponent_id(leaf->stone_id));
-        // game_res == 1 means (3 - leaf.stone_id) win, thus leaf loss game.
-        BackPropagation(leaf, leaf->stone_id, trans_game_res[game_res]);
-        pbar.tick();
     }
+    const int num_released = released.size();
+    nodes.Release(std::move(released));
+    return num_released;
+}
+
+/**
+ * @return: nodes kept by an eviction for node_budget, see kEvictionExpansions.
+ */
+int MonteCarloTreeSearch::CollapseTarget() const
+{
+    const int cells = root_board.Size() * root_board.Size();
+    return node_budget - std::min(node_budget / 2, std::max(node_budget / 4, kEvictionExpansions * cells));
+}
+
+/**
+ * Make board track the near empty places used by NearPlacePlayout and ThreatPlayout, and
+ * nothing for UniformPlayout.
+ */
+void MonteCarloTreeSearch::PrepareBoard(BitBoard &board) const
+{
+    board.SetNearDistance(playout_policy == PlayoutPolicy::UniformPlayout ? 0 : near_playout_policy_distance);
+}
 
-    const auto &most_total_child = GetMostTotalRoundsChild();
-    auto time2 = std::chrono::high_resolution_clock::now();
-    std::cout << "win ratio: " << most_total_child->win_rounds << "/"
-              << most_total_child->total_rounds << "="
-              << (most_total_child->win_rounds / most_total_child->total_rounds)
-              << "\tcost time: " << std::chrono::duration<double>(time2-time1).count()
-              << "s" << std::endl;
-    for (auto &ch : root->children) {
-        std::cout << "[" << ch->from_moving.first << "," << ch->from_moving.second
-            << "|" << ch->win_rounds << "/" << ch->total_rounds << "="
-            << (ch->win_rounds / ch->total_rounds)  <<"], ";
+void MonteCarloTreeSearch::ResetTree(int root_stone_id, const std::pair<int, int> &root_move)
+{
+    nodes = NodeArena<TreeNode>();
+    root = nodes.Allocate(1);
+    nodes[root].stone_id = root_stone_id;
+    nodes[root].move_x = root_move.first;
+    nodes[root].move_y = root_move.second;
+    transposition_table_.Clear();
+}
+
+/**
+ * Step into node: place its move on worker.board and add virtual loss to the node it resolves to.
+ * @return: the resolved node, which is appended to worker.path.
+ */
+int MonteCarloTreeSearch::VisitNode(SearchWorker &worker, int node)
+{
+    const TreeNode &edge = nodes[node];
+    if (!worker.path.empty()) {
+        worker.board.Place(edge.move_x, edge.move_y, edge.stone_id);
     }
-    std::cout << std::endl;
-    return most_total_child->from_moving;
+    node = Resolve(node);
+    nodes[node].virtual_loss.fetch_add(worker.virtual_loss, std::memory_order_relaxed);
+    worker.path.push_back(node);
+    return node;
 }
 
-std::shared_ptr<MonteCarloTreeSearch::TreeNode>MonteCarloTreeSearch::Selection()
+int MonteCarloTreeSearch::Selection()
 {
-    std::shared_ptr<TreeNode> leaf = SearchLeaf(root);
-    int game_res = leaf->from_moving.first < 0 ? 0 : CheckIsGameEnd(leaf->state, leaf->from_moving);
+    PrepareBoard(root_board);
+    SearchWorker worker{rand_engine_, 0, root_board, {}, {}};
+    int node = Selection(worker);
+    rand_engine_ = worker.rand_engine;
+    return node;
+}
+
+/**
+ * Descend to a leaf, expand it and return its most promising child, or the leaf itself
+ * when another thread is expanding it. Every node on the path carries `worker.virtual_loss`
+ * until it is back propagated, and worker.board follows the path.
+ * @return: index of selected node, -1 if the leaf ends the game and was already back propagated.
+ */
+int MonteCarloTreeSearch::Selection(SearchWorker &worker)
+{
+    SearchStats &stats = worker.stats;
+    auto time1 = Clock::now();
+    ++stats.selection_count;
+    int leaf = VisitNode(worker, root);
+    while (nodes[leaf].IsExpanded()) {
+        const TreeNode &n = nodes[leaf];
+        if (n.expand_state.load(std::memory_order_relaxed) == TreeNode::kPartiallyExpanded &&
+            n.NumChildren() < AllowedChildren(leaf)) {
+            stats.selection_time += Lap(time1);
+            Widen(leaf, worker.board);
+            ++stats.expansion_count;
+            stats.expansion_time += Lap(time1);
+        }
+        if (n.NumChildren() == 0) {
+            break;
+        }
+        leaf = VisitNode(worker, GetMostPriorityChild(leaf));
+    }
+    const TreeNode &leaf_node = nodes[leaf];
+    // a five in the position must pass through the move of any node reaching it, so the
+    // move of the resolved node is as good as the move just placed.
+    int game_res = leaf_node.move_x < 0 ? 0 : worker.board.CheckIsGameEnd(leaf_node.GetMove());
     if (game_res != 0) {
-        BackPropagation(leaf, leaf->stone_id, game_res == 1 ? 1 : 0);
-        return nullptr;
+        ++stats.terminal_hits;
+        stats.selection_time += Lap(time1);
+        BackPropagation(worker.path, leaf_node.stone_id, game_res == 1 ? 1 : 0, worker.virtual_loss);
+        ++stats.backprop_count;
+        stats.backprop_time += Lap(time1);
+        return -1;
+    }
+    stats.selection_time += Lap(time1);
+    bool expanded = Expansion(leaf, worker.board, worker.rand_engine);
+    ++stats.expansion_count;
+    stats.expansion_time += Lap(time1);
+    if (!expanded) {
+        return leaf;
+    }
+    int child = GetMostPriorityChild(leaf);
+    if (child < 0) {
+        // no empty place left, the game is a draw.
+        ++stats.terminal_hits;
+        stats.selection_time += Lap(time1);
+        BackPropagation(worker.path, leaf_node.stone_id, 0, worker.virtual_loss);
+        ++stats.backprop_count;
+        stats.backprop_time += Lap(time1);
+        return -1;
     }
-    Expansion(leaf);
-    return leaf->children[0];
+    child = VisitNode(worker, child);
+    stats.selection_time += Lap(time1);
+    return child;
 }
 
 /**
+ * Back propagate along parent links, nodes reached through other parents are not updated.
  * @param game_res: 0->draw; 1->leaf_stone_id win; 2->leaf_stone_id loss.
  */
-void MonteCarloTreeSearch::BackPropagation(std::shared_ptr<TreeNode> node, int leaf_stone_id, int game_res)
+void MonteCarloTreeSearch::BackPropagation(int node, int leaf_stone_id, int game_res)
 {
-    std::shared_ptr<TreeNode> cur = node;
-    while (cur != nullptr) {
-        switch (game_res)
-        {
-        case 1:
-            cur->UpdateRounds(cur->stone_id == leaf_stone_id ? 1 : 0, 1);
-            break;
-        case 2:
-            cur->UpdateRounds(cur->stone_id == leaf_stone_id ? 0 : 1, 1);
-            break;
-        default:
-            cur->UpdateRounds(0.5, 1);
-            break;
+    for (int cur = Resolve(node); cur >= 0; cur = nodes[cur].parent) {
+        UpdateNode(nodes[cur], leaf_stone_id, game_res, 0);
+    }
+}
+
+/**
+ * Back propagate to the nodes of a selection path, which may pass through transpositions.
+ * @param game_res: 0->draw; 1->leaf_stone_id win; 2->leaf_stone_id loss.
+ */
+void MonteCarloTreeSearch::BackPropagation(const std::vector<int> &path, int leaf_stone_id, int game_res,
+    int virtual_loss)
+{
+    for (int node : path) {
+        UpdateNode(nodes[node], leaf_stone_id, game_res, virtual_loss);
+    }
+}
+
+void MonteCarloTreeSearch::UpdateNode(TreeNode &n, int leaf_stone_id, int game_res, int virtual_loss)
+{
+    n.virtual_loss.fetch_sub(virtual_loss, std::memory_order_relaxed);
+    switch (game_res)
+    {
+    case 1:
+        n.UpdateRounds(n.stone_id == leaf_stone_id ? 1 : 0, 1);
+        break;
+    case 2:
+        n.UpdateRounds(n.stone_id == leaf_stone_id ? 0 : 1, 1);
+        break;
+    default:
+        n.UpdateRounds(0.5, 1);
+        break;
+    }
+}
+
+void MonteCarloTreeSearch::Expansion(int leaf)
+{
+    EnsureTranspositionTable();
+    leaf = Resolve(leaf);
+    BitBoard board = BitBoard::FromState(GetNodeState(leaf));
+    PrepareBoard(board);
+    Expansion(leaf, board, rand_engine_);
+}
+
+/**
+ * Create children of leaf, `board` is the board at leaf, set up by PrepareBoard. A child whose
+ * position is found in the transposition table becomes an alias of the node stored there.
+ * Safe to call concurrently, only the first caller expands the node.
+ * @return: true if leaf has been expanded, false if another thread is expanding it.
+ */
+bool MonteCarloTreeSearch::Expansion(int leaf, const BitBoard &board, RandEngine &rand_engine)
+{
+    TreeNode &leaf_node = nodes[leaf];
+    std::uint8_t expand_state = TreeNode::kUnexpanded;
+    if (!leaf_node.expand_state.compare_exchange_strong(expand_state, TreeNode::kExpanding,
+                                                        std::memory_order_acq_rel)) {
+        return expand_state == TreeNode::kExpanded || expand_state >= TreeNode::kPartiallyExpanded;
+    }
+
+    int opponent_stone_id = get_opponent_id(leaf_node.stone_id);
+    auto candidates = ListCandidates(board, opponent_stone_id);
+    if (!progressive_widening) {
+        std::shuffle(candidates.begin(), candidates.end(), rand_engine);
+    }
+    const int num_candidates = candidates.size();
+    const int num_children = progressive_widening ? std::min(num_candidates, AllowedChildren(leaf)) : num_candidates;
+    if (num_children > 0) {
+        int first_child = nodes.Allocate(num_children);
+        for (int i = 0; i < num_children; ++i) {
+            InitChild(first_child + i, leaf, candidates[i], opponent_stone_id, board);
+            nodes[first_child + i].next_sibling = i + 1 < num_children ? first_child + i + 1 : -1;
         }
-        cur = cur->parent;
+        leaf_node.first_child.store(first_child, std::memory_order_relaxed);
     }
+    leaf_node.num_children.store(num_children, std::memory_order_relaxed);
+    leaf_node.expand_state.store(num_children < num_candidates ? TreeNode::kPartiallyExpanded : TreeNode::kExpanded,
+                                 std::memory_order_release);
+    return true;
 }
 
-void MonteCarloTreeSearch::Expansion(std::shared_ptr<TreeNode> leaf)
+/**
+ * Progressive widening: add the best candidate move of node that has no child yet.
+ * `board` is the board at node. Does nothing if another thread is widening node.
+ */
+void MonteCarloTreeSearch::Widen(int node, const BitBoard &board)
 {
-    const int board_sz = leaf->state.size();
-    int opponent_stone_id = get_opponent_id(leaf->stone_id);
-    auto expansion_uniform = [&]() {
+    TreeNode &n = nodes[node];
+    std::uint8_t expand_state = TreeNode::kPartiallyExpanded;
+    if (!n.expand_state.compare_exchange_strong(expand_state, TreeNode::kWidening, std::memory_order_acq_rel)) {
+        return;
+    }
+    std::array<std::uint32_t, BitBoard::kMaxSize> has_child{};
+    ForEachChild(node, [&](int ch) { has_child[nodes[ch].move_x] |= 1u << nodes[ch].move_y; });
+
+    int opponent_stone_id = get_opponent_id(n.stone_id);
+    auto candidates = ListCandidates(board, opponent_stone_id);
+    auto it = std::find_if(candidates.begin(), candidates.end(), [&](const std::pair<int, int> &move) {
+        return (has_child[move.first] >> move.second & 1u) == 0;
+    });
+    if (it != candidates.end()) {
+        int child = nodes.Allocate(1);
+        InitChild(child, node, *it, opponent_stone_id, board);
+        nodes[child].next_sibling = n.first_child.load(std::memory_order_relaxed);
+        n.first_child.store(child, std::memory_order_release);
+        n.num_children.fetch_add(1, std::memory_order_release);
+    }
+    bool widened_fully = n.NumChildren() >= static_cast<int>(candidates.size());
+    n.expand_state.store(widened_fully ? TreeNode::kExpanded : TreeNode::kPartiallyExpanded,
+                         std::memory_order_release);
+}
+
+/**
+ * @return: number of children progressive widening allows for node, from its visits.
+ */
+int MonteCarloTreeSearch::AllowedChildren(int node) const
+{
+    double visits = std::max(1, nodes[node].total_rounds.load(std::memory_order_relaxed));
+    return std::max(1, static_cast<int>(std::ceil(widening_coef * std::pow(visits, widening_exponent))));
+}
+
+/**
+ * Candidate moves at `board` for stone_id: every empty place with UniformPlayout, the near
+ * empty places with NearPlacePlayout and ThreatPlayout. With progressive widening they are ordered best first,
+ * by PlacePrior if widening_prior is set, then by the Zobrist hash of the resulting position.
+ * The order only depends on the position, so Widen can pick up where Expansion stopped.
+ */
+std::vector<std::pair<int, int>> MonteCarloTreeSearch::ListCandidates(const BitBoard &board, int stone_id) const
+{
+    const int board_sz = board.Size();
+    std::vector<std::pair<int, int>> candidates;
+    switch (playout_policy) {
+    case PlayoutPolicy::UniformPlayout:
         for (int i = 0; i < board_sz; ++i) {
             for (int j = 0; j < board_sz; ++j) {
-                if (leaf->state[i][j] == 0) {
-                    leaf->state[i][j] = opponent_stone_id;
-                    auto new_node = std::make_shared<TreeNode>(leaf->state, leaf, opponent_stone_id, std::make_pair(i, j));
-                    leaf->children.emplace_back(new_node);
-                    leaf->state[i][j] = 0;
+                if (board.IsEmpty(i, j)) {
+                    candidates.emplace_back(i, j);
                 }
             }
         }
-    };
-
-    auto expansion_near_place = [&]() {
-        auto candidates = ScanForEmptyPlace(leaf->state, near_playout_policy_distance);
-        for (auto &pos : candidates) {
-            leaf->state[pos.first][pos.second] = opponent_stone_id;
-            auto new_node = std::make_shared<TreeNode>(leaf->state, leaf, opponent_stone_id, pos);
-            leaf->children.emplace_back(new_node);
-            leaf->state[pos.first][pos.second] = 0;
-        }
-    };
-
-    switch (playout_policy) {
-    case PlayoutPolicy::UniformPlayout:
-        expansion_uniform();
         break;
     case PlayoutPolicy::NearPlacePlayout:
+    case PlayoutPolicy::ThreatPlayout:
     default:
-        expansion_near_place();
+        board.ForEachNearEmpty([&](int i, int j) { candidates.emplace_back(i, j); });
         break;
     }
-    std::shuffle(leaf->children.begin(), leaf->children.end(), rand_engine);
-}
+    if (!progressive_widening) {
+        return candidates;
+    }
 
+    // (-prior, hash) of each candidate, sorted ascending.
+    std::vector<std::tuple<int, std::uint64_t, std::pair<int, int>>> keyed;
+    keyed.reserve(candidates.size());
+    for (const auto &move : candidates) {
+        int prior = widening_prior ? PlacePrior(board, move.first, move.second) : 0;
+        keyed.emplace_back(-prior, board.Hash() ^ BitBoard::ZobristKey(move.first, move.second, stone_id), move);
+    }
+    std::sort(keyed.begin(), keyed.end());
+    for (size_t i = 0; i < keyed.size(); ++i) {
+        candidates[i] = std::get<2>(keyed[i]);
+    }
+    return candidates;
+}
 
-std::shared_ptr<MonteCarloTreeSearch::TreeNode> MonteCarloTreeSearch::SearchLeaf(
-    std::shared_ptr<MonteCarloTreeSearch::TreeNode> node)
+/**
+ * Fill in child of parent reached by stone_id playing `move` on `board`. If the resulting
+ * position is in the transposition table the child becomes an alias, otherwise it is stored.
+ */
+void MonteCarloTreeSearch::InitChild(int child, int parent, const std::pair<int, int> &move, int stone_id,
+    const BitBoard &board)
 {
-    std::shared_ptr<TreeNode> cur = node;
-    while (!cur->children.empty()) {
-        cur = *std::max_element(cur->children.begin(), cur->children.end(),
-            [](const std::shared_ptr<TreeNode> &a, const std::shared_ptr<TreeNode> &b) {
-                return a->GetExploitPriority() < b->GetExploitPriority();
-            });
+    TreeNode &ch = nodes[child];
+    ch.parent = parent;
+    ch.move_x = move.first;
+    ch.move_y = move.second;
+    ch.stone_id = stone_id;
+    if (transposition_table_.Capacity() == 0) {
+        return;
+    }
+    std::uint64_t hash = board.Hash() ^ BitBoard::ZobristKey(move.first, move.second, stone_id);
+    int same = transposition_table_.Lookup(hash);
+    if (same >= 0) {
+        ch.first_child.store(same, std::memory_order_relaxed);
+        ch.expand_state.store(TreeNode::kAlias, std::memory_order_relaxed);
+        return;
     }
-    return cur;
+    auto visits = [this](int node) { return nodes[node].total_rounds.load(std::memory_order_relaxed); };
+    transposition_table_.Store(hash, child, visits);
+}
+
+
+int MonteCarloTreeSearch::GetMostPriorityChild(int node) const
+{
+    const int parent_visits = nodes[node].GetVisits();
+    int max_arg = -1;
+    double max_priority = 0;
+    ForEachChild(node, [&](int ch) {
+        double priority = nodes[Resolve(ch)].ComputeExploitPriority(parent_visits);
+        if (max_arg < 0 || priority > max_priority) {
+            max_priority = priority;
+            max_arg = ch;
+        }
+    });
+    return max_arg;
 }
 
 /**
  * @return: 0 -> draw; 1 -> stone_id win; 2 -> stone_id loss.
  */
-int MonteCarloTreeSearch::RolloutPlay(const StateType &state, int stone_id)
+int MonteCarloTreeSearch::RolloutPlay(BitBoard &board, int stone_id, RandEngine &rand_engine, int &rollout_length)
 {
     switch (playout_policy)
     {
     case PlayoutPolicy::UniformPlayout:
-        return UniformPlayoutPolicy(state, stone_id);
+        return UniformPlayoutPolicy(board, stone_id, rand_engine, rollout_length);
+    case PlayoutPolicy::ThreatPlayout:
+        board.SetNearDistance(near_playout_policy_distance);
+        return ThreatPlayoutPolicy(board, stone_id, rand_engine, rollout_length);
     case PlayoutPolicy::NearPlacePlayout:
     default:
-        return NearPlacePlayoutPolicy(state, stone_id, near_playout_policy_distance);
+        board.SetNearDistance(near_playout_policy_distance);
+        return NearPlacePlayoutPolicy(board, stone_id, rand_engine, rollout_length);
     }
 }
 
+/**
+ * @return: true if the most visited root child leads the runner-up by more than `remaining_iterations` visits.
+ */
+bool MonteCarloTreeSearch::IsBestMoveSettled(double remaining_iterations) const
+{
+    int best = 0;
+    int second = 0;
+    ForEachChild(root, [&](int ch) {
+        int visits = nodes[Resolve(ch)].total_rounds.load(std::memory_order_relaxed);
+        if (visits > best) {
+            second = best;
+            best = visits;
+        } else if (visits > second) {
+            second = visits;
+        }
+    });
+    return best > 0 && best - second > remaining_iterations;
+}
+
 /**
  * Move to most exploited nodes
  */
-std::shared_ptr<MonteCarloTreeSearch::TreeNode> MonteCarloTreeSearch::GetMostTotalRoundsChild()
+int MonteCarloTreeSearch::GetMostTotalRoundsChild() const
 {
-    if (root->children.empty()) {
+    int max_total_rounds = 0;
+    int max_arg = -1;
+    ForEachChild(root, [&](int ch) {
+        int total_rounds = nodes[Resolve(ch)].total_rounds;
+        if (max_arg < 0 || total_rounds > max_total_rounds) {
+            max_total_rounds = total_rounds;
+            max_arg = ch;
+        }
+    });
+    if (max_arg < 0) {
         throw std::runtime_error("No succesive state exist for root node!");
     }
-    int max_total_rounds = root->children[0]->total_rounds;
-    size_t max_arg = 0;
-    for (size_t i = 1; i < root->children.size(); ++i) {
-        if (root->children[i]->total_rounds > max_total_rounds) {
-            max_total_rounds = root->children[i]->total_rounds;
-            max_arg = i;
-        }
+    return max_arg;
+}
+
+MonteCarloTreeSearch::NodeInfo MonteCarloTreeSearch::GetNode(int index) const
+{
+    if (index < 0 || index >= nodes.End()) {
+        throw std::out_of_range("node index out of range");
     }
-    return root->children[max_arg];
+    const TreeNode &n = nodes[index];
+    const int canonical = Resolve(index);
+    const TreeNode &c = nodes[canonical];
+    return NodeInfo{index, canonical, n.GetMove(), n.stone_id, c.win_rounds.load(), c.total_rounds.load(),
+                    n.parent, c.first_child.load(), n.next_sibling, c.IsExpanded() ? c.NumChildren() : 0};
 }
 
+std::vector<MonteCarloTreeSearch::NodeInfo> MonteCarloTreeSearch::GetRootChildren() const
+{
+    std::vector<NodeInfo> res;
+    ForEachChild(root, [&](int ch) { res.emplace_back(GetNode(ch)); });
+    return res;
+}
+
+/**
+ * Fill root_stats_ from the current root children and return it. The buffers are refilled in
+ * place by later calls, and replaced only when the board size changes, so a caller holding
+ * the returned pointer always sees valid memory.
+ */
+std::shared_ptr<const MonteCarloTreeSearch::RootStats> MonteCarloTreeSearch::UpdateRootStats()
+{
+    const int board_sz = root_board.Size();
+    const int num_cells = board_sz * board_sz;
+    if (root_stats_ == nullptr || root_stats_->board_size != board_sz) {
+        root_stats_ = std::make_shared<RootStats>();
+        root_stats_->board_size = board_sz;
+        root_stats_->visits.resize(num_cells);
+        root_stats_->win_rates.resize(num_cells);
+        root_stats_->ucb.resize(num_cells);
+    }
+    RootStats &stats = *root_stats_;
+    std::fill(stats.visits.begin(), stats.visits.end(), 0);
+    std::fill(stats.win_rates.begin(), stats.win_rates.end(), std::numeric_limits<float>::quiet_NaN());
+    std::fill(stats.ucb.begin(), stats.ucb.end(), std::numeric_limits<float>::quiet_NaN());
+    const int parent_visits = nodes[root].GetVisits();
+    ForEachChild(root, [&](int ch) {
+        const TreeNode &c = nodes[Resolve(ch)];
+        const int cell = nodes[ch].move_x * board_sz + nodes[ch].move_y;
+        const int visits = c.total_rounds.load(std::memory_order_relaxed);
+        stats.visits[cell] = visits;
+        if (visits > 0) {
+            stats.win_rates[cell] = c.win_rounds.load(std::memory_order_relaxed) / visits;
+        }
+        stats.ucb[cell] = c.ComputeExploitPriority(parent_visits);
+    });
+    return root_stats_;
+}
+
+/**
+ * Rebuild the board at node by replaying moves from root.
+ */
+MonteCarloTreeSearch::StateType MonteCarloTreeSearch::GetNodeState(int index) const
+{
+    GetNode(index); // range check
+    StateType state = root_board.ToState();
+    for (int cur = index; cur != root && cur >= 0; cur = nodes[cur].parent) {
+        const TreeNode &n = nodes[cur];
+        state[n.move_x][n.move_y] = n.stone_id;
+    }
+    return state;
+}
@@ -8,6 +8,15 @@
 #include <pybind11/numpy.h>
 #include <iostream>
 #include <memory>
+#include <atomic>
+#include <cstdint>
+#include <functional>
+#include <string>
+
+#include "node_arena.h"
+#include "bit_board.h"
+#include "transposition_table.h"
+#include "tree_file.h"
 
 inline int get_opponent_id(int stone_id) {
     return 3 - stone_id;
@@ -17,128 +26,398 @@ class MonteCarloTreeSearch {
 public:
     enum class PlayoutPolicy {
         UniformPlayout = 0,
-        NearPlacePlayout = 1
+        NearPlacePlayout = 1,
+        // near places, weighted by the threats (five, fours, threes) they make or block.
+        ThreatPlayout = 2
     };
 
     int near_playout_policy_distance = 2;
     PlayoutPolicy playout_policy = PlayoutPolicy::NearPlacePlayout;
+    // number of worker threads running tree-parallel search in SearchMove.
+    int num_threads = 1;
+    // visits counted as losses on nodes of an in-flight path, used only when num_threads > 1.
+    int virtual_loss = 1;
+    // seed of the random streams, each worker thread derives its own stream from it.
+    unsigned int random_seed = std::random_device{}();
+    // stop SearchMove once the most visited root child can't be overtaken within the remaining budget.
+    bool early_stop = true;
+    // number of iterations run by the last SearchMove.
+    int last_search_iterations = 0;
+    // number of rollouts run by the last SearchMove, iterations ending at a decided game run none.
+    int last_search_rollouts = 0;
+    // entries of the transposition table sharing nodes of positions reached by different move orders, 0 disables it.
+    int transposition_table_size = 1 << 20;
+    // set from another thread to make a running SearchMove return early, cleared when SearchMove returns.
+    std::atomic<bool> stop_search{false};
+    // create children on demand (progressive widening) instead of all at once when a node is expanded.
+    bool progressive_widening = false;
+    // with progressive widening, a node visited n times may have ceil(widening_coef * n ^ widening_exponent) children.
+    double widening_coef = 2.0;
+    double widening_exponent = 0.5;
+    // with progressive widening, children are created best first by a prior favouring places near
+    // many stones; otherwise in a pseudo-random order fixed by the position.
+    bool widening_prior = true;
+    // most nodes the tree may hold during SearchMove, 0 for unlimited. When reached, the least
+    // visited subtrees are collapsed into their roots and their nodes reused by new expansions.
+    // The transposition table then holds at most 2 * node_budget entries.
+    int node_budget = 0;
+    // show a progress bar and print statistics of root children in SearchMove.
+    bool verbose = false;
 
     using StateType = std::vector<std::vector<int>>;
+    using RandEngine = std::default_random_engine;
+
+    /**
+     * Compact tree node stored in a NodeArena. It keeps only the move leading to it,
+     * statistics and links by index; the board is rebuilt along the selection path.
+     * Children form a list linked by next_sibling; Expansion allocates them as one contiguous
+     * block, progressive widening prepends them one at a time.
+     * A node whose position was already in the search graph is an alias: it keeps its own
+     * move and parent, while statistics and children live in the node at first_child.
+     */
     struct TreeNode {
-        StateType state;
-        std::shared_ptr<TreeNode> parent;
-        int stone_id;
-        std::pair<int, int> from_moving;
-        std::vector<std::shared_ptr<TreeNode>> children;
-        double win_rounds = 0;
-        int total_rounds = 0;
+        enum ExpandState : std::uint8_t {
+            kUnexpanded = 0,
+            kExpanding = 1,
+            kExpanded = 2,          // every candidate move has its child
+            kAlias = 3,
+            kPartiallyExpanded = 4, // progressive widening may add more children
+            kWidening = 5           // a thread is adding a child, the list stays readable
+        };
 
-        TreeNode(const StateType &state, std::shared_ptr<TreeNode> parent, int stone_id,
-                 const std::pair<int, int> &from_moving) : state{state},
-                 parent{parent}, stone_id{stone_id}, from_moving{from_moving} {
+        std::atomic<double> win_rounds{0};
+        std::atomic<int> total_rounds{0};
+        int parent = -1;
+        // head of the children list, published after the children it links are written.
+        // for an alias, index of the node sharing its position.
+        std::atomic<int> first_child{-1};
+        int next_sibling = -1;
+        std::atomic<std::int16_t> num_children{0};
+        std::atomic<std::int16_t> virtual_loss{0};
+        std::int8_t move_x = -1;
+        std::int8_t move_y = -1;
+        std::int8_t stone_id = 0; // id of last moved stone which leads to this node
+        std::atomic<std::uint8_t> expand_state{kUnexpanded};
+
+        std::pair<int, int> GetMove() const {
+            return {move_x, move_y};
         }
 
-        void UpdateRounds(double added_win_rounds, int added_total_rounds) {
-            win_rounds += added_win_rounds;
-            total_rounds += added_total_rounds;
+        bool IsExpanded() const {
+            std::uint8_t state = expand_state.load(std::memory_order_acquire);
+            return state == kExpanded || state >= kPartiallyExpanded;
+        }
+
+        int NumChildren() const {
+            return num_children.load(std::memory_order_acquire);
         }
 
-        double GetExploitPriority() const {
-            if (parent == nullptr) {
-                return 0.0;
+        void UpdateRounds(double added_win_rounds, int added_total_rounds) {
+            double cur = win_rounds.load(std::memory_order_relaxed);
+            while (!win_rounds.compare_exchange_weak(cur, cur + added_win_rounds, std::memory_order_relaxed)) {
             }
-            return ComputeExploitPriority(parent->total_rounds);
+            total_rounds.fetch_add(added_total_rounds, std::memory_order_relaxed);
+        }
+
+        int GetVisits() const {
+            return total_rounds.load(std::memory_order_relaxed) + virtual_loss.load(std::memory_order_relaxed);
         }
 
-    private:
         double ComputeExploitPriority(int parent_total_rounds) const {
             const double coef = 1.4142135623730951; // sqrt(2)
-            if (total_rounds == 0) {
+            // in-flight visits of other threads count as losses, steering them to other paths.
+            int visits = GetVisits();
+            if (visits == 0) {
                 return std::numeric_limits<double>::infinity();
             }
-            double win_ratio = win_rounds / total_rounds;
-            double exploit = coef * std::sqrt(std::log<double>(parent_total_rounds) / total_rounds);
+            double win_ratio = win_rounds.load(std::memory_order_relaxed) / visits;
+            double exploit = coef * std::sqrt(std::log(static_cast<double>(parent_total_rounds)) / visits);
             return win_ratio + exploit;
         }
     };
 
-    
-    std::shared_ptr<TreeNode> root;
+    /**
+     * Snapshot of a tree node handed to Python.
+     */
+    struct NodeInfo {
+        int index;
+        int canonical; // node holding the statistics, differs from index for an alias
+        std::pair<int, int> from_moving;
+        int stone_id;
+        double win_rounds;
+        int total_rounds;
+        int parent;
+        int first_child;
+        int next_sibling;
+        int num_children;
+    };
+
+    /**
+     * Counters collected by a search. Phase times are summed over worker threads, so with
+     * num_threads > 1 they add up to more than total_time.
+     */
+    struct SearchStats {
+        int iterations = 0;
+        int selection_count = 0;
+        int expansion_count = 0;
+        int rollout_count = 0;
+        int backprop_count = 0;
+        double selection_time = 0; // seconds
+        double expansion_time = 0;
+        double rollout_time = 0;
+        double backprop_time = 0;
+        double total_time = 0; // wall-clock seconds of the whole search
+        std::int64_t rollout_moves = 0; // stones placed by all rollouts
+        int terminal_hits = 0; // iterations whose selected node already ends the game
+        int nodes_allocated = 0;
+        int evictions = 0; // times the tree was shrunk for reaching node_budget
+        int nodes_evicted = 0; // nodes given back by those evictions
+        size_t peak_memory_bytes = 0; // bytes of node arena and transposition table
+
+        double AverageRolloutLength() const {
+            return rollout_count > 0 ? static_cast<double>(rollout_moves) / rollout_count : 0.0;
+        }
+
+        void Merge(const SearchStats &other) {
+            selection_count += other.selection_count;
+            expansion_count += other.expansion_count;
+            rollout_count += other.rollout_count;
+            backprop_count += other.backprop_count;
+            selection_time += other.selection_time;
+            expansion_time += other.expansion_time;
+            rollout_time += other.rollout_time;
+            backprop_time += other.backprop_time;
+            rollout_moves += other.rollout_moves;
+            terminal_hits += other.terminal_hits;
+        }
+    };
+
+    /**
+     * Statistics of root children laid out as the board, row major. Cells without a root
+     * child hold 0 visits and NaN rates. Buffers are shared with the arrays handed to Python.
+     */
+    struct RootStats {
+        int board_size = 0;
+        std::vector<std::int32_t> visits;
+        std::vector<float> win_rates; // from the view of the player to move at root
+        std::vector<float> ucb;       // UCT priority used by Selection, inf for unvisited children
+    };
+
+    /**
+     * Budgets and tree parameters shared by all positions of BatchSearchMove.
+     */
+    struct SearchConfig {
+        int iter_steps = 5000;
+        double time_limit_ms = 0;
+        int max_nodes = 0;
+        int node_budget = 0;
+        PlayoutPolicy playout_policy = PlayoutPolicy::NearPlacePlayout;
+        int near_playout_policy_distance = 2;
+        bool early_stop = true;
+        int transposition_table_size = 1 << 20;
+        bool progressive_widening = false;
+        double widening_coef = 2.0;
+        double widening_exponent = 0.5;
+        unsigned int random_seed = 0;
+    };
+
+    /**
+     * Flattened results of BatchSearchMove, position i at row i.
+     */
+    struct BatchSearchResult {
+        int board_size = 0;
+        std::vector<int> best_moves;      // (B, 2), {-1, -1} if the board is full
+        std::vector<double> win_rounds;   // (B,) of the best move
+        std::vector<int> total_rounds;    // (B,) of the best move
+        std::vector<int> iterations;      // (B,)
+        std::vector<int> visits;          // (B, N, N) total rounds of each root child
+    };
+
+    /**
+     * Per-thread search state: its own random stream, the virtual loss it applies,
+     * and the board of the node currently visited together with the path leading to it.
+     */
+    struct SearchWorker {
+        RandEngine rand_engine;
+        int virtual_loss = 0;
+        BitBoard board;
+        std::vector<int> path;
+        SearchStats stats;
+    };
+
+    NodeArena<TreeNode> nodes;
+    int root = 0;
+    // counters of the last SearchMove.
+    SearchStats last_search_stats;
+    BitBoard root_board;
     int stone_id;
 
-    MonteCarloTreeSearch(const StateType &root_state, int stone_id) : 
-        stone_id{stone_id} {
-        root = std::make_shared<TreeNode>(root_state, nullptr, get_opponent_id(stone_id), std::pair{-1, -1});
+    MonteCarloTreeSearch(const StateType &root_state, int stone_id) :
+        root_board{BitBoard::FromState(root_state)}, stone_id{stone_id} {
+        ResetTree(get_opponent_id(stone_id), {-1, -1});
     }
 
-    MonteCarloTreeSearch(const pybind11::array_t<int> &root_state, int stone_id) :
-        MonteCarloTreeSearch(ConvertNumpyToStateType(root_state), stone_id){
+    MonteCarloTreeSearch(const pybind11::array &root_state, int stone_id) :
+        root_board{BoardFromNumpy(root_state)}, stone_id{stone_id} {
+        ResetTree(get_opponent_id(stone_id), {-1, -1});
     }
 
-    std::pair<int, int> SearchMove(int iter_steps = 5000);
+    std::pair<int, int> SearchMove(int iter_steps = 5000, double time_limit_ms = 0, int max_nodes = 0);
+
+    static BatchSearchResult BatchSearchMove(const std::vector<StateType> &states,
+        const std::vector<int> &stone_ids, const SearchConfig &config, int num_threads);
 
-    std::shared_ptr<TreeNode> Selection();
+    bool AdvanceRoot(const std::pair<int, int> &move);
 
-    void Expansion(std::shared_ptr<TreeNode> leaf);
+    void SaveTree(const std::string &path, int max_nodes = 0) const;
 
-    void BackPropagation(std::shared_ptr<TreeNode> node, int leaf_stone_id, int game_res);
+    void LoadTree(const std::string &path);
+
+    static std::unique_ptr<MonteCarloTreeSearch> FromTreeFile(const std::string &path);
+
+    int Selection();
+
+    void Expansion(int leaf);
+
+    void BackPropagation(int node, int leaf_stone_id, int game_res);
+
+    NodeInfo GetNode(int index) const;
+
+    std::vector<NodeInfo> GetRootChildren() const;
+
+    std::shared_ptr<const RootStats> UpdateRootStats();
+
+    StateType GetNodeState(int index) const;
+
+    size_t GetMemoryUsage() const {
+        return nodes.Bytes();
+    }
+
+    size_t GetTranspositionTableSize() const {
+        return transposition_table_.Size();
+    }
 
     int GetTreeNodesNumbers() const {
-        return GetTreeNodesNumbers_(*root);
+        return GetTreeNodesNumbers_(root);
     }
 
     int GetTreeDepth() const {
-        return GetTreeDepth_(*root);
+        return GetTreeDepth_(root);
     }
 
     std::vector<int> StaticDepthNodesNumbers() const {
         std::vector<int> depth_nodes_numbers;
-        std::function<void(const TreeNode &, int)> dfs =
-            [&](const TreeNode &node, int depth) {
+        std::function<void(int, int)> dfs =
+            [&](int node, int depth) {
                 if (depth >= depth_nodes_numbers.size()) {
                     depth_nodes_numbers.push_back(0);
                 }
                 depth_nodes_numbers[depth] += 1;
-                for (const auto &ch : node.children) {
-                    dfs(*ch, depth + 1);
-                }
+                ForEachChild(node, [&](int ch) { dfs(ch, depth + 1); });
             };
-        dfs(*root, 0);
+        dfs(root, 0);
         return depth_nodes_numbers;
     }
 
 private:
-    int GetTreeNodesNumbers_(const TreeNode &node) const {
-        int count = 1;
-        for (auto &ch : node.children) {
-            count += GetTreeNodesNumbers_(*ch);
+    // iterations between two early stop checks of SearchMove.
+    static constexpr int kEarlyStopCheckInterval = 64;
+    // an eviction frees room for this many expansions with a child on every place, but at least
+    // a quarter and at most half of node_budget.
+    static constexpr int kEvictionExpansions = 64;
+
+    unsigned int search_count_ = 0;
+    // random stream of the phase functions called directly from Python.
+    RandEngine rand_engine_{random_seed};
+    TranspositionTable transposition_table_;
+    // reused by UpdateRootStats while the board size stays the same.
+    std::shared_ptr<RootStats> root_stats_;
+
+    void ResetTree(int root_stone_id, const std::pair<int, int> &root_move);
+    void PrepareBoard(BitBoard &board) const;
+    int RunSearch(int iter_steps, double time_limit_ms, int max_nodes, const std::function<void()> &tick);
+    void EnsureTranspositionTable();
+    void RebuildTranspositionTable();
+    int CollapseTree(int max_nodes);
+    int CollapseTarget() const;
+    int TranspositionTableSize() const;
+    std::vector<TreeRecord> FlattenTree(int from, int max_nodes) const;
+    void BuildTree(const TreeRecord *records, int num_records);
+    int Selection(SearchWorker &worker);
+    bool Expansion(int leaf, const BitBoard &board, RandEngine &rand_engine);
+    void Widen(int node, const BitBoard &board);
+    int AllowedChildren(int node) const;
+    std::vector<std::pair<int, int>> ListCandidates(const BitBoard &board, int stone_id) const;
+    void InitChild(int child, int parent, const std::pair<int, int> &move, int stone_id, const BitBoard &board);
+    void BackPropagation(const std::vector<int> &path, int leaf_stone_id, int game_res, int virtual_loss);
+    void UpdateNode(TreeNode &n, int leaf_stone_id, int game_res, int virtual_loss);
+    void SearchIteration(SearchWorker &worker);
+    int VisitNode(SearchWorker &worker, int node);
+
+    /**
+     * @return: node holding statistics and children of node, i.e. the target of an alias.
+     */
+    int Resolve(int node) const {
+        const TreeNode &n = nodes[node];
+        return n.expand_state.load(std::memory_order_acquire) == TreeNode::kAlias ?
+            n.first_child.load(std::memory_order_relaxed) : node;
+    }
+
+    template <typename Func>
+    void ForEachChild(int node, Func &&func) const {
+        const TreeNode &n = nodes[node];
+        if (!n.IsExpanded()) {
+            return;
         }
+        for (int ch = n.first_child.load(std::memory_order_acquire); ch >= 0; ch = nodes[ch].next_sibling) {
+            func(ch);
+        }
+    }
+
+    int GetTreeNodesNumbers_(int node) const {
+        int count = 1;
+        ForEachChild(node, [&](int ch) { count += GetTreeNodesNumbers_(ch); });
         return count;
     }
 
-    int GetTreeDepth_(const TreeNode &node) const {
+    int GetTreeDepth_(int node) const {
         int depth = 0;
-        for (auto &ch : node.children) {
-            depth = std::max(depth, GetTreeDepth_(*ch));
-        }
+        ForEachChild(node, [&](int ch) { depth = std::max(depth, GetTreeDepth_(ch)); });
         return depth + 1;
     }
 
 
-    std::shared_ptr<TreeNode> GetMostTotalRoundsChild();
-    int RolloutPlay(const StateType &state, int stone_id);
-    std::shared_ptr<TreeNode> SearchLeaf(std::shared_ptr<TreeNode> node);
+    int GetMostTotalRoundsChild() const;
+    bool IsBestMoveSettled(double remaining_iterations) const;
+    int RolloutPlay(BitBoard &board, int stone_id, RandEngine &rand_engine, int &rollout_length);
+    int GetMostPriorityChild(int node) const;
 
-    static StateType ConvertNumpyToStateType(const pybind11::array_t<int> &array) {
-        auto buf = array.unchecked<2>(); // 2D array
-        StateType state(buf.shape(0), std::vector<int>(buf.shape(1)));
-        for (size_t i = 0; i < buf.shape(0); ++i) {
-            for (size_t j = 0; j < buf.shape(1); ++j) {
-                state[i][j] = buf(i, j);
-            }
+    /**
+     * Read a (N, N) board from a NumPy array. int8, uint8 and int32 arrays of any strides are
+     * read in place, other dtypes are converted first.
+     */
+    static BitBoard BoardFromNumpy(const pybind11::array &array) {
+        if (array.ndim() != 2 || array.shape(0) != array.shape(1)) {
+            throw std::invalid_argument("root_state should be of shape (N, N)");
+        }
+        auto read = [](auto buf) {
+            return BitBoard::FromCells(buf.shape(0), [&buf](int i, int j) { return static_cast<int>(buf(i, j)); });
+        };
+        if (pybind11::isinstance<pybind11::array_t<std::int8_t>>(array)) {
+            return read(array.unchecked<std::int8_t, 2>());
+        }
+        if (pybind11::isinstance<pybind11::array_t<std::uint8_t>>(array)) {
+            return read(array.unchecked<std::uint8_t, 2>());
+        }
+        if (pybind11::isinstance<pybind11::array_t<std::int32_t>>(array)) {
+            return read(array.unchecked<std::int32_t, 2>());
+        }
+        auto converted = pybind11::array_t<int, pybind11::array::forcecast>::ensure(array);
+        if (!converted) {
+            throw std::invalid_argument("root_state should be an integer array");
         }
-        return state;
+        return read(converted.unchecked<2>());
     }
 };
 
-#endif // __MONTE_CARLO_TREE_SEARCH_H__
\ No newline at end of file
+#endif // __MONTE_CARLO_TREE_SEARCH_H__
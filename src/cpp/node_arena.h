@@ -0,0 +1,153 @@
+#ifndef __NODE_ARENA_H__
+#define __NODE_ARENA_H__
+
+#include <algorithm>
+#include <cstddef>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <new>
+#include <stdexcept>
+#include <utility>
+#include <vector>
+
+/**
+ * Contiguous storage of tree nodes addressed by int index.
+ * Nodes live in fixed-size chunks that are never moved, so an index (and a reference
+ * to the node) stays valid while other threads allocate. A block returned by Allocate
+ * never crosses a chunk boundary, thus children of a node are contiguous in memory.
+ * Released nodes are kept in free blocks, which Allocate reuses before growing the arena.
+ */
+template <typename Node>
+class NodeArena {
+public:
+    static constexpr int kChunkBits = 16;
+    static constexpr int kChunkSize = 1 << kChunkBits;
+    static constexpr int kMaxChunks = 1 << 14;
+
+    NodeArena() : chunks_(new std::unique_ptr<Node[]>[kMaxChunks]) {
+    }
+
+    NodeArena(NodeArena &&) = default;
+    NodeArena &operator=(NodeArena &&) = default;
+
+    Node &operator[](int index) {
+        return chunks_[index >> kChunkBits][index & (kChunkSize - 1)];
+    }
+
+    const Node &operator[](int index) const {
+        return chunks_[index >> kChunkBits][index & (kChunkSize - 1)];
+    }
+
+    /**
+     * Allocate `count` contiguous default constructed nodes. Thread safe.
+     * @return: index of the first node.
+     */
+    int Allocate(int count) {
+        if (count <= 0 || count > kChunkSize) {
+            throw std::invalid_argument("NodeArena: invalid block size");
+        }
+        std::lock_guard<std::mutex> lock(*mutex_);
+        // best fit among free blocks, the rest of the block stays free.
+        auto it = free_blocks_.lower_bound(count);
+        if (it != free_blocks_.end()) {
+            const int block_size = it->first;
+            const int first = it->second.back();
+            it->second.pop_back();
+            if (it->second.empty()) {
+                free_blocks_.erase(it);
+            }
+            if (block_size > count) {
+                free_blocks_[block_size - count].push_back(first + count);
+            }
+            used_ += count;
+            return first;
+        }
+        int offset = size_ & (kChunkSize - 1);
+        if (offset != 0 && offset + count > kChunkSize) {
+            // leave the tail of current chunk to smaller blocks rather than split the block.
+            free_blocks_[kChunkSize - offset].push_back(size_);
+            size_ += kChunkSize - offset;
+        }
+        int chunk = size_ >> kChunkBits;
+        if (chunk >= kMaxChunks) {
+            throw std::runtime_error("NodeArena: out of capacity");
+        }
+        if (chunks_[chunk] == nullptr) {
+            chunks_[chunk].reset(new Node[kChunkSize]);
+            ++num_chunks_;
+        }
+        int first = size_;
+        size_ += count;
+        used_ += count;
+        return first;
+    }
+
+    /**
+     * Give back nodes, which are reset to default constructed ones and reused by Allocate.
+     * Free nodes adjacent in a chunk are merged into one block, so blocks released node by
+     * node serve large allocations again. Must not run concurrently with readers of the nodes.
+     */
+    void Release(std::vector<int> indices) {
+        std::lock_guard<std::mutex> lock(*mutex_);
+        for (int index : indices) {
+            Node &n = (*this)[index];
+            n.~Node();
+            new (&n) Node();
+        }
+        used_ -= static_cast<int>(indices.size());
+        // (first, size) of every free block, then merged where they touch.
+        std::vector<std::pair<int, int>> blocks;
+        for (const auto &[block_size, firsts] : free_blocks_) {
+            for (int first : firsts) {
+                blocks.emplace_back(first, block_size);
+            }
+        }
+        for (int index : indices) {
+            blocks.emplace_back(index, 1);
+        }
+        std::sort(blocks.begin(), blocks.end());
+        free_blocks_.clear();
+        for (size_t i = 0; i < blocks.size();) {
+            auto [first, block_size] = blocks[i++];
+            while (i < blocks.size() && blocks[i].first == first + block_size &&
+                   (blocks[i].first & (kChunkSize - 1)) != 0) {
+                block_size += blocks[i++].second;
+            }
+            free_blocks_[block_size].push_back(first);
+        }
+    }
+
+    /**
+     * @return: number of allocated nodes, released ones excluded.
+     */
+    int Size() const {
+        return used_;
+    }
+
+    /**
+     * @return: one past the largest allocated index.
+     */
+    int End() const {
+        return size_;
+    }
+
+    /**
+     * @return: bytes held by the arena.
+     */
+    size_t Bytes() const {
+        return static_cast<size_t>(num_chunks_) * kChunkSize * sizeof(Node);
+    }
+
+private:
+    std::unique_ptr<std::unique_ptr<Node[]>[]> chunks_;
+    // held by pointer to keep the arena movable.
+    std::unique_ptr<std::mutex> mutex_ = std::make_unique<std::mutex>();
+    // block size -> first index of the free blocks of that size.
+    std::map<int, std::vector<int>> free_blocks_;
+    int size_ = 0;
+    int used_ = 0;
+    int num_chunks_ = 0;
+};
+
+#endif // __NODE_ARENA_H__
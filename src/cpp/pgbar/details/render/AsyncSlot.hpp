@@ -34,6 +34,9 @@ namespace pgbar {
           console::TermContext<Tag>::itself().virtual_term();
 
           PGBAR__ASSERT( runner_.get_id() == std::thread::id() );
+          // Leave the Dead state before the thread starts, otherwise a thread scheduled
+          // right away sees Dead, exits at once, and activate() spins forever.
+          state_.store( State::Dormant, std::memory_order_release );
           try {
             runner_ = std::thread( [this]() {
               try {
@@ -70,8 +73,6 @@ namespace pgbar {
             state_.store( State::Dead, std::memory_order_release );
             throw;
           }
-          auto expected = State::Dead;
-          state_.compare_exchange_strong( expected, State::Dormant, std::memory_order_release );
         }
 
         // Since the control flow of the child thread has been completely handed over to task_,
@@ -4,6 +4,8 @@
 #include <vector>
 #include <chrono>
 #include <ctime>
+#include <thread>
+#include <algorithm>
 
 void output_date_time(const char *hint_str="") {
     std::time_t t = std::time(nullptr);
@@ -37,6 +39,36 @@ void TestFunc(int board_sz = 11) {
     output_date_time("end test func");
 }
 
+/**
+ * Scaling report of tree-parallel search: iterations per second for each thread count,
+ * with transposition_table_size entries in the table (0 disables it).
+ */
+void TestThreadScaling(int board_sz = 15, int iter_steps = 100000, int transposition_table_size = 1 << 20) {
+    std::vector<std::vector<int>> state(board_sz, std::vector<int>(board_sz, 0));
+    state[board_sz / 2][board_sz / 2] = 1;
+    const int max_threads = std::max(1u, std::thread::hardware_concurrency());
+    double base_speed = 0;
+    std::cout << "transposition table size " << transposition_table_size << "\n";
+    std::cout << "threads\titer/s\tspeedup\n";
+    for (int n_threads = 1; n_threads <= max_threads; n_threads *= 2) {
+        MonteCarloTreeSearch tree(state, 2);
+        tree.num_threads = n_threads;
+        tree.random_seed = 0;
+        tree.transposition_table_size = transposition_table_size;
+        // run the whole budget, the early stop of SearchMove would vary it between thread counts.
+        tree.early_stop = false;
+        auto time1 = std::chrono::steady_clock::now();
+        tree.SearchMove(iter_steps);
+        auto time2 = std::chrono::steady_clock::now();
+        double speed = tree.last_search_iterations / std::chrono::duration<double>(time2 - time1).count();
+        if (n_threads == 1) {
+            base_speed = speed;
+        }
+        std::cout << n_threads << "\t" << speed << "\t" << speed / base_speed << "\n";
+    }
+    std::cout << std::flush;
+}
+
 int main(int argc, char** argv) {
     output_date_time();
     TestFunc(11);
@@ -44,6 +76,9 @@ int main(int argc, char** argv) {
     output_date_time();
     TestFunc(11);
     output_date_time();
+    TestThreadScaling();
+    TestThreadScaling(15, 100000, 0);
+    output_date_time();
     std::cout << "done!" << std::endl;
     return 0;
 }
\ No newline at end of file
@@ -0,0 +1,153 @@
+#ifndef __THREAT_PATTERNS_H__
+#define __THREAT_PATTERNS_H__
+
+#include <array>
+#include <cstdint>
+
+#include "bit_board.h"
+
+/**
+ * Threats a move makes on its lines, looked up in a table indexed by BitBoard::LineWindow.
+ * A window holds the 4 cells on each side of the move along one line; the table is filled
+ * once by playing out every window, so classifying a line in a rollout is a single load.
+ */
+class ThreatPatterns {
+public:
+    enum Threat : std::uint8_t {
+        kNone = 0,
+        kTwo = 1,       // one more stone makes an open three
+        kThree = 2,     // one more stone makes a four
+        kOpenThree = 3, // one more stone makes an open four
+        kFour = 4,      // one more stone makes five
+        kOpenFour = 5,  // two places make five, can't be blocked
+        kFive = 6,
+        kNumThreats = 7
+    };
+
+    /**
+     * @return: threat of placing a stone at the center of `window` (see BitBoard::LineWindow).
+     */
+    static Threat Lookup(std::uint16_t window) {
+        static const auto table = [] {
+            std::array<std::uint8_t, 1 << 16> t{};
+            for (int own = 0; own < 256; ++own) {
+                for (int blocked = 0; blocked < 256; ++blocked) {
+                    if ((own & blocked) == 0) {
+                        t[own | blocked << 8] = Classify(ToLine(own, blocked));
+                    }
+                }
+            }
+            return t;
+        }();
+        return static_cast<Threat>(table[window]);
+    }
+
+    /**
+     * Weight of playing stone_id at (pos_x, pos_y) in a threat-aware playout: 1, plus the attack
+     * weight of the threat it makes and the defense weight of the threat it takes from the
+     * opponent, summed over the 4 lines.
+     */
+    static double Urgency(const BitBoard &board, int pos_x, int pos_y, int stone_id) {
+        // a five wins at once, blocking the opponent's five comes next, then fours and threes.
+        static constexpr double kAttack[kNumThreats] = {0, 4, 20, 200, 400, 5000, 1e7};
+        static constexpr double kDefense[kNumThreats] = {0, 2, 10, 150, 300, 2000, 1e6};
+        const int opponent = 3 - stone_id;
+        double urgency = 1;
+        for (int dir = 0; dir < 4; ++dir) {
+            urgency += kAttack[Lookup(board.LineWindow(pos_x, pos_y, dir, stone_id))];
+            urgency += kDefense[Lookup(board.LineWindow(pos_x, pos_y, dir, opponent))];
+        }
+        return urgency;
+    }
+
+private:
+    static constexpr int kLen = 9;
+    static constexpr int kCenter = 4;
+    enum Cell : std::uint8_t { kEmpty = 0, kOwn = 1, kBlocked = 2 };
+    using Line = std::array<std::uint8_t, kLen>;
+
+    static Line ToLine(int own, int blocked) {
+        Line line{};
+        for (int i = 0, bit = 0; i < kLen; ++i) {
+            if (i == kCenter) {
+                line[i] = kOwn;
+                continue;
+            }
+            line[i] = (own >> bit & 1) ? kOwn : (blocked >> bit & 1) ? kBlocked : kEmpty;
+            ++bit;
+        }
+        return line;
+    }
+
+    static bool IsFive(const Line &line) {
+        int left = kCenter;
+        int right = kCenter;
+        while (left > 0 && line[left - 1] == kOwn) {
+            --left;
+        }
+        while (right < kLen - 1 && line[right + 1] == kOwn) {
+            ++right;
+        }
+        return right - left + 1 >= 5;
+    }
+
+    /**
+     * @return: number of empty cells that make five through the center.
+     */
+    static int CountFiveCompletions(Line line) {
+        int count = 0;
+        for (int i = 0; i < kLen; ++i) {
+            if (line[i] == kEmpty) {
+                line[i] = kOwn;
+                count += IsFive(line);
+                line[i] = kEmpty;
+            }
+        }
+        return count;
+    }
+
+    /**
+     * @return: best threat reachable by one more stone on an empty cell, classified with
+     * `classify`.
+     */
+    template <typename Func>
+    static Threat BestAfterOneMore(Line line, Func &&classify) {
+        Threat best = kNone;
+        for (int i = 0; i < kLen; ++i) {
+            if (line[i] == kEmpty) {
+                line[i] = kOwn;
+                Threat t = classify(line);
+                best = t > best ? t : best;
+                line[i] = kEmpty;
+            }
+        }
+        return best;
+    }
+
+    static Threat ClassifyFours(const Line &line) {
+        if (IsFive(line)) {
+            return kFive;
+        }
+        int completions = CountFiveCompletions(line);
+        return completions >= 2 ? kOpenFour : completions == 1 ? kFour : kNone;
+    }
+
+    static Threat ClassifyThrees(const Line &line) {
+        Threat t = ClassifyFours(line);
+        if (t != kNone) {
+            return t;
+        }
+        Threat next = BestAfterOneMore(line, ClassifyFours);
+        return next == kOpenFour ? kOpenThree : next == kFour ? kThree : kNone;
+    }
+
+    static Threat Classify(const Line &line) {
+        Threat t = ClassifyThrees(line);
+        if (t != kNone) {
+            return t;
+        }
+        return BestAfterOneMore(line, ClassifyThrees) == kOpenThree ? kTwo : kNone;
+    }
+};
+
+#endif // __THREAT_PATTERNS_H__
@@ -0,0 +1,167 @@
+#ifndef __TRANSPOSITION_TABLE_H__
+#define __TRANSPOSITION_TABLE_H__
+
+#include <atomic>
+#include <cstddef>
+#include <cstdint>
+#include <memory>
+#include <mutex>
+#include <utility>
+#include <vector>
+
+/**
+ * Bounded map from Zobrist hash of a position to the tree node holding its statistics.
+ * Entries are grouped in buckets of kBucketSize by the low bits of the hash. When the bucket
+ * of a new position is full, the entry whose node has the fewest visits is replaced; the
+ * replaced node stays in the tree, it's just no longer shared by later transpositions.
+ * Buckets are guarded by kNumStripes mutexes, bucket b by mutex b % kNumStripes, so that
+ * search threads expanding different nodes rarely wait on each other.
+ */
+class TranspositionTable {
+public:
+    static constexpr int kBucketSize = 4;
+    static constexpr int kNumStripes = 256;
+
+    /**
+     * @param capacity: max number of entries, rounded down to a power of two, 0 disables the table.
+     */
+    explicit TranspositionTable(size_t capacity = 0) {
+        entries_.assign(RoundCapacity(capacity), Entry{});
+        num_buckets_ = entries_.size() / kBucketSize;
+    }
+
+    /**
+     * @return: number of entries of a table created with `capacity`.
+     */
+    static size_t RoundCapacity(size_t capacity) {
+        size_t n = capacity >= kBucketSize ? kBucketSize : 0;
+        while (n != 0 && n * 2 <= capacity) {
+            n *= 2;
+        }
+        return n;
+    }
+
+    TranspositionTable(TranspositionTable &&other) noexcept {
+        *this = std::move(other);
+    }
+
+    /**
+     * Not thread safe.
+     */
+    TranspositionTable &operator=(TranspositionTable &&other) noexcept {
+        entries_ = std::move(other.entries_);
+        num_buckets_ = other.num_buckets_;
+        size_.store(other.size_.load(std::memory_order_relaxed), std::memory_order_relaxed);
+        stripes_ = std::move(other.stripes_);
+        other.num_buckets_ = 0;
+        other.size_.store(0, std::memory_order_relaxed);
+        return *this;
+    }
+
+    size_t Capacity() const {
+        return entries_.size();
+    }
+
+    size_t Bytes() const {
+        return entries_.size() * sizeof(Entry);
+    }
+
+    /**
+     * @return: number of entries in use.
+     */
+    size_t Size() const {
+        return size_.load(std::memory_order_relaxed);
+    }
+
+    /**
+     * Not thread safe.
+     */
+    void Clear() {
+        entries_.assign(entries_.size(), Entry{});
+        size_.store(0, std::memory_order_relaxed);
+    }
+
+    /**
+     * Thread safe.
+     * @return: node stored for key, -1 if absent.
+     */
+    int Lookup(std::uint64_t key) const {
+        if (num_buckets_ == 0) {
+            return -1;
+        }
+        const size_t bucket_index = key % num_buckets_;
+        std::lock_guard<std::mutex> lock(stripes_[bucket_index % kNumStripes]);
+        const Entry *bucket = entries_.data() + bucket_index * kBucketSize;
+        for (int i = 0; i < kBucketSize; ++i) {
+            if (bucket[i].node >= 0 && bucket[i].key == key) {
+                return bucket[i].node;
+            }
+        }
+        return -1;
+    }
+
+    /**
+     * Map key to node, replacing the entry of the least visited node if the bucket is full.
+     * `visits(node)` returns the visits of a stored node. Thread safe.
+     */
+    template <typename VisitsFunc>
+    void Store(std::uint64_t key, int node, VisitsFunc &&visits) {
+        if (num_buckets_ == 0) {
+            return;
+        }
+        const size_t bucket_index = key % num_buckets_;
+        std::lock_guard<std::mutex> lock(stripes_[bucket_index % kNumStripes]);
+        Entry *bucket = entries_.data() + bucket_index * kBucketSize;
+        Entry *victim = nullptr;
+        int victim_visits = 0;
+        for (int i = 0; i < kBucketSize; ++i) {
+            Entry &e = bucket[i];
+            if (e.node < 0 || e.key == key) {
+                victim = &e;
+                break;
+            }
+            int v = visits(e.node);
+            if (victim == nullptr || v < victim_visits) {
+                victim = &e;
+                victim_visits = v;
+            }
+        }
+        if (victim->node < 0) {
+            size_.fetch_add(1, std::memory_order_relaxed);
+        }
+        *victim = Entry{key, node};
+    }
+
+    /**
+     * Remove the entry mapping key to node, if any. Thread safe.
+     */
+    void Erase(std::uint64_t key, int node) {
+        if (num_buckets_ == 0) {
+            return;
+        }
+        const size_t bucket_index = key % num_buckets_;
+        std::lock_guard<std::mutex> lock(stripes_[bucket_index % kNumStripes]);
+        Entry *bucket = entries_.data() + bucket_index * kBucketSize;
+        for (int i = 0; i < kBucketSize; ++i) {
+            if (bucket[i].node == node && bucket[i].key == key) {
+                bucket[i] = Entry{};
+                size_.fetch_sub(1, std::memory_order_relaxed);
+                return;
+            }
+        }
+    }
+
+private:
+    struct Entry {
+        std::uint64_t key = 0;
+        int node = -1;
+    };
+
+    std::vector<Entry> entries_;
+    size_t num_buckets_ = 0;
+    std::atomic<size_t> size_{0};
+    // held by pointer to keep the table movable.
+    std::unique_ptr<std::mutex[]> stripes_ = std::make_unique<std::mutex[]>(kNumStripes);
+};
+
+#endif // __TRANSPOSITION_TABLE_H__
@@ -0,0 +1,232 @@
+#ifndef __TREE_FILE_H__
+#define __TREE_FILE_H__
+
+#include <cstddef>
+#include <cstdint>
+#include <cstring>
+#include <fstream>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+#ifndef _WIN32
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
+
+/**
+ * Binary file of a search tree, little endian:
+ *   TreeFileHeader
+ *   root board, int8[board_size * board_size] row major, padded with zeros to a multiple of 8 bytes
+ *   TreeRecord[num_records]
+ * Record 0 is the root. Children of a record are the num_children records from first_child
+ * on, always stored after their parent; an alias record stores in first_child the record
+ * sharing its position, always stored before it.
+ */
+struct TreeFileHeader {
+    char magic[8];
+    std::uint32_t version;
+    std::uint32_t board_size;
+    std::uint32_t num_records;
+    std::int8_t root_stone_id; // id of last moved stone which leads to root
+    std::int8_t root_move_x;
+    std::int8_t root_move_y;
+    std::int8_t reserved;
+};
+
+struct TreeRecord {
+    double win_rounds;
+    std::int32_t total_rounds;
+    std::int32_t first_child;
+    std::int16_t num_children;
+    std::int8_t move_x;
+    std::int8_t move_y;
+    std::int8_t stone_id;
+    std::uint8_t expand_state; // one of kRecord*, same values as TreeNode::ExpandState
+    std::uint16_t reserved;
+};
+
+enum TreeRecordState : std::uint8_t {
+    kRecordUnexpanded = 0,
+    kRecordExpanded = 2,
+    kRecordAlias = 3,
+    kRecordPartiallyExpanded = 4
+};
+
+static_assert(sizeof(TreeFileHeader) == 24, "TreeFileHeader layout is part of the file format");
+static_assert(sizeof(TreeRecord) == 24, "TreeRecord layout is part of the file format");
+
+constexpr char kTreeFileMagic[8] = {'P', 'F', 'R', 'T', 'R', 'E', 'E', '1'};
+constexpr std::uint32_t kTreeFileVersion = 1;
+
+inline size_t TreeFileBoardBytes(int board_size) {
+    return (static_cast<size_t>(board_size) * board_size + 7) / 8 * 8;
+}
+
+/**
+ * Write header, board and records to path.
+ */
+inline void WriteTreeFile(const std::string &path, const TreeFileHeader &header,
+    const std::vector<std::int8_t> &board, const std::vector<TreeRecord> &records)
+{
+    std::ofstream out(path, std::ios::binary | std::ios::trunc);
+    if (!out) {
+        throw std::runtime_error("can't open " + path + " for writing");
+    }
+    std::vector<std::int8_t> padded_board(board);
+    padded_board.resize(TreeFileBoardBytes(header.board_size), 0);
+    out.write(reinterpret_cast<const char *>(&header), sizeof(header));
+    out.write(reinterpret_cast<const char *>(padded_board.data()), padded_board.size());
+    out.write(reinterpret_cast<const char *>(records.data()), records.size() * sizeof(TreeRecord));
+    if (!out) {
+        throw std::runtime_error("failed writing " + path);
+    }
+}
+
+/**
+ * Read-only view of a tree file. The file is memory-mapped where mmap is available, so
+ * records are paged in as they are read; otherwise it is read into memory.
+ */
+class TreeFileView {
+public:
+    explicit TreeFileView(const std::string &path) {
+#ifndef _WIN32
+        int fd = open(path.c_str(), O_RDONLY);
+        if (fd < 0) {
+            throw std::runtime_error("can't open " + path);
+        }
+        struct stat st;
+        if (fstat(fd, &st) != 0) {
+            close(fd);
+            throw std::runtime_error("can't stat " + path);
+        }
+        size_ = static_cast<size_t>(st.st_size);
+        if (size_ > 0) {
+            void *p = mmap(nullptr, size_, PROT_READ, MAP_PRIVATE, fd, 0);
+            if (p == MAP_FAILED) {
+                close(fd);
+                throw std::runtime_error("can't mmap " + path);
+            }
+            mapped_ = p;
+            data_ = static_cast<const char *>(p);
+        }
+        close(fd);
+#else
+        std::ifstream in(path, std::ios::binary | std::ios::ate);
+        if (!in) {
+            throw std::runtime_error("can't open " + path);
+        }
+        buffer_.resize(static_cast<size_t>(in.tellg()));
+        in.seekg(0);
+        in.read(buffer_.data(), buffer_.size());
+        size_ = buffer_.size();
+        data_ = buffer_.data();
+#endif
+        Validate(path);
+    }
+
+    ~TreeFileView() {
+#ifndef _WIN32
+        if (mapped_ != nullptr) {
+            munmap(mapped_, size_);
+        }
+#endif
+    }
+
+    TreeFileView(const TreeFileView &) = delete;
+    TreeFileView &operator=(const TreeFileView &) = delete;
+
+    const TreeFileHeader &Header() const {
+        return *reinterpret_cast<const TreeFileHeader *>(data_);
+    }
+
+    /**
+     * @return: stone id at cell (x, y) of root board.
+     */
+    int BoardAt(int x, int y) const {
+        return data_[sizeof(TreeFileHeader) + x * Header().board_size + y];
+    }
+
+    const TreeRecord *Records() const {
+        return reinterpret_cast<const TreeRecord *>(data_ + RecordsOffset());
+    }
+
+private:
+    size_t RecordsOffset() const {
+        return sizeof(TreeFileHeader) + TreeFileBoardBytes(Header().board_size);
+    }
+
+    /**
+     * Check the header and that links of records stay inside the file, so a truncated or
+     * foreign file is rejected before a tree is built from it.
+     */
+    void Validate(const std::string &path) const {
+        if (size_ < sizeof(TreeFileHeader) || std::memcmp(Header().magic, kTreeFileMagic, sizeof(kTreeFileMagic)) != 0) {
+            throw std::runtime_error(path + " is not a search tree file");
+        }
+        const TreeFileHeader &header = Header();
+        if (header.version != kTreeFileVersion) {
+            throw std::runtime_error(path + ": unsupported tree file version " + std::to_string(header.version));
+        }
+        if (header.board_size == 0 || header.board_size > 32 || header.num_records == 0 ||
+                size_ < RecordsOffset() + static_cast<size_t>(header.num_records) * sizeof(TreeRecord)) {
+            throw std::runtime_error(path + ": truncated or corrupt tree file");
+        }
+        if (header.root_stone_id != 1 && header.root_stone_id != 2) {
+            throw std::runtime_error(path + ": invalid root stone id " + std::to_string(header.root_stone_id));
+        }
+        // every record but the root is the child of exactly one record, moves are on the board and
+        // stone ids are 1 or 2.
+        const TreeRecord *records = Records();
+        const std::int64_t n = header.num_records;
+        const int board_size = header.board_size;
+        std::vector<std::uint8_t> has_parent(n, 0);
+        for (std::int64_t i = 0; i < n; ++i) {
+            const TreeRecord &r = records[i];
+            bool ok = (r.stone_id == 1 || r.stone_id == 2) &&
+                (i == 0 || (r.move_x >= 0 && r.move_x < board_size && r.move_y >= 0 && r.move_y < board_size &&
+                            has_parent[i]));
+            switch (r.expand_state) {
+            case kRecordAlias:
+                ok = ok && r.first_child >= 0 && r.first_child < i &&
+                    records[r.first_child].expand_state != kRecordAlias;
+                break;
+            case kRecordUnexpanded:
+            case kRecordExpanded:
+            case kRecordPartiallyExpanded:
+                ok = ok && r.num_children >= 0 && (r.num_children == 0 ||
+                    (r.expand_state != kRecordUnexpanded && r.first_child > i &&
+                     r.first_child + std::int64_t{r.num_children} <= n));
+                for (std::int64_t ch = r.first_child; ok && ch < r.first_child + r.num_children; ++ch) {
+                    ok = !has_parent[ch];
+                    has_parent[ch] = 1;
+                }
+                break;
+            default:
+                ok = false;
+            }
+            if (!ok) {
+                throw std::runtime_error(path + ": corrupt record " + std::to_string(i));
+            }
+        }
+        for (int x = 0; x < board_size; ++x) {
+            for (int y = 0; y < board_size; ++y) {
+                if (BoardAt(x, y) < 0 || BoardAt(x, y) > 2) {
+                    throw std::runtime_error(path + ": corrupt root board");
+                }
+            }
+        }
+    }
+
+    const char *data_ = nullptr;
+    size_t size_ = 0;
+#ifndef _WIN32
+    void *mapped_ = nullptr;
+#else
+    std::vector<char> buffer_;
+#endif
+};
+
+#endif // __TREE_FILE_H__
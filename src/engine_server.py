@@ -0,0 +1,319 @@
+"""
+Serve many concurrent games from a bounded pool of src.gomocup engine processes.
+
+Clients connect over TCP and exchange JSON lines, several games may share a connection and
+requests of a connection are answered as they complete, not in order:
+
+    {"op": "new_game", "game": "g1", "board_size": 15, "timeout_turn": 2000, "timeout_match": 60000}
+        -> {"game": "g1", "ok": true}
+    {"op": "move", "game": "g1", "moves": [[7, 7], [7, 8]]}
+        -> {"game": "g1", "move": [8, 8], "time_left": 58120}
+    {"op": "end", "game": "g1"} -> {"game": "g1", "ok": true}
+
+moves are all moves of the game from black, the engine plays the side to move. timeout_turn
+and timeout_match are in milliseconds, 0 is unlimited. The clock of a game runs from the
+arrival of a move request to its answer, time waiting for a free engine included, and the
+remaining time is sent to the engine as INFO time_left when it starts searching.
+
+A request first takes one of engines + max_queued slots. When all are taken the connection is
+not read any more until one frees, so back-pressure reaches clients through TCP. A free engine
+is given to the game it served last when possible: its search tree still follows that game.
+
+    python -m src.engine_server --engines 4 --max-queued 64 --port 5005
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# time an engine may take beyond its turn budget before it is considered hung and restarted.
+REPLY_GRACE_MS = 3000
+
+
+class EngineError(Exception):
+    pass
+
+
+class EngineExited(EngineError):
+    pass
+
+
+class GameState:
+    """
+    Moves and clock of one game.
+    """
+    def __init__(self, game_id: str, board_size: int = 15, timeout_turn: int = 5000, timeout_match: int = 0) -> None:
+        self.game_id = game_id
+        self.board_size = board_size
+        self.timeout_turn = timeout_turn
+        self.timeout_match = timeout_match
+        self.time_left = timeout_match
+        self.moves: list[tuple[int, int]] = []
+
+    def turn_limit_ms(self, time_left: int):
+        """
+        Return: time the engine may spend on the next move, 0 for unlimited.
+        """
+        limits = [t for t in (self.timeout_turn, time_left if self.timeout_match > 0 else 0) if t > 0]
+        return min(limits) if limits else 0
+
+
+class EngineProcess:
+    """
+    A src.gomocup process, talked to through its stdin / stdout.
+    """
+    def __init__(self, engine_args: list[str], log_stderr: bool = False) -> None:
+        self.engine_args = engine_args
+        self.log_stderr = log_stderr
+        self.process: asyncio.subprocess.Process | None = None
+        self.board_size = 0
+        self.game_id: str | None = None # game whose position the engine holds
+        self.last_used = 0.0
+        # killed while a reply was awaited, restarted by the next play.
+        self.needs_restart = False
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "src.gomocup", *self.engine_args, cwd=ROOT_DIR,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=None if self.log_stderr else asyncio.subprocess.DEVNULL)
+        self.board_size = 0
+        self.game_id = None
+        self.needs_restart = False
+
+    async def restart(self):
+        self.kill()
+        await self.process.wait()
+        await self.start()
+
+    def kill(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+
+    async def close(self):
+        if self.process.returncode is None:
+            self.process.stdin.write(b"END\n")
+            try:
+                await self.process.stdin.drain()
+                await asyncio.wait_for(self.process.wait(), 5)
+            except (ConnectionError, asyncio.TimeoutError):
+                self.kill()
+
+    async def __send(self, lines: list[str]):
+        self.process.stdin.write("".join(line + "\n" for line in lines).encode())
+        await self.process.stdin.drain()
+
+    async def __reply(self):
+        """
+        Return: next reply line, MESSAGE and DEBUG lines are skipped.
+        """
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                raise EngineExited("engine exited")
+            line = line.decode().strip()
+            if line.startswith("ERROR") or line.startswith("UNKNOWN"):
+                raise EngineError(line)
+            if line and not line.startswith("MESSAGE") and not line.startswith("DEBUG"):
+                return line
+
+    async def play(self, game: GameState, time_left: int):
+        """
+        Search the position of game, with time_left milliseconds left on its clock.
+        Return: (x, y) move of the engine. Raise EngineError on an ERROR reply, e.g. to an invalid
+        board; the engine is restarted only if it exited or didn't reply in time.
+        """
+        turn_limit = game.turn_limit_ms(time_left)
+        if self.needs_restart:
+            await self.restart()
+        try:
+            if self.board_size != game.board_size:
+                self.board_size = 0
+                await self.__send([f"START {game.board_size}"])
+                await self.__reply()
+                self.board_size = game.board_size
+            self.game_id = game.game_id
+            # stones of the side to move are "own" (1), the other's are 2.
+            to_move = len(game.moves) % 2
+            await self.__send([f"INFO timeout_turn {game.timeout_turn}", f"INFO timeout_match {game.timeout_match}",
+                               f"INFO time_left {time_left}", "BOARD"] +
+                              [f"{x},{y},{1 if i % 2 == to_move else 2}" for i, (x, y) in enumerate(game.moves)] +
+                              ["DONE"])
+            timeout = (turn_limit + REPLY_GRACE_MS) / 1000 if turn_limit > 0 else None
+            reply = await asyncio.wait_for(self.__reply(), timeout)
+            x, y = (int(v) for v in reply.split(",")[:2])
+            return x, y
+        except (EngineExited, ConnectionError, asyncio.TimeoutError) as e:
+            await self.restart()
+            raise EngineError(f"engine failed on game {game.game_id}: {e!r}") from e
+        except ValueError as e:
+            raise EngineError(f"malformed engine reply on game {game.game_id}: {e}") from e
+        except asyncio.CancelledError:
+            # the reply may still come and must not be read as the reply to the next game.
+            self.kill()
+            self.needs_restart = True
+            raise
+        finally:
+            self.last_used = time.monotonic()
+
+
+class EnginePool:
+    """
+    num_engines engine processes shared by every game; at most max_queued requests wait for
+    an engine, further requests wait in reserve().
+    """
+    def __init__(self, num_engines: int, max_queued: int, engine_args: list[str] | None = None,
+                 log_stderr: bool = False) -> None:
+        self.engines = [EngineProcess(engine_args or [], log_stderr) for _ in range(num_engines)]
+        self.idle = list(self.engines)
+        self.idle_changed = asyncio.Condition()
+        self.slots = asyncio.Semaphore(num_engines + max_queued)
+
+    async def start(self):
+        await asyncio.gather(*(engine.start() for engine in self.engines))
+
+    async def close(self):
+        await asyncio.gather(*(engine.close() for engine in self.engines))
+
+    async def reserve(self):
+        """
+        Wait for a request slot, to be released by get_move.
+        """
+        await self.slots.acquire()
+
+    def release(self):
+        """
+        Give back a slot taken by reserve() for a request that is not passed to get_move.
+        """
+        self.slots.release()
+
+    async def __acquire(self, game_id: str):
+        async with self.idle_changed:
+            await self.idle_changed.wait_for(lambda: len(self.idle) > 0)
+            # the engine that served this game keeps its tree, otherwise evict the least recently used.
+            engine = next((e for e in self.idle if e.game_id == game_id), None) or \
+                min(self.idle, key=lambda e: e.last_used)
+            self.idle.remove(engine)
+            return engine
+
+    async def __release(self, engine: EngineProcess):
+        async with self.idle_changed:
+            self.idle.append(engine)
+            self.idle_changed.notify()
+
+    async def get_move(self, game: GameState, time_left: int):
+        """
+        Call after reserve(), the slot is released when the move is returned.
+        Return: (x, y) move for the side to move in game.
+        """
+        try:
+            engine = await self.__acquire(game.game_id)
+            try:
+                return await engine.play(game, time_left)
+            finally:
+                await self.__release(engine)
+        finally:
+            self.release()
+
+
+class EngineServer:
+    """
+    JSON lines front end, see the module docstring.
+    """
+    def __init__(self, pool: EnginePool) -> None:
+        self.pool = pool
+        self.games: dict[str, GameState] = {}
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        tasks = set()
+        write_lock = asyncio.Lock()
+
+        async def reply(message: dict):
+            async with write_lock:
+                writer.write((json.dumps(message) + "\n").encode())
+                await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    op, game_id = request["op"], str(request["game"])
+                except (ValueError, KeyError, TypeError):
+                    await reply({"error": f"malformed request {line.decode().strip()}"})
+                    continue
+                if op == "move":
+                    # stop reading the connection while every slot is taken.
+                    await self.pool.reserve()
+                    task = asyncio.create_task(self.__move(request, game_id, reply, time.monotonic()))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                else:
+                    await reply(self.__control(op, game_id, request))
+            await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    def __control(self, op: str, game_id: str, request: dict):
+        if op == "new_game":
+            self.games[game_id] = GameState(game_id, int(request.get("board_size", 15)),
+                                            int(request.get("timeout_turn", 5000)), int(request.get("timeout_match", 0)))
+            return {"game": game_id, "ok": True}
+        if op == "end":
+            self.games.pop(game_id, None)
+            return {"game": game_id, "ok": True}
+        return {"game": game_id, "error": f"unknown op {op}"}
+
+    async def __move(self, request: dict, game_id: str, reply, arrival: float):
+        game = self.games.get(game_id)
+        if game is None:
+            self.pool.release()
+            await reply({"game": game_id, "error": "unknown game, send new_game first"})
+            return
+        try:
+            game.moves = [(int(x), int(y)) for x, y in request.get("moves", [])]
+            waited = int((time.monotonic() - arrival) * 1000)
+            move = await self.pool.get_move(game, max(1, game.time_left - waited))
+        except (EngineError, ValueError, TypeError) as e:
+            await reply({"game": game_id, "error": str(e)})
+            return
+        if game.timeout_match > 0:
+            game.time_left -= int((time.monotonic() - arrival) * 1000)
+        await reply({"game": game_id, "move": list(move), "time_left": game.time_left})
+
+
+async def serve(host: str, port: int, num_engines: int, max_queued: int, engine_args: list[str],
+                log_stderr: bool = False):
+    pool = EnginePool(num_engines, max_queued, engine_args, log_stderr)
+    await pool.start()
+    server = await asyncio.start_server(EngineServer(pool).handle_client, host, port)
+    print(f"serving on {', '.join(str(s.getsockname()) for s in server.sockets)} with {num_engines} engines",
+          flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve games from a pool of Gomocup protocol engines.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5005)
+    parser.add_argument("--engines", type=int, default=os.cpu_count(), help="engine processes, default cpu count")
+    parser.add_argument("--max-queued", type=int, default=64, help="move requests waiting for an engine")
+    parser.add_argument("--engine-threads", type=int, default=1, help="search threads of each engine")
+    parser.add_argument("--log-engines", action="store_true", help="pass the engines' stderr through")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.engines, args.max_queued,
+                      ["--threads", str(args.engine_threads)], args.log_engines))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 from enum import Enum, auto
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor
 
 from imgui_bundle import imgui
 import sdl2
@@ -11,9 +10,10 @@ cons = Console()
 from .singleton import Singleton
 import game_config
 from . import game_ui
-from . import game_AI
+from .ai_worker import AIWorker
 from . import utils
 from . import game_utils
+from .game_records import GameRecordWriter
 
 class Game(Singleton):
     class GameStatus(Enum):
@@ -31,8 +31,11 @@ class Game(Singleton):
 
     last_tick = -1
     board_shape = [[0,0],[0,0]]
-    thread_pool = ThreadPoolExecutor(1)
-    thread_future = None
+    # engine process, started on first use: creating it at import would spawn it again in the
+    # worker process, which imports this module through __main__.
+    ai_worker: AIWorker | None = None
+    ai_thinking = False
+    pondering = False
     winner = None
 
     def log(self):
@@ -43,8 +46,7 @@ class Game(Singleton):
     
     def render_ui(self):
         # draw board
-        self.board_shape = game_ui.draw_board(self.board_state, self.who_first == 0,
-                                              None if len(self.record_stone_places) == 0 else self.record_stone_places[-1])
+        self.board_shape = game_ui.draw_board(self.board_state, self.record_stone_places, self.who_first == 0)
 
         # draw ui buttons and hint text
         self.draw_buttons_ui()
@@ -65,6 +67,12 @@ class Game(Singleton):
                 cons.log(f"self.status={self.status}")
 
 
+    def needs_update(self):
+        """
+        Return: True if frames must be rendered without input, i.e. while waiting for the AI's move.
+        """
+        return self.status == Game.GameStatus.PLAYING and not self.players_turn
+
     def draw_ai_thinking_hint(self):
         imgui_io = imgui.get_io()
         imgui.open_popup("AI Thinking")
@@ -76,30 +84,61 @@ class Game(Singleton):
         
 
     def start_AI_step(self):
-        self.thread_future = self.thread_pool.submit(game_AI.AI_step, self.board_state, 2-self.who_first)
+        if self.ai_worker is None:
+            Game.ai_worker = AIWorker()
+        self.ai_worker.request_move(self.board_state, 2 - self.who_first)
+        self.ai_thinking = True
         cons.log(f"start AI step")
 
     def get_AI_step(self):
         if self.status != Game.GameStatus.PLAYING:
             return
-        if self.thread_future is None:
-            # 没有异步任务，启动一个并返回（非阻塞）
+        if not self.ai_thinking:
+            # no request in flight, send one and return (non-blocking)
             self.start_AI_step()
             return False
 
-        # 检查线程是否完成，未完成则直接返回（等待下一帧再检查）
-        if not self.thread_future.done():
+        # the worker has not answered yet, check again in next frame
+        move = self.ai_worker.poll_move()
+        if move is None:
             return False
-        cons.log(f"thread task done")
-        # 任务已完成，取出结果并处理异常
-        pos_x, pos_y = self.thread_future.result()
-        self.thread_future = None
+        cons.log(f"AI step done")
+        self.ai_thinking = False
+        pos_x, pos_y = move
         self.place_stone(pos_x, pos_y, 2 - self.who_first)
         self.players_turn = True
+        self.start_ponder()
         return True
 
+    def start_ponder(self):
+        if not game_config.ponder or self.status != Game.GameStatus.PLAYING:
+            return
+        self.ai_worker.ponder()
+        self.pondering = True
+
+    def stop_ponder(self):
+        if not self.pondering:
+            return
+        self.ai_worker.cancel()
+        self.pondering = False
+
+    def cancel_AI(self):
+        """
+        Stop pondering and the search in flight, its move will never be played.
+        """
+        if self.ai_worker is not None and (self.ai_thinking or self.pondering):
+            self.ai_worker.cancel()
+        self.ai_thinking = False
+        self.pondering = False
+
+    def shutdown(self):
+        if self.ai_worker is not None:
+            self.ai_worker.close()
+            Game.ai_worker = None
+
 
     def reset_game_status(self):
+        self.cancel_AI()
         self.status = Game.GameStatus.PLAYING
         self.board_state = np.zeros_like(self.board_state, dtype=self.board_state.dtype)
         self.who_first = self.next_game_who_first
@@ -143,6 +182,8 @@ class Game(Singleton):
         imgui.end()
 
     def withdraw_a_move(self):
+        self.cancel_AI()
+        self.players_turn = True
         for i in range(2):
             if len(self.record_stone_places) > 0:
                 pos = self.record_stone_places[-1]
@@ -163,6 +204,7 @@ class Game(Singleton):
         if grid_x >= 0 and grid_x < game_config.board_size and \
             grid_y >= 0 and grid_y < game_config.board_size and \
                 self.board_state[grid_x, grid_y] == 0:
+            self.stop_ponder()
             self.place_stone(grid_x, grid_y, 1 + self.who_first)
             self.players_turn = False
             self.get_AI_step()
@@ -175,4 +217,18 @@ class Game(Singleton):
             return
         self.status = self.GameStatus.GAME_END
         if check_res == 1:
-            self.winner = stone
\ No newline at end of file
+            self.winner = stone
+        self.save_record()
+
+    def save_record(self):
+        """
+        Append the finished game to game_config.game_record_path.
+        """
+        if game_config.game_record_path is None:
+            return
+        settings = {"iter_steps": game_config.tree_search_steps, "time_limit_ms": game_config.move_time_ms,
+                    "playout_policy": game_config.tree_search_policy,
+                    "progressive_widening": game_config.progressive_widening}
+        with GameRecordWriter(game_config.game_record_path) as writer:
+            writer.append(self.record_stone_places, game_config.board_size, self.who_first,
+                          0 if self.winner is None else self.winner, settings)
\ No newline at end of file
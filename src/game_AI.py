@@ -1,24 +1,184 @@
 import numpy as np
+import threading
 import time
 from rich.console import Console
 cons = Console()
 
 import game_config
 from . import monte_carlo_tree_search
+from .opening_book import OpeningBook
 import py_MCTS
 
-def AI_step(board_states: np.ndarray, ai_stone_id: int):
+
+class SearchSession:
+    """
+    Keep one py_MCTS search tree alive between moves.
+    After the AI's move and the opponent's reply, the matching grandchild subtree
+    becomes the new root, so statistics from the previous search are reused.
+    A fresh tree is built whenever the board does not follow from the tree root,
+    e.g. after a withdrawn move or a new game.
+    While the player is thinking, the tree keeps growing from the AI's move (pondering)
+    until cancel is called. cancel also stops a search, e.g. when the game it was
+    started for is abandoned.
+    """
+    def __init__(self) -> None:
+        self.tree = None
+        self.board: np.ndarray | None = None # board state at root of self.tree
+        self.ai_stone_id = 0
+        self.running = False # a search or ponder was started and not cancelled
+        self.lock = threading.Lock() # guards running and stop_search of self.tree
+
+    def reset(self):
+        self.tree = None
+        self.board = None
+
+    def sync(self, board_states: np.ndarray, ai_stone_id: int):
+        """
+        Move tree root to board_states.
+        @return: True if the old tree was reused, False if a fresh tree was built.
+        """
+        if self.tree is not None and self.ai_stone_id == ai_stone_id and \
+                self.board.shape == board_states.shape:
+            diff = np.argwhere(self.board != board_states)
+            if len(diff) == 0:
+                return True
+            if len(diff) == 1:
+                pos_x, pos_y = int(diff[0][0]), int(diff[0][1])
+                if self.board[pos_x, pos_y] == 0 and board_states[pos_x, pos_y] == 3 - ai_stone_id:
+                    self.advance((pos_x, pos_y), 3 - ai_stone_id)
+                    return True
+
+        self.tree = py_MCTS.MonteCarloTreeSearch(board_states, ai_stone_id)
+        self.board = board_states.copy()
+        self.ai_stone_id = ai_stone_id
+        return False
+
+    def advance(self, move: tuple[int, int], stone_id: int):
+        self.tree.AdvanceRoot(move)
+        self.board[move[0], move[1]] = stone_id
+
+    def search(self, board_states: np.ndarray, ai_stone_id: int, budget: dict | None = None):
+        """
+        budget: iter_steps, time_limit_ms and max_nodes of SearchMove, default from game_config.
+        @return: best move, None if the search was cancelled.
+        """
+        if budget is None:
+            budget = default_budget()
+        reused = self.sync(board_states, ai_stone_id)
+        tree = self.tree
+        tree.playout_policy = getattr(py_MCTS, game_config.tree_search_policy)
+        tree.near_playout_policy_distance = 1
+        tree.verbose = game_config.search_verbose
+        tree.progressive_widening = game_config.progressive_widening
+        tree.node_budget = game_config.tree_search_node_budget
+        with self.lock:
+            # a cancel that came before the tree was built stops the search at once.
+            tree.stop_search = not self.running
+        best_move = tree.SearchMove(budget["iter_steps"], budget["time_limit_ms"], budget["max_nodes"])
+        if not self.finish(tree):
+            cons.log(f"search cancelled after {tree.last_search_iterations} iterations")
+            return None
+        stats = tree.last_search_stats
+        cons.log(f"reuse search tree: {reused}, search iterations: {stats.iterations}, "
+                 f"rollouts: {stats.rollout_count}, average rollout length: {stats.average_rollout_length:.1f}, "
+                 f"new nodes: {stats.nodes_allocated}, evicted nodes: {stats.nodes_evicted}")
+        if game_config.search_verbose:
+            cons.log(f"phase time (s): selection {stats.selection_time:.3f}, expansion {stats.expansion_time:.3f}, "
+                     f"rollout {stats.rollout_time:.3f}, backprop {stats.backprop_time:.3f}")
+            # walking the whole tree is slow for large trees.
+            cons.log(f"tree size: {tree.GetTreeNodesNumbers()}, depth: {tree.GetTreeDepth()}")
+            cons.log(f"num nodes in each depth: {tree.StaticDepthNodesNumbers()}")
+        self.advance(best_move, ai_stone_id)
+        return best_move
+
+    def start(self):
+        """
+        Called before a search or ponder is handed to the thread running it, so that a cancel
+        issued before it starts running still stops it.
+        """
+        with self.lock:
+            self.running = True
+
+    def finish(self, tree):
+        """
+        Return: False if the search or ponder on tree was cancelled.
+        """
+        with self.lock:
+            completed = self.running
+            self.running = False
+            # drop a stop that was not consumed by SearchMove.
+            if tree is not None:
+                tree.stop_search = False
+        return completed
+
+    def ponder(self):
+        """
+        Search from the position after the AI's move until cancel is called or
+        game_config.ponder_max_nodes is reached.
+        """
+        with self.lock:
+            tree = self.tree
+            cancelled = not self.running or tree is None
+        if not cancelled:
+            tree.SearchMove(0, 0, game_config.ponder_max_nodes)
+            cons.log(f"ponder iterations: {tree.last_search_iterations}, "
+                     f"new nodes: {tree.last_search_stats.nodes_allocated}")
+        self.finish(tree)
+
+    def cancel(self):
+        """
+        Ask a running search or ponder to return, does not wait for it.
+        """
+        with self.lock:
+            if self.running:
+                self.running = False
+                if self.tree is not None:
+                    self.tree.stop_search = True
+
+
+def default_budget():
+    return {"iter_steps": game_config.tree_search_steps if game_config.move_time_ms <= 0 else 0,
+            "time_limit_ms": game_config.move_time_ms, "max_nodes": game_config.tree_search_max_nodes}
+
+
+session = SearchSession()
+opening_book: OpeningBook | None = None
+
+
+def book_move(board_states: np.ndarray, ai_stone_id: int):
+    """
+    Return: move of the opening book for board_states, None if it has none or no book is configured.
+    """
+    global opening_book
+    if game_config.opening_book_path is None:
+        return None
+    if opening_book is None:
+        opening_book = OpeningBook(game_config.opening_book_path)
+    return opening_book.best_move(board_states, ai_stone_id, game_config.opening_book_min_visits)
+
+
+def AI_step(board_states: np.ndarray, ai_stone_id: int, budget: dict | None = None):
+    """
+    Call session.start first, session.cancel stops the search.
+    @return: move of the AI, None if the search was cancelled.
+    """
     time1 = time.time()
     # tree = monte_carlo_tree_search.MonteCarloTreeSearch(board_states, ai_stone_id)
     # best_move = tree.search_move(50000)
 
-    tree = py_MCTS.MonteCarloTreeSearch(board_states, ai_stone_id)
-    tree.playout_policy = game_config.tree_search_policy
-    tree.near_playout_policy_distance = 1
-    best_move = tree.SearchMove(game_config.tree_search_steps)
+    best_move = book_move(board_states, ai_stone_id)
+    if best_move is not None:
+        # the search tree doesn't follow the book line, drop it.
+        session.reset()
+        session.finish(None)
+        cons.log(f"opening book move: {best_move}")
+    else:
+        best_move = session.search(board_states, ai_stone_id, budget)
 
     time2 = time.time()
     cons.log(f"search step cost time: {time2-time1}s.")
-    cons.log(f"tree size: {tree.GetTreeNodesNumbers()}, depth: {tree.GetTreeDepth()}")
-    cons.log(f"num nodes in each depth: {tree.StaticDepthNodesNumbers()}")
-    return best_move
\ No newline at end of file
+    return best_move
+
+
+def ponder():
+    session.ponder()
@@ -0,0 +1,317 @@
+"""
+Append-only log of finished games, compact enough for millions of games, and bulk re-analysis
+of logged games with py_MCTS over a process pool.
+
+File layout (little endian):
+    log     magic b"PFRGAME1", uint32 version, uint32 reserved, then records back to back:
+                RECORD_HEADER_DTYPE (16 bytes)
+                moves, one byte per move holding x * board_size + y (two bytes for boards
+                larger than 16), black moves first
+    <log>.idx   uint64 offset of every record in the log
+
+Records are only ever appended, the index after its record, so a crash leaves at most a
+partial record after the last indexed one; GameRecordWriter drops it when it opens the log.
+GameRecordLog memory-maps both files for random access.
+
+    python -m src.game_records show game_records.bin
+    python -m src.game_records import -o game_records.bin --board-size 15 arena.jsonl
+    python -m src.game_records analyze game_records.bin -o analysis.jsonl --iter-steps 2000 --workers 4
+"""
+import argparse
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+MAGIC = b"PFRGAME1"
+VERSION = 1
+FILE_HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("reserved", "<u4")])
+RECORD_HEADER_DTYPE = np.dtype([("num_moves", "<u2"), ("board_size", "u1"),
+                                ("who_first", "u1"),      # Game.who_first: 0 -> the player had black
+                                ("winner", "u1"),         # stone id, 0 for a draw
+                                ("playout_policy", "u1"), # index in PLAYOUT_POLICIES
+                                ("flags", "u1"), ("reserved", "u1"),
+                                ("iter_steps", "<u4"), ("time_limit_ms", "<u4")])
+PLAYOUT_POLICIES = ["NearPlacePlayout", "UniformPlayout", "ThreatPlayout"]
+FLAG_PROGRESSIVE_WIDENING = 1
+
+
+def move_dtype(board_size: int):
+    return np.dtype(np.uint8) if board_size * board_size <= 256 else np.dtype("<u2")
+
+
+def index_path(path: str):
+    return path + ".idx"
+
+
+def encode_record(moves, board_size: int, who_first: int, winner: int, settings: dict | None = None):
+    """
+    settings: engine settings of the game, keys iter_steps, time_limit_ms, playout_policy (name)
+    and progressive_widening, like the arena engine spec.
+    Return: bytes of the record.
+    """
+    settings = settings or {}
+    moves = np.asarray(moves, dtype=np.int64).reshape(-1, 2)
+    header = np.zeros(1, dtype=RECORD_HEADER_DTYPE)
+    header["num_moves"] = len(moves)
+    header["board_size"] = board_size
+    header["who_first"] = who_first
+    header["winner"] = winner
+    header["playout_policy"] = PLAYOUT_POLICIES.index(settings.get("playout_policy", PLAYOUT_POLICIES[0]))
+    header["flags"] = FLAG_PROGRESSIVE_WIDENING if settings.get("progressive_widening", False) else 0
+    header["iter_steps"] = settings.get("iter_steps", 0)
+    header["time_limit_ms"] = settings.get("time_limit_ms", 0)
+    cells = (moves[:, 0] * board_size + moves[:, 1]).astype(move_dtype(board_size))
+    return header.tobytes() + cells.tobytes()
+
+
+def record_size(header: np.void):
+    return RECORD_HEADER_DTYPE.itemsize + int(header["num_moves"]) * move_dtype(int(header["board_size"])).itemsize
+
+
+class GameRecordWriter:
+    """
+    Append records to a log, creating it if needed. Every append is flushed, so readers and
+    crashes see whole records.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "wb") as f:
+                header = np.zeros(1, dtype=FILE_HEADER_DTYPE)
+                header["magic"] = MAGIC
+                header["version"] = VERSION
+                f.write(header.tobytes())
+            open(index_path(path), "wb").close()
+        self.__recover()
+        self.log = open(path, "ab")
+        self.index = open(index_path(path), "ab")
+
+    def __recover(self):
+        """
+        Index records written after the last indexed one, and cut a partial record at the end.
+        """
+        check_file_header(self.path)
+        if not os.path.exists(index_path(self.path)):
+            open(index_path(self.path), "wb").close()
+        index_size = os.path.getsize(index_path(self.path)) // 8 * 8
+        offsets = np.fromfile(index_path(self.path), dtype="<u8", count=index_size // 8)
+        log_size = os.path.getsize(self.path)
+        offset = FILE_HEADER_DTYPE.itemsize
+        if len(offsets) > 0:
+            last = np.fromfile(self.path, dtype=RECORD_HEADER_DTYPE, count=1, offset=int(offsets[-1]))[0]
+            offset = int(offsets[-1]) + record_size(last)
+        recovered = []
+        while offset + RECORD_HEADER_DTYPE.itemsize <= log_size:
+            header = np.fromfile(self.path, dtype=RECORD_HEADER_DTYPE, count=1, offset=offset)[0]
+            if offset + record_size(header) > log_size:
+                break
+            recovered.append(offset)
+            offset += record_size(header)
+        with open(index_path(self.path), "r+b") as f:
+            f.truncate(index_size)
+            f.seek(index_size)
+            f.write(np.array(recovered, dtype="<u8").tobytes())
+        if offset < log_size:
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+
+    def append(self, moves, board_size: int, who_first: int, winner: int, settings: dict | None = None):
+        """
+        See encode_record for the arguments.
+        """
+        offset = self.log.tell()
+        self.log.write(encode_record(moves, board_size, who_first, winner, settings))
+        self.log.flush()
+        self.index.write(np.array([offset], dtype="<u8").tobytes())
+        self.index.flush()
+
+    def close(self):
+        self.log.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def check_file_header(path: str):
+    header = np.fromfile(path, dtype=FILE_HEADER_DTYPE, count=1)
+    if len(header) == 0 or header["magic"][0] != MAGIC or header["version"][0] != VERSION:
+        raise ValueError(f"{path} is not a game record log of version {VERSION}")
+
+
+class GameRecordLog:
+    """
+    Read-only, memory-mapped view of a log; records appended later are not seen.
+    """
+    def __init__(self, path: str) -> None:
+        check_file_header(path)
+        self.path = path
+        index_size = os.path.getsize(index_path(path)) // 8
+        self.offsets = np.memmap(index_path(path), dtype="<u8", mode="r", shape=(index_size,)) \
+            if index_size > 0 else np.zeros(0, dtype="<u8")
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def header(self, index: int):
+        offset = int(self.offsets[index])
+        return self.data[offset:offset + RECORD_HEADER_DTYPE.itemsize].view(RECORD_HEADER_DTYPE)[0]
+
+    def moves(self, index: int):
+        """
+        Return: (num_moves, 2) int array of the moves of record index.
+        """
+        header = self.header(index)
+        n = int(header["board_size"])
+        dtype = move_dtype(n)
+        begin = int(self.offsets[index]) + RECORD_HEADER_DTYPE.itemsize
+        cells = self.data[begin:begin + int(header["num_moves"]) * dtype.itemsize].view(dtype).astype(np.int64)
+        return np.stack([cells // n, cells % n], axis=1)
+
+    def __getitem__(self, index: int):
+        """
+        Return: dict of record index, settings with the keys of encode_record.
+        """
+        header = self.header(index)
+        return {"board_size": int(header["board_size"]), "who_first": int(header["who_first"]),
+                "winner": int(header["winner"]), "moves": self.moves(index),
+                "settings": {"iter_steps": int(header["iter_steps"]), "time_limit_ms": int(header["time_limit_ms"]),
+                             "playout_policy": PLAYOUT_POLICIES[header["playout_policy"]],
+                             "progressive_widening": bool(header["flags"] & FLAG_PROGRESSIVE_WIDENING)}}
+
+    def headers(self):
+        """
+        Return: structured array of the headers of all records, gathered without a Python loop,
+        e.g. for selecting the games to analyze.
+        """
+        cols = self.offsets.astype(np.int64)[:, None] + np.arange(RECORD_HEADER_DTYPE.itemsize)
+        return np.ascontiguousarray(self.data[cols]).view(RECORD_HEADER_DTYPE).reshape(-1)
+
+
+_worker_log: GameRecordLog | None = None
+
+
+def _init_analysis_worker(path: str):
+    from .arena import silence_output
+    global _worker_log
+    silence_output()
+    _worker_log = GameRecordLog(path)
+
+
+def analyze_game(index: int, iter_steps: int, time_limit_ms: int, playout_policy: str, seed: int):
+    """
+    Search every position of record index, before each of its moves. The tree follows the game
+    through AdvanceRoot, so each search starts from the statistics of the previous one.
+    Return: dict with, per position, the most visited move and its win rate, and visits and
+    win rate of the move played; win rates are of the player to move, None if the played move
+    has no visit.
+    """
+    import py_MCTS
+    record = _worker_log[index]
+    n = record["board_size"]
+    tree = py_MCTS.MonteCarloTreeSearch(np.zeros((n, n), dtype=np.int8), 1)
+    tree.playout_policy = getattr(py_MCTS, playout_policy)
+    tree.near_playout_policy_distance = 1
+    tree.random_seed = seed + index
+    positions = []
+    for ply, (x, y) in enumerate(record["moves"].tolist()):
+        tree.SearchMove(iter_steps, time_limit_ms)
+        stats = tree.GetRootStats()
+        visits, win_rates = stats["visits"], stats["win_rates"]
+        best = np.unravel_index(int(np.argmax(visits)), visits.shape)
+        played_win_rate = float(win_rates[x, y])
+        positions.append({"ply": ply, "move": [x, y], "best_move": [int(best[0]), int(best[1])],
+                          "best_win_rate": float(win_rates[best]), "played_visits": int(visits[x, y]),
+                          "played_win_rate": None if np.isnan(played_win_rate) else played_win_rate})
+        tree.AdvanceRoot((x, y))
+    return {"game": index, "winner": record["winner"], "positions": positions}
+
+
+def analyze_log(path: str, output: str, iter_steps: int = 2000, time_limit_ms: int = 0,
+                playout_policy: str = "NearPlacePlayout", workers: int | None = None,
+                start: int = 0, stop: int | None = None, seed: int = 0, verbose: bool = True):
+    """
+    Analyze records [start, stop) on a process pool, writing one JSON line per game to output
+    as games finish. At most a few games per worker are in flight, so memory stays flat
+    however long the log is.
+    Return: number of games analyzed.
+    """
+    stop = len(GameRecordLog(path)) if stop is None else stop
+    workers = workers or os.cpu_count()
+    pending = set()
+    done = 0
+    with open(output, "w") as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_analysis_worker, initargs=(path,)) as pool:
+        indices = iter(range(start, stop))
+        while True:
+            for index in indices:
+                pending.add(pool.submit(analyze_game, index, iter_steps, time_limit_ms, playout_policy, seed))
+                if len(pending) >= 4 * workers:
+                    break
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                out.write(json.dumps(future.result()) + "\n")
+                done += 1
+            out.flush()
+            if verbose:
+                print(f"[{done}/{stop - start}] games analyzed", flush=True)
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Game record logs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    show = sub.add_parser("show", help="print the number of games, or a game")
+    show.add_argument("log")
+    show.add_argument("--index", type=int, default=None)
+    imp = sub.add_parser("import", help="append games of arena JSON lines files")
+    imp.add_argument("inputs", nargs="+")
+    imp.add_argument("-o", "--output", required=True)
+    imp.add_argument("--board-size", type=int, default=15)
+    analyze = sub.add_parser("analyze", help="search every position of logged games")
+    analyze.add_argument("log")
+    analyze.add_argument("-o", "--output", required=True, help="JSON lines file, one line per game")
+    analyze.add_argument("--iter-steps", type=int, default=2000)
+    analyze.add_argument("--time-limit-ms", type=int, default=0)
+    analyze.add_argument("--playout-policy", default="NearPlacePlayout", choices=PLAYOUT_POLICIES)
+    analyze.add_argument("--workers", type=int, default=None, help="processes, default cpu count")
+    analyze.add_argument("--start", type=int, default=0)
+    analyze.add_argument("--stop", type=int, default=None)
+    analyze.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "show":
+        log = GameRecordLog(args.log)
+        if args.index is None:
+            headers = log.headers()
+            print(f"{len(log)} games, {int(headers['num_moves'].sum())} moves, "
+                  f"black / white / draw: {[int((headers['winner'] == w).sum()) for w in (1, 2, 0)]}")
+        else:
+            record = log[args.index]
+            record["moves"] = record["moves"].tolist()
+            print(json.dumps(record))
+    elif args.command == "import":
+        with GameRecordWriter(args.output) as writer:
+            for input_path in args.inputs:
+                with open(input_path) as f:
+                    for line in f:
+                        game = json.loads(line)
+                        # engine A has black when who_first is 0, see src.arena.play_game.
+                        winner = 0 if game["winner"] is None else \
+                            1 + (game["who_first"] + (game["winner"] == "B")) % 2
+                        writer.append(game["moves"], args.board_size, game["who_first"], winner)
+    else:
+        analyze_log(args.log, args.output, args.iter_steps, args.time_limit_ms, args.playout_policy,
+                    args.workers, args.start, args.stop, args.seed)
+
+
+if __name__ == "__main__":
+    main()
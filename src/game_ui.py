@@ -14,85 +14,127 @@ def get_mouse_grid(left_top_coord: list[float], line_interval: float):
     return grid_x, grid_y
 
 
-def draw_board(board_state: np.ndarray, player_use_black: bool, last_place_pos):
-    io = imgui.get_io()
+class BoardGeometry:
+    """
+    Static layout of the board for one display size and board_size: frame, grid lines and star
+    points. Built by board_geometry only when the window is resized or board_size changes.
+    """
+    def __init__(self, display_size: tuple[float, float], board_size: int) -> None:
+        self.display_size = display_size
+        self.board_size = board_size
+        board_sz = int(min(*display_size) * 0.9)
+        board_sz = (board_sz // (board_size - 1)) * (board_size - 1)
+        center_coord = (display_size[0] / 2, display_size[1] / 2)
+        self.pmin = [center_coord[0] - board_sz / 2, center_coord[1] - board_sz / 2]
+        self.pmax = [center_coord[0] + board_sz / 2, center_coord[1] + board_sz / 2]
+        self.line_interval = board_sz / (board_size - 1)
+        self.stone_r = self.line_interval * 0.46
+
+        self.lines = []
+        for i in range(1, board_size - 1):
+            line_xpos = self.pmin[0] + i * self.line_interval
+            self.lines.append(((line_xpos, self.pmin[1]), (line_xpos, self.pmax[1])))
+            line_ypos = self.pmin[1] + i * self.line_interval
+            self.lines.append(((self.pmin[0], line_ypos), (self.pmax[0], line_ypos)))
+
+        self.dot_r = min(5, self.line_interval * 0.2)
+        self.dots = []
+        if board_size % 2 == 1:
+            self.dots.append(center_coord)
+        if board_size >= 8:
+            corner_dot = (board_size // 4) * self.line_interval
+            self.dots += [(self.pmin[0] + corner_dot, self.pmin[1] + corner_dot),
+                          (self.pmin[0] + corner_dot, self.pmax[1] - corner_dot),
+                          (self.pmax[0] - corner_dot, self.pmin[1] + corner_dot),
+                          (self.pmax[0] - corner_dot, self.pmax[1] - corner_dot)]
+
+    def grid_pos(self, grid_x: int, grid_y: int):
+        return (self.pmin[0] + grid_x * self.line_interval, self.pmin[1] + grid_y * self.line_interval)
+
+
+_geometry: BoardGeometry | None = None
+# (move, center, stone id) of stones drawn, in the order of the record of stone places.
+_stones: list[tuple[tuple[int, int], tuple[float, float], int]] = []
+
+
+def board_geometry():
+    """
+    Return: BoardGeometry of the current display size and game_config.board_size, cached.
+    """
+    global _geometry
+    display_size = tuple(imgui.get_io().display_size)
+    if _geometry is None or _geometry.display_size != display_size or _geometry.board_size != game_config.board_size:
+        _geometry = BoardGeometry(display_size, game_config.board_size)
+        _stones.clear()
+    return _geometry
+
+
+def update_stones(geometry: BoardGeometry, board_state: np.ndarray, record_stone_places: list):
+    """
+    Bring the cached stones in line with record_stone_places. Moves are appended one at a
+    time while a game goes on, so only new stones are laid out; the cache is rebuilt when
+    the record no longer extends it, e.g. after a withdrawn move or a new game.
+    """
+    num_kept = 0
+    while num_kept < min(len(_stones), len(record_stone_places)) and \
+            _stones[num_kept][0] == tuple(record_stone_places[num_kept]) and \
+            _stones[num_kept][2] == board_state[_stones[num_kept][0]]:
+        num_kept += 1
+    del _stones[num_kept:]
+    for pos in record_stone_places[num_kept:]:
+        pos = (int(pos[0]), int(pos[1]))
+        _stones.append((pos, geometry.grid_pos(*pos), int(board_state[pos])))
+
+
+def draw_board(board_state: np.ndarray, record_stone_places: list, player_use_black: bool):
+    """
+    Draw board, stones of record_stone_places and the hint stone under the mouse. Layout comes
+    from board_geometry, so each frame only emits draw commands.
+    Return: (left top, right bottom) corners of the grid.
+    """
+    geometry = board_geometry()
+    update_stones(geometry, board_state, record_stone_places)
     draw_list: imgui.ImDrawList = imgui.get_background_draw_list()
-    board_sz = int(min(*io.display_size) * 0.9)
-    board_sz = (board_sz // (game_config.board_size - 1)) * (game_config.board_size - 1)
-    center_coord = (io.display_size[0] / 2, io.display_size[1] / 2)
+    pmin, pmax = geometry.pmin, geometry.pmax
 
-    rect_shape_pmin = [center_coord[0] - board_sz / 2, center_coord[1] - board_sz / 2]
-    rect_shape_pmax = [center_coord[0] + board_sz / 2, center_coord[1] + board_sz / 2]
     line_col32 = imgui.get_color_u32((0.5,1,1,1))
-    draw_list.add_rect(rect_shape_pmin, rect_shape_pmax,
-                       line_col32)
-    draw_list.add_rect((rect_shape_pmin[0]-5, rect_shape_pmin[1]-5),
-                       (rect_shape_pmax[0]+5, rect_shape_pmax[1]+5),
-                       line_col32,thickness=3)
-    
-    line_interval = board_sz / (game_config.board_size - 1)
-    for i in range(1, game_config.board_size - 1):
-        line_xpos = rect_shape_pmin[0] + i * line_interval
-        draw_list.add_line((line_xpos, rect_shape_pmin[1]), (line_xpos, rect_shape_pmax[1]),
-                           line_col32)
-        line_ypos = rect_shape_pmin[1] + i * line_interval
-        draw_list.add_line((rect_shape_pmin[0], line_ypos), (rect_shape_pmax[0], line_ypos),
-                           line_col32)
-    
-    circle_dot_r = min(5, line_interval * 0.2)
-    if game_config.board_size % 2 == 1:
-        draw_list.add_circle_filled(center_coord, circle_dot_r, line_col32)
-    if game_config.board_size >= 8:
-        corner_dot = (game_config.board_size // 4) * line_interval
-
-        draw_list.add_circle_filled((rect_shape_pmin[0] + corner_dot, rect_shape_pmin[1] + corner_dot),
-                                    circle_dot_r, line_col32)
-        draw_list.add_circle_filled((rect_shape_pmin[0] + corner_dot, rect_shape_pmax[1] - corner_dot),
-                                    circle_dot_r, line_col32)
-        draw_list.add_circle_filled((rect_shape_pmax[0] - corner_dot, rect_shape_pmin[1] + corner_dot),
-                                    circle_dot_r, line_col32)
-        draw_list.add_circle_filled((rect_shape_pmax[0] - corner_dot, rect_shape_pmax[1] - corner_dot),
-                                    circle_dot_r, line_col32)
-    
+    draw_list.add_rect(pmin, pmax, line_col32)
+    draw_list.add_rect((pmin[0]-5, pmin[1]-5), (pmax[0]+5, pmax[1]+5), line_col32, thickness=3)
+    for p1, p2 in geometry.lines:
+        draw_list.add_line(p1, p2, line_col32)
+    for dot in geometry.dots:
+        draw_list.add_circle_filled(dot, geometry.dot_r, line_col32)
 
     # draw stones
     black_col = imgui.get_color_u32((0,0,0,1))
     white_col = imgui.get_color_u32((1,1,1,1))
-    stone_r = line_interval * 0.46
 
     # draw stone at mouse postion for hint
-    grid_x, grid_y = get_mouse_grid([rect_shape_pmin[0], rect_shape_pmin[1]], line_interval)
-    if grid_x >= 0 and grid_x < game_config.board_size and \
-        grid_y >= 0 and grid_y < game_config.board_size:
-        stone_pos = [rect_shape_pmin[0] + grid_x * line_interval, rect_shape_pmin[1] + grid_y * line_interval]
-        draw_list.add_circle_filled((stone_pos[0], stone_pos[1]),
-                                    stone_r,
+    grid_x, grid_y = get_mouse_grid(pmin, geometry.line_interval)
+    if grid_x >= 0 and grid_x < geometry.board_size and \
+        grid_y >= 0 and grid_y < geometry.board_size:
+        stone_pos = geometry.grid_pos(grid_x, grid_y)
+        draw_list.add_circle_filled(stone_pos, geometry.stone_r,
                                     black_col if player_use_black else white_col)
-        rect_w = line_interval / 2
+        rect_w = geometry.line_interval / 2
         draw_list.add_rect((stone_pos[0] - rect_w, stone_pos[1] - rect_w),
                            (stone_pos[0] + rect_w, stone_pos[1] + rect_w),
                            imgui.get_color_u32((1,0,0,1)))
 
     # draw stones on board
-    for i in range(board_state.shape[0]):
-        for j in range(board_state.shape[1]):
-            if board_state[i, j] == 0:
-                continue
-            draw_list.add_circle_filled((rect_shape_pmin[0] + i * line_interval,
-                                         rect_shape_pmin[1] + j * line_interval),
-                                        stone_r,
-                                        black_col if board_state[i,j] == 1 else white_col)
-
-    if last_place_pos is not None:
+    for _, center, stone in _stones:
+        draw_list.add_circle_filled(center, geometry.stone_r, black_col if stone == 1 else white_col)
+
+    if _stones:
         red_col = imgui.get_color_u32((1,0,0,1))
-        pos = (last_place_pos[0] * line_interval + rect_shape_pmin[0], last_place_pos[1] * line_interval + rect_shape_pmin[1])
+        pos = _stones[-1][1]
         hint_len = 6
         draw_list.add_line((pos[0]-hint_len, pos[1]), (pos[0]+hint_len, pos[1]),
                            red_col, 3)
         draw_list.add_line((pos[0],pos[1]-hint_len), (pos[0],pos[1]+hint_len),
                            red_col, 3)
 
-    return rect_shape_pmin, rect_shape_pmax
+    return pmin, pmax
 
 
 @immapp.static(popup_opened = False)
@@ -3,6 +3,7 @@ cons = Console()
 import numpy as np
 
 import game_config
+from .bit_board import BitBoard
 
 
 def check_is_game_end(board_state: np.ndarray, last_move_pos: tuple[int, int]):
@@ -118,25 +119,156 @@ def is_game_end(board_state: np.ndarray, stone_id: int):
     return 0
                 
         
-def uniform_playout_policy(board_state: np.ndarray, stone_id: int):
+# directions of a line: row, column, skew [1, 1], skew [1, -1]
+_DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+def _has_five_in_row(masks: np.ndarray, target_num: int = 5):
+    """
+    masks: (B, N, N) bool array.
+    @return: (B,) bool array, True if a board has target_num True cells in a line.
+    """
+    n = masks.shape[-1]
+    span = target_num - 1
+    res = np.zeros(masks.shape[0], dtype=bool)
+    if n < target_num:
+        return res
+    for dx, dy in _DIRECTIONS:
+        # windows start at (x, y) and cover (x + i * dx, y + i * dy), i in [0, target_num).
+        rows = n - span * dx
+        cols = n - span * abs(dy)
+        y0 = 0 if dy >= 0 else span
+        window = masks[:, 0:rows, y0:y0 + cols].copy()
+        for i in range(1, target_num):
+            window &= masks[:, i * dx:i * dx + rows, y0 + i * dy:y0 + i * dy + cols]
+        res |= window.any(axis=(1, 2))
+    return res
+
+
+def batch_is_game_end(boards: np.ndarray, stone_id):
+    """
+    Vectorized game end check of a stack of boards.
+    boards: (B, N, N) array of board states; stone_id: int or (B,) array.
+    Return: (B,) int8 array, 0: not end; 1: stone_id wins; 2. fair.
+    Unlike is_game_end, a five on a full board counts as a win.
+    """
+    boards = np.asarray(boards)
+    stone_id = np.broadcast_to(np.asarray(stone_id), boards.shape[:1])
+    res = np.zeros(boards.shape[0], dtype=np.int8)
+    res[(boards != 0).all(axis=(1, 2))] = 2
+    res[_has_five_in_row(boards == stone_id[:, None, None])] = 1
+    return res
+
+
+def batch_check_is_game_end(boards: np.ndarray, last_move_pos: np.ndarray):
     """
+    Vectorized check_is_game_end: only the lines through the last move of each board are checked.
+    boards: (B, N, N) array of board states; last_move_pos: (B, 2) array of positions.
+    Return: (B,) int8 array, 0: not end; 1: win; 2. fair.
+    """
+    boards = np.asarray(boards)
+    last_move_pos = np.asarray(last_move_pos, dtype=np.intp)
+    batch, n = boards.shape[0], boards.shape[-1]
+    target_num = 5
+    pos_x, pos_y = last_move_pos[:, 0], last_move_pos[:, 1]
+    stone_id = boards[np.arange(batch), pos_x, pos_y]
+
+    # cells at offsets [-4, 4] along each direction: (B, 4, 9)
+    offsets = np.arange(-(target_num - 1), target_num)
+    dirs = np.array(_DIRECTIONS)
+    xs = pos_x[:, None, None] + dirs[None, :, 0, None] * offsets
+    ys = pos_y[:, None, None] + dirs[None, :, 1, None] * offsets
+    inside = (xs >= 0) & (xs < n) & (ys >= 0) & (ys < n)
+    cells = boards[np.arange(batch)[:, None, None], np.clip(xs, 0, n - 1), np.clip(ys, 0, n - 1)]
+    line = inside & (cells == stone_id[:, None, None]) & (stone_id != 0)[:, None, None]
+
+    window = line[..., :target_num].copy()
+    for i in range(1, target_num):
+        window &= line[..., i:i + target_num]
+    win = window.any(axis=(1, 2))
+
+    res = np.zeros(batch, dtype=np.int8)
+    res[(boards != 0).all(axis=(1, 2))] = 2
+    res[win] = 1
+    return res
+
+
+def uniform_playout_policy(board: BitBoard, stone_id: int):
+    """
+    Play random stones on board until the game ends, then restore board.
     @return: 0 -> draw, 1 -> win, 2 -> loss
     """
-    board = board_state.copy()
-    empty_pos = []
-    for i in range(game_config.board_size):
-        for j in range(game_config.board_size):
-            if board[i,j] == 0:
-                empty_pos.append((i, j))
+    num_moves = board.stone_count
+    empty_pos = board.empty_places()
     cur_stone_id = stone_id
+    res = 0
     for step in range(len(empty_pos)):
         rand_idx = np.random.randint(step, len(empty_pos))
         empty_pos[step], empty_pos[rand_idx] = empty_pos[rand_idx], empty_pos[step]
-        board[*(empty_pos[step])] = cur_stone_id
-        game_res = check_is_game_end(board, empty_pos[step])
+        board.place(*empty_pos[step], cur_stone_id)
+        game_res = board.check_is_game_end(empty_pos[step])
         if game_res == 1:
-            return 1 if cur_stone_id == stone_id else 2
+            res = 1 if cur_stone_id == stone_id else 2
+            break
         if game_res == 2:
-            return 0
+            break
         cur_stone_id = 3 - cur_stone_id # exchange id 1 <--> 2
-    return 0
+    board.undo_to(num_moves)
+    return res
+
+
+def _earliest_five(times: np.ndarray, target_num: int = 5):
+    """
+    times: (B, N, N) int array, time each cell gets a stone of one color, a large value if never.
+    @return: (B,) int array, time the first target_num cells in a line are all filled.
+    """
+    batch, n = times.shape[0], times.shape[-1]
+    span = target_num - 1
+    res = np.full(batch, np.iinfo(times.dtype).max, dtype=times.dtype)
+    if n < target_num:
+        return res
+    for dx, dy in _DIRECTIONS:
+        rows = n - span * dx
+        cols = n - span * abs(dy)
+        y0 = 0 if dy >= 0 else span
+        window = times[:, 0:rows, y0:y0 + cols].copy()
+        for i in range(1, target_num):
+            np.maximum(window, times[:, i * dx:i * dx + rows, y0 + i * dy:y0 + i * dy + cols], out=window)
+        np.minimum(res, window.min(axis=(1, 2)), out=res)
+    return res
+
+
+def batch_uniform_playout(boards: np.ndarray, stone_id, rng=np.random):
+    """
+    Vectorized uniform_playout_policy of a stack of boards, none of which may already hold a five.
+    Random playout fills the empty places in a random order, so every game is played to the
+    full board at once: each empty place gets its turn from a random permutation, and the game
+    ends at the first five, i.e. the five whose last stone has the earliest turn.
+    boards: (B, N, N) array of board states; stone_id: id to move, int or (B,) array.
+    @return: (results, lengths), (B,) int8 array 0 -> draw, 1 -> win, 2 -> loss of stone_id,
+    and (B,) array of stones placed by each game.
+    """
+    boards = np.asarray(boards)
+    batch, n = boards.shape[0], boards.shape[-1]
+    stone_id = np.broadcast_to(np.asarray(stone_id), (batch,))
+    flat = boards.reshape(batch, n * n)
+    empty = flat == 0
+    keys = rng.random_sample((batch, n * n))
+    keys[~empty] = 2.0 # after every empty place
+    turns = np.empty((batch, n * n), dtype=np.int32)
+    np.put_along_axis(turns, np.argsort(keys, axis=1),
+                      np.broadcast_to(np.arange(n * n, dtype=np.int32), (batch, n * n)), axis=1)
+    colors = np.where(empty, np.where(turns % 2 == 0, stone_id[:, None], 3 - stone_id[:, None]), flat)
+    turns[~empty] = -1 # stones already on the board
+
+    never = np.iinfo(np.int32).max
+    end_turn = np.full(batch, never, dtype=np.int32)
+    winner = np.zeros(batch, dtype=np.int8)
+    for color in (1, 2):
+        first = _earliest_five(np.where(colors == color, turns, never).reshape(batch, n, n))
+        earlier = first < end_turn
+        end_turn[earlier] = first[earlier]
+        winner[earlier] = color
+    results = np.where(winner == 0, 0, np.where(winner == stone_id, 1, 2)).astype(np.int8)
+    lengths = np.where(winner == 0, empty.sum(axis=1), end_turn + 1)
+    return results, lengths
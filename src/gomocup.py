@@ -0,0 +1,275 @@
+"""
+Headless engine speaking the Gomocup protocol (https://plastovicka.github.io/protocl2en.htm) over
+stdin / stdout, so tournament managers and src/engine_server.py can drive py_MCTS without the GUI.
+
+    python -m src.gomocup [--threads 2] [--default-turn-ms 5000]
+
+Commands handled, one per line, coordinates are "x,y" with x indexing the first axis of the
+board array like Game does:
+
+    START size          -> OK, or ERROR for a size py_MCTS doesn't support
+    RECTSTART w,h       -> OK if w == h, else ERROR
+    RESTART             -> OK, empty board
+    INFO key value      -> nothing; timeout_turn, timeout_match, time_left, max_memory are used,
+                           max_memory bounds the tree, whose least visited subtrees are collapsed
+    BEGIN               -> move of the engine on the empty board
+    TURN x,y            -> move of the engine after the opponent played x,y
+    BOARD               -> followed by "x,y,field" lines and DONE, field 1 for own stones and 2
+                           for the opponent's, in the order they were played; replies a move.
+                           Field 3 (continuous game) is answered by ERROR
+    TAKEBACK x,y        -> OK, the stone at x,y is removed
+    ABOUT               -> name="...", version="...", ...
+    END                 -> exit
+
+The search tree follows the game: while the moves played extend those at the tree root, the
+root is advanced through them and its statistics are kept.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from .bit_board import BitBoard
+
+ABOUT = 'name="py_five_in_row", version="1.0", author="maojh15", country="CN"'
+# stop this long before the turn timeout, for replying and the manager's own overhead.
+TURN_MARGIN_MS = 60
+# search time of a move for timeout_turn 0, which asks to play as fast as possible.
+FAST_TURN_MS = 10
+# estimate of the moves still to play, the remaining match time is shared between them.
+MOVES_TO_GO = 20
+# bytes of a tree node and of a transposition table entry of py_MCTS, for max_memory.
+NODE_BYTES = 32
+TABLE_ENTRY_BYTES = 16
+# with a node budget, the transposition table holds at most 2 entries per node of the budget.
+BUDGET_NODE_BYTES = NODE_BYTES + 2 * TABLE_ENTRY_BYTES
+# nodes are allocated by arena chunks of 65536, the last one is allocated whole.
+ARENA_CHUNK_BYTES = 65536 * NODE_BYTES
+# a smaller max_memory can't be met anyway, the first arena chunk is larger.
+MIN_NODE_BUDGET = 1024
+
+
+def node_budget(max_memory: int):
+    """
+    Return: node_budget of the tree keeping nodes and transposition table within max_memory
+    bytes, 0 (unlimited) if max_memory is 0.
+    """
+    if max_memory <= 0:
+        return 0
+    return max(MIN_NODE_BUDGET, (max_memory - ARENA_CHUNK_BYTES) // BUDGET_NODE_BYTES)
+
+
+class GomocupEngine:
+    """
+    State of one game and its search tree. handle() takes a command line and returns the reply
+    lines, so the engine can be driven without stdin / stdout.
+    """
+    def __init__(self, num_threads: int = 1, default_turn_ms: int = 5000, seed: int | None = None) -> None:
+        self.num_threads = num_threads
+        self.default_turn_ms = default_turn_ms
+        self.seed = seed
+        self.board: BitBoard | None = None
+        self.info = {}
+        self.tree = None
+        self.tree_moves: list[tuple[int, int]] = [] # moves played to reach the tree root
+        self.board_lines: list[str] | None = None # lines of a BOARD command being read
+        self.ended = False
+
+    def handle(self, line: str):
+        """
+        Return: list of reply lines.
+        """
+        line = line.strip()
+        if self.board_lines is not None:
+            if line.upper() != "DONE":
+                self.board_lines.append(line)
+                return []
+            lines, self.board_lines = self.board_lines, None
+            try:
+                return self.__board(lines)
+            except ValueError:
+                return ["ERROR malformed BOARD line"]
+            except RuntimeError as e:
+                return [f"ERROR {e}"]
+        if not line:
+            return []
+        command, _, args = line.partition(" ")
+        command = command.upper()
+        try:
+            if command == "START":
+                return self.__start(int(args))
+            if command == "RECTSTART":
+                width, height = (int(v) for v in args.split(","))
+                if width != height:
+                    return ["ERROR only square boards are supported"]
+                return self.__start(width)
+            if command == "END":
+                self.ended = True
+                return []
+            if command == "ABOUT":
+                return [ABOUT]
+            if command == "INFO":
+                key, _, value = args.partition(" ")
+                self.info[key.lower()] = value.strip()
+                return []
+            if self.board is None:
+                return ["ERROR START was not sent"]
+            if command == "RESTART":
+                return self.__start(self.board.board_size)
+            if command == "BEGIN":
+                if self.board.stone_count != 0:
+                    return ["ERROR BEGIN on a board which is not empty"]
+                return [self.__think()]
+            if command == "TURN":
+                move = self.__parse_move(args)
+                if move is None:
+                    return [f"ERROR invalid move {args}"]
+                self.board.place(*move, self.__stone_to_move())
+                return [self.__think()]
+            if command == "BOARD":
+                self.board_lines = []
+                return []
+            if command == "TAKEBACK":
+                move = self.__parse_move(args, empty=False)
+                if move is None:
+                    return [f"ERROR invalid move {args}"]
+                board = BitBoard(self.board.board_size)
+                for m in self.board.moves:
+                    if m != move:
+                        board.place(*m, self.board.at(*m))
+                self.board = board
+                return ["OK"]
+        except ValueError:
+            return [f"ERROR malformed command {line}"]
+        except RuntimeError as e:
+            # SearchMove on a position without any move left.
+            return [f"ERROR {e}"]
+        return [f"UNKNOWN {command}"]
+
+    def __start(self, board_size: int):
+        if board_size < 5 or board_size > 32:
+            return [f"ERROR unsupported board size {board_size}"]
+        self.board = BitBoard(board_size)
+        self.tree = None
+        self.tree_moves = []
+        return ["OK"]
+
+    def __parse_move(self, text: str, empty: bool = True):
+        """
+        Return: (x, y) on the board, None if it is off the board or the place is (not) empty.
+        """
+        x, y = (int(v) for v in text.split(",")[:2])
+        n = self.board.board_size
+        if not (0 <= x < n and 0 <= y < n) or (self.board.at(x, y) == 0) != empty:
+            return None
+        return x, y
+
+    def __stone_to_move(self):
+        return 1 if self.board.stone_count % 2 == 0 else 2
+
+    def __rebuild(self, moves: list[tuple[int, int]]):
+        """
+        Replace the board by moves played alternately from black.
+        """
+        self.board = BitBoard(self.board.board_size)
+        for move in moves:
+            self.board.place(*move, self.__stone_to_move())
+
+    def __board(self, lines: list[str]):
+        own, opponent = [], []
+        for line in lines:
+            if not line:
+                continue
+            x, y, field = (int(v) for v in line.split(",")[:3])
+            if field not in (1, 2):
+                # 3 marks stones of a continuous game, which isn't supported.
+                return [f"ERROR unsupported field {field} in BOARD"]
+            (own if field == 1 else opponent).append((x, y))
+        # the engine is to move, so it is black if both sides have as many stones.
+        if len(opponent) not in (len(own), len(own) + 1):
+            return ["ERROR stone counts don't allow the engine to move"]
+        first, second = (own, opponent) if len(own) == len(opponent) else (opponent, own)
+        moves = [m for pair in zip(first, second + [None]) for m in pair if m is not None]
+        n = self.board.board_size
+        if len(set(moves)) != len(moves) or any(not (0 <= x < n and 0 <= y < n) for x, y in moves):
+            return ["ERROR invalid board"]
+        self.__rebuild(moves)
+        return [self.__think()]
+
+    def turn_budget_ms(self):
+        """
+        Return: milliseconds to search this move, from timeout_turn, and time_left shared over
+        MOVES_TO_GO moves when the match is timed. timeout_turn 0 gets FAST_TURN_MS, without
+        timeout_turn default_turn_ms is used.
+        """
+        if "timeout_turn" not in self.info:
+            budget = self.default_turn_ms
+        elif int(self.info["timeout_turn"]) <= 0:
+            return FAST_TURN_MS
+        else:
+            budget = int(self.info["timeout_turn"])
+        if int(self.info.get("timeout_match", 0)) > 0 and "time_left" in self.info:
+            budget = min(budget, int(self.info["time_left"]) // MOVES_TO_GO)
+        return max(1, budget - TURN_MARGIN_MS)
+
+    def __sync_tree(self, stone_id: int):
+        """
+        Bring the tree root to the board, advancing it when the board follows from it.
+        """
+        moves = list(self.board.moves)
+        if self.tree is not None and moves[:len(self.tree_moves)] == self.tree_moves:
+            for move in moves[len(self.tree_moves):]:
+                self.tree.AdvanceRoot(move)
+        else:
+            import py_MCTS
+            self.tree = py_MCTS.MonteCarloTreeSearch(self.board.to_numpy(np.int8), stone_id)
+            self.tree.playout_policy = py_MCTS.NearPlacePlayout
+            self.tree.near_playout_policy_distance = 1
+            self.tree.num_threads = self.num_threads
+            if self.seed is not None:
+                self.tree.random_seed = self.seed
+        self.tree_moves = moves
+
+    def __think(self):
+        """
+        Search, play and return the engine's move as "x,y".
+        """
+        time1 = time.time()
+        stone_id = self.__stone_to_move()
+        self.__sync_tree(stone_id)
+        self.tree.node_budget = node_budget(int(self.info.get("max_memory", 0)))
+        move = self.tree.SearchMove(0, self.turn_budget_ms())
+        move = (int(move[0]), int(move[1]))
+        self.board.place(*move, stone_id)
+        self.tree.AdvanceRoot(move)
+        self.tree_moves.append(move)
+        print(f"move {move} in {time.time() - time1:.3f}s, {self.tree.last_search_iterations} iterations",
+              file=sys.stderr)
+        return f"{move[0]},{move[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gomocup protocol engine on stdin / stdout.")
+    parser.add_argument("--threads", type=int, default=1, help="search threads of py_MCTS")
+    parser.add_argument("--default-turn-ms", type=int, default=5000,
+                        help="search time of a move when the manager sends no timeout_turn")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    # replies own the real stdout, anything else printed by the engine goes to stderr.
+    protocol_out = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    engine = GomocupEngine(args.threads, args.default_turn_ms, args.seed)
+    for line in sys.stdin:
+        for reply in engine.handle(line):
+            protocol_out.write(reply + "\n")
+        if engine.ended:
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -1,136 +1,324 @@
 import numpy as np
-from random import shuffle
 from rich.progress import Progress
 from rich.console import Console
 cons = Console()
 
 from . import game_utils
+from .bit_board import BitBoard
+from .transposition_table import TranspositionTable
 
-def exploit_priority(win_rounds, total_rounds, parent_node_total_rounds):
-    const = 1.4142135623730951 # sqrt(2)
-    if total_rounds == 0:
-        return np.inf
-    return win_rounds / total_rounds + \
-        const * np.sqrt(np.log(parent_node_total_rounds) / total_rounds)
-
-
-class TreeNode:
-    def __init__(self, state: np.ndarray, parent, stone_id: int, from_moving: tuple[int, int]) -> None:
-        self.state = state.copy()
-        self.parent: TreeNode | None = parent
-        self.stone_id = stone_id # id of last moved stone which leads to self.states
-        self.from_moving = from_moving
-        self.children: list[TreeNode] | None = None
-        self.win_rounds = 0
-        self.total_rounds = 0
-        self.exploit_priority = 0
-        self.update_exploit_priority()
-    
-    def update(self, added_win_rounds: float, added_total_rounds: int):
-        self.win_rounds += added_win_rounds
-        self.total_rounds += added_total_rounds
-
-    def update_exploit_priority(self):
-        self.exploit_priority = exploit_priority(self.win_rounds, self.total_rounds,
-                                                 self.parent.total_rounds if self.parent is not None else 1)
+EXPLORE_COEF = 1.4142135623730951 # sqrt(2)
+
+
+def place_priors(board_state: np.ndarray):
+    """
+    Cheap prior of playing at each place: stones next to it count 2, stones two places away count 1.
+    Same as PlacePrior in src/cpp/monte_carlo_tree_search.cpp, computed for the whole board at once.
+    Return: (N, N) int array.
+    """
+    n = board_state.shape[0]
+    padded = np.zeros((n + 4, n + 4), dtype=np.int32)
+    padded[2:n + 2, 2:n + 2] = board_state != 0
+    prior = np.zeros((n, n), dtype=np.int32)
+    for dx in range(-2, 3):
+        for dy in range(-2, 3):
+            if dx != 0 or dy != 0:
+                weight = 2 if max(abs(dx), abs(dy)) == 1 else 1
+                prior += weight * padded[2 + dx:n + 2 + dx, 2 + dy:n + 2 + dy]
+    return prior
+
+
+class NodeStore:
+    """
+    Tree nodes as a struct of NumPy arrays, node i is row i of every array.
+    A node keeps only the move leading to it, the board is rebuilt along the selection path.
+    Children of a node are the contiguous block [first_child, first_child + num_children).
+    With progressive widening they are allocated one at a time as the node gains visits, so
+    they are listed in children[node] instead, and the moves without a child yet wait in
+    untried[node] as flat board indices, best first.
+    A node whose position was already in the search graph when it is first visited becomes
+    an alias: it keeps its own move and parent, while statistics and children live in node stat[i].
+    """
+    def __init__(self, capacity: int = 1024) -> None:
+        self.size = 0
+        self.visits = np.zeros(capacity, dtype=np.int32)
+        self.wins = np.zeros(capacity, dtype=np.float64)
+        self.parent = np.full(capacity, -1, dtype=np.int32)
+        self.first_child = np.full(capacity, -1, dtype=np.int32)
+        self.num_children = np.zeros(capacity, dtype=np.int32)
+        self.move = np.full((capacity, 2), -1, dtype=np.int8)
+        self.stone_id = np.zeros(capacity, dtype=np.int8) # id of last moved stone which leads to the node
+        self.stat = np.arange(capacity, dtype=np.int32)
+        self.children: dict[int, list[int]] = {}
+        self.untried: dict[int, np.ndarray] = {}
+
+    def allocate(self, count: int):
+        """
+        Return: index of the first of count new contiguous nodes.
+        """
+        first = self.size
+        if first + count > len(self.visits):
+            self.__grow(max(2 * len(self.visits), first + count))
+        self.size += count
+        return first
+
+    def __grow(self, capacity: int):
+        old = len(self.visits)
+        fill = {"parent": -1, "first_child": -1, "move": -1}
+        for name in ("visits", "wins", "parent", "first_child", "num_children", "move", "stone_id"):
+            array = getattr(self, name)
+            grown = np.full((capacity,) + array.shape[1:], fill.get(name, 0), dtype=array.dtype)
+            grown[:old] = array
+            setattr(self, name, grown)
+        self.stat = np.concatenate([self.stat, np.arange(old, capacity, dtype=np.int32)])
 
 
 class MonteCarloTreeSearch:
-    def __init__(self, root_state: np.ndarray, stone_id: int) -> None:
-        self.root = TreeNode(root_state, None, 3 - stone_id, None) # type: ignore
+    def __init__(self, root_state: np.ndarray, stone_id: int, transposition_table_size: int = 1 << 18,
+                 progressive_widening: bool = False, widening_coef: float = 2.0, widening_exponent: float = 0.5,
+                 batch_size: int = 8) -> None:
+        """
+        transposition_table_size: entries of the table sharing nodes of positions reached by
+        different move orders, 0 disables it.
+        progressive_widening: create children on demand, best first by place_priors, a node visited
+        n times may have ceil(widening_coef * n ** widening_exponent) children. Otherwise all
+        children are created when a node is expanded.
+        batch_size: leaves selected before their rollouts are played together by
+        game_utils.batch_uniform_playout. Visits of a selected path are counted at once, so the
+        following selections of the batch spread over other leaves.
+        """
+        self.nodes = NodeStore()
+        self.root = self.nodes.allocate(1)
+        self.nodes.stone_id[self.root] = 3 - stone_id
         self.stone_id = stone_id
-        
+        # board of the node currently visited, equals root state between iterations.
+        self.board = BitBoard.from_state(root_state)
+        self.root_num_moves = self.board.stone_count
+        self.transposition_table = TranspositionTable(transposition_table_size, lambda node: self.nodes.visits[node])
+        self.progressive_widening = progressive_widening
+        self.widening_coef = widening_coef
+        self.widening_exponent = widening_exponent
+        self.batch_size = max(1, batch_size)
+        self.num_rollouts = 0
+
+    @property
+    def num_nodes(self):
+        """
+        Number of nodes in the tree.
+        """
+        return self.nodes.size
+
     def search_move(self, iter_steps = 5000):
-        trans_game_res = [0, 2, 1]
         prog = Progress()
         prog.start()
         task = prog.add_task("ai thinking", total=iter_steps)
-        for itr in range(iter_steps):
-            leaf = self.selection()
-            if leaf is None:
-                continue
-            game_res = game_utils.check_is_game_end(leaf.state, leaf.from_moving)
-            if game_res != 0:
-                self.back_propagation(leaf, leaf.stone_id, 1 if game_res == 1 else 0)
-                continue
-            game_res = self.rollout_play(leaf.state, 3 - leaf.stone_id)
-            # game_res == 1 means (3 - leaf.stone_id) win, thus leaf loss game.
-            self.back_propagation(leaf, leaf.stone_id, trans_game_res[game_res])
-            prog.advance(task)
+        done = 0
+        while done < iter_steps:
+            count = min(self.batch_size, iter_steps - done)
+            self.search_batch(count)
+            done += count
+            prog.advance(task, count)
         prog.stop()
-        most_total_child = self.__get_most_total_rounds_child()
-        cons.log(f"win ratio: {most_total_child.win_rounds}/{most_total_child.total_rounds}"
-                 f"={most_total_child.win_rounds/most_total_child.total_rounds}")
-        return most_total_child.from_moving
+        best_child = self.__get_most_total_rounds_child()
+        stat = self.nodes.stat[best_child]
+        win_rounds, total_rounds = self.nodes.wins[stat], self.nodes.visits[stat]
+        cons.log(f"win ratio: {win_rounds}/{total_rounds}={win_rounds/total_rounds}")
+        return tuple(int(v) for v in self.nodes.move[best_child])
+
+    def search_batch(self, count: int):
+        """
+        Run count iterations: select count leaves, play their rollouts at once, then back propagate.
+        """
+        paths = []
+        leaf_stone_ids = []
+        boards = []
+        for _ in range(count):
+            path, game_res = self.selection()
+            leaf_stone_id = int(self.nodes.stone_id[path[-1]])
+            if game_res is not None:
+                self.back_propagation(path, leaf_stone_id, game_res)
+            else:
+                paths.append(path)
+                leaf_stone_ids.append(leaf_stone_id)
+                boards.append(self.board.to_numpy())
+            self.undo_moves()
+        if not paths:
+            return
+        leaf_stone_ids = np.array(leaf_stone_ids)
+        results, _ = self.rollout_play(np.stack(boards), 3 - leaf_stone_ids)
+        self.num_rollouts += len(paths)
+        # results are of the player to move at the leaf, thus swap win and loss for the leaf.
+        trans_game_res = np.array([0, 2, 1])[results]
+        for path, leaf_stone_id, game_res in zip(paths, leaf_stone_ids, trans_game_res):
+            self.back_propagation(path, leaf_stone_id, game_res)
 
-    
     def __get_most_total_rounds_child(self):
         """
-        move to most exploited nodes
-        """
-        max_total_rounds = self.root.children[0].total_rounds # type: ignore
-        max_arg = self.root.children[0] # type: ignore
-        for ch in self.root.children: # type: ignore
-            if ch.total_rounds > max_total_rounds:
-                max_total_rounds = ch.total_rounds
-                max_arg = ch
-        return max_arg
-
-    def rollout_play(self, board_states: np.ndarray, stone_id):
-        """
-        @return: 0 -> draw; 1 -> stone_id win; 2 -> stone_id loss.
-        """
-        return game_utils.uniform_playout_policy(board_states, stone_id)
-
-    def selection(self) -> TreeNode | None:
-        leaf = self.__search_leaf(self.root)
-        game_res = game_utils.check_is_game_end(leaf.state, leaf.from_moving) if leaf.from_moving is not None else 0
-        if game_res != 0:
-            self.back_propagation(leaf, leaf.stone_id, 1 if game_res == 1 else 0)
-            return None
-        self.expansion(leaf)
-        return leaf.children[0] # type: ignore
-
-    
-    def expansion(self, leaf: TreeNode):
-        leaf.children = []
-        # stone_id: 1 means black stone, 2 means white stone,
-        # thus 3 - stone_id gives stone id of opponent.
-        opponent_stone_id = 3 - leaf.stone_id
-        for i in range(leaf.state.shape[0]):
-            for j in range(leaf.state.shape[1]):
-                if leaf.state[i,j] == 0:
-                    leaf.state[i,j] = opponent_stone_id
-                    leaf.children.append(TreeNode(leaf.state, leaf, opponent_stone_id, (i, j)))
-                    leaf.state[i,j] = 0
-        shuffle(leaf.children)
-        
-
-    def back_propagation(self, node: TreeNode | None, leaf_stone_id, game_res):
+        Return: root child with the most visits.
         """
-        @param game_res: 0 -> draw; 1 -> leaf_stone_id win; 2 -> leaf_stone_id loss.
+        nodes = self.nodes
+        children = self.children(self.root)
+        return int(children[np.argmax(nodes.visits[nodes.stat[children]])])
+
+    def root_children(self):
+        """
+        Return: list of (move, win_rounds, total_rounds) of root children.
+        """
+        nodes = self.nodes
+        res = []
+        for ch in self.children(self.root):
+            stat = nodes.stat[ch]
+            res.append(((int(nodes.move[ch, 0]), int(nodes.move[ch, 1])), float(nodes.wins[stat]), int(nodes.visits[stat])))
+        return res
+
+    def rollout_play(self, boards: np.ndarray, stone_ids: np.ndarray):
+        """
+        boards: (B, N, N) boards of leaves; stone_ids: (B,) ids to move.
+        @return: (results, lengths), results 0 -> draw; 1 -> stone_id win; 2 -> stone_id loss.
+        """
+        return game_utils.batch_uniform_playout(boards, stone_ids)
+
+    def undo_moves(self):
+        """
+        Restore self.board to the root state.
         """
-        path: list[TreeNode] = []
-        while node is not None:
-            if game_res == 1: # leaf_stone_id win
-                node.update(1 if node.stone_id == leaf_stone_id else 0, 1)
-            elif game_res == 2:
-                node.update(0 if node.stone_id == leaf_stone_id else 1, 1)
-            else: # draw
-                node.update(0.5, 1)
-            path.append(node)
-            node = node.parent
-        for n in path:
-            n.update_exploit_priority()
-    
-    def __search_leaf(self, node: TreeNode):
-        while node.children is not None:
-            max_val = node.children[0].exploit_priority
-            max_arg = node.children[0]
-            for ch in node.children:
-                if ch.exploit_priority > max_val:
-                    max_val = ch.exploit_priority
-                    max_arg = ch
-            node = max_arg
+        self.board.undo_to(self.root_num_moves)
+
+    def selection(self):
+        """
+        Descend to a leaf, expand it and step into its first child, adding a visit to every
+        node of the path. self.board follows the path until undo_moves.
+        Return: (path, game_res), path of resolved nodes; game_res is None if a rollout is
+        needed, else the result for the last node of path, 1 -> win, 0 -> draw.
+        """
+        nodes = self.nodes
+        node = self.root
+        path = [node]
+        nodes.visits[node] += 1
+        while nodes.num_children[node] > 0:
+            if node in nodes.untried and nodes.num_children[node] < self.allowed_children(node):
+                self.widen(node)
+            node = self.__play_move(self.__most_priority_child(node), path)
+        move = nodes.move[node]
+        if move[0] >= 0:
+            game_res = self.board.check_is_game_end((int(move[0]), int(move[1])))
+            if game_res != 0:
+                return path, 1 if game_res == 1 else 0
+        self.expansion(node)
+        if nodes.num_children[node] == 0:
+            return path, 0 # no empty place left
+        self.__play_move(int(self.children(node)[0]), path)
+        return path, None
+
+    def __play_move(self, child: int, path: list[int]):
+        """
+        Place the move of child on self.board and add a visit to the node it resolves to.
+        On its first visit, a child whose position is in the transposition table becomes an alias
+        of the node stored there, otherwise it is stored. Unvisited children hold no statistics,
+        so looking them up lazily loses nothing and saves a lookup for most children.
+        Return: the resolved node, which is appended to path.
+        """
+        nodes = self.nodes
+        self.board.place(int(nodes.move[child, 0]), int(nodes.move[child, 1]), int(nodes.stone_id[child]))
+        table = self.transposition_table
+        if table.capacity > 0 and nodes.visits[child] == 0 and nodes.stat[child] == child:
+            same = table.lookup(self.board.hash)
+            if same is None:
+                table.store(self.board.hash, child)
+            else:
+                nodes.stat[child] = same
+        node = int(nodes.stat[child])
+        nodes.visits[node] += 1
+        path.append(node)
         return node
-    
\ No newline at end of file
+
+    def __most_priority_child(self, node: int):
+        """
+        Return: child of node with the largest UCB, computed over the whole children slice at once.
+        """
+        nodes = self.nodes
+        children = self.children(node)
+        stats = nodes.stat[children]
+        visits = nodes.visits[stats]
+        unvisited = np.flatnonzero(visits == 0)
+        if len(unvisited) > 0:
+            return int(children[unvisited[0]])
+        priority = nodes.wins[stats] / visits + \
+            EXPLORE_COEF * np.sqrt(np.log(max(nodes.visits[node], 1)) / visits)
+        return int(children[np.argmax(priority)])
+
+    def children(self, node: int):
+        """
+        Return: int array of the children of node.
+        """
+        nodes = self.nodes
+        if node in nodes.children:
+            return np.asarray(nodes.children[node], dtype=np.int32)
+        first = nodes.first_child[node]
+        return np.arange(first, first + nodes.num_children[node], dtype=np.int32)
+
+    def expansion(self, leaf: int):
+        """
+        Allocate the children block of leaf in random order, self.board should be the board at leaf.
+        With progressive widening only the first allowed_children(leaf) children are allocated,
+        the other moves wait in nodes.untried[leaf], best first by place_priors.
+        """
+        nodes = self.nodes
+        n = self.board.board_size
+        cells = np.array(self.board.cells, dtype=np.int8)
+        moves = np.random.permutation(np.flatnonzero(cells == 0))
+        if len(moves) == 0:
+            return
+        if self.progressive_widening:
+            # stable sort, moves of equal prior stay shuffled.
+            moves = moves[np.argsort(-place_priors(cells.reshape(n, n)).ravel()[moves], kind="stable")]
+            nodes.untried[leaf] = moves.astype(np.int16)
+            nodes.children[leaf] = []
+            for _ in range(min(len(moves), self.allowed_children(leaf))):
+                self.widen(leaf)
+            return
+        first = nodes.allocate(len(moves))
+        nodes.parent[first:first + len(moves)] = leaf
+        nodes.move[first:first + len(moves), 0] = moves // n
+        nodes.move[first:first + len(moves), 1] = moves % n
+        nodes.stone_id[first:first + len(moves)] = 3 - nodes.stone_id[leaf]
+        nodes.first_child[leaf] = first
+        nodes.num_children[leaf] = len(moves)
+
+    def widen(self, node: int):
+        """
+        Progressive widening: allocate the child of node for its best untried move.
+        """
+        nodes = self.nodes
+        untried = nodes.untried[node]
+        if len(untried) > 1:
+            nodes.untried[node] = untried[1:]
+        else:
+            del nodes.untried[node]
+        child = nodes.allocate(1)
+        n = self.board.board_size
+        nodes.parent[child] = node
+        nodes.move[child] = divmod(int(untried[0]), n)
+        nodes.stone_id[child] = 3 - nodes.stone_id[node]
+        nodes.children[node].append(child)
+        nodes.num_children[node] += 1
+
+    def allowed_children(self, node: int):
+        """
+        Return: number of children progressive widening allows for node, from its visits.
+        """
+        return max(1, int(np.ceil(self.widening_coef * max(int(self.nodes.visits[node]), 1) ** self.widening_exponent)))
+
+    def back_propagation(self, path: list[int], leaf_stone_id: int, game_res: int):
+        """
+        Add the result to nodes of path, which may pass through transpositions. Their visits
+        were already counted by selection.
+        @param game_res: 0 -> draw; 1 -> leaf_stone_id win; 2 -> leaf_stone_id loss.
+        """
+        nodes = self.nodes
+        path = np.asarray(path)
+        if game_res == 0:
+            nodes.wins[path] += 0.5
+            return
+        leaf_side = nodes.stone_id[path] == leaf_stone_id
+        nodes.wins[path] += leaf_side if game_res == 1 else ~leaf_side
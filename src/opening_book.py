@@ -0,0 +1,245 @@
+"""
+Opening book: statistics of moves in early positions, looked up before searching.
+
+Positions are normalised over the 8 symmetries of the board: the key of a position is the
+smallest Zobrist hash among its rotations and reflections, and moves are stored in the
+coordinates of that transform. The book file is sorted by key and memory-mapped, so a lookup
+is a binary search touching only a few pages.
+
+File layout (little endian):
+    header  magic b"PFRBOOK1", uint32 version, uint32 board_size, uint64 num_entries, 8 bytes reserved
+    keys        uint64[num_entries]   sorted, entries of the same position are adjacent
+    total_rounds uint32[num_entries]
+    win_rounds  float32[num_entries]  from the view of the player making the move
+    moves       uint8[num_entries, 2] in canonical coordinates
+
+Build a book by searching the most visited lines from the empty board, or from arena games:
+
+    python -m src.opening_book search -o opening_book.bin --board-size 15 --depth 4 --width 3
+    python -m src.opening_book games -o opening_book.bin --board-size 15 arena.jsonl
+"""
+import argparse
+import json
+
+import numpy as np
+
+from .bit_board import zobrist_key
+
+MAGIC = b"PFRBOOK1"
+VERSION = 1
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("board_size", "<u4"),
+                         ("num_entries", "<u8"), ("reserved", "<u8")])
+
+# (x, y) -> coordinates of the transformed board of size n, and the inverse of each transform.
+_TRANSFORMS = [
+    lambda x, y, n: (x, y),
+    lambda x, y, n: (y, n - 1 - x),
+    lambda x, y, n: (n - 1 - x, n - 1 - y),
+    lambda x, y, n: (n - 1 - y, x),
+    lambda x, y, n: (y, x),
+    lambda x, y, n: (n - 1 - x, y),
+    lambda x, y, n: (n - 1 - y, n - 1 - x),
+    lambda x, y, n: (x, n - 1 - y),
+]
+_INVERSE = [0, 3, 2, 1, 4, 5, 6, 7]
+# xor-ed into the key for the player to move.
+_SIDE_KEYS = [0, 0x9e3779b97f4a7c15, 0xc2b2ae3d27d4eb4f]
+
+
+def canonical_key(board_state: np.ndarray, stone_id: int):
+    """
+    Return: (key, transform) where key is the smallest hash of the position over the 8
+    symmetries, and transform the index in _TRANSFORMS giving it.
+    """
+    n = board_state.shape[0]
+    stones = [(int(x), int(y), int(board_state[x, y])) for x, y in np.argwhere(board_state != 0)]
+    best = None
+    for t, transform in enumerate(_TRANSFORMS):
+        key = _SIDE_KEYS[stone_id]
+        for x, y, s in stones:
+            key ^= zobrist_key(*transform(x, y, n), s)
+        if best is None or key < best[0]:
+            best = (key, t)
+    return best
+
+
+def to_canonical(move: tuple[int, int], transform: int, board_size: int):
+    return _TRANSFORMS[transform](*move, board_size)
+
+
+def from_canonical(move: tuple[int, int], transform: int, board_size: int):
+    return _TRANSFORMS[_INVERSE[transform]](*move, board_size)
+
+
+class OpeningBookBuilder:
+    """
+    Accumulate move statistics of positions, then write them as a sorted book file.
+    """
+    def __init__(self, board_size: int) -> None:
+        self.board_size = board_size
+        self.stats: dict[tuple[int, tuple[int, int]], list[float]] = {} # (key, canonical move) -> [win_rounds, total_rounds]
+
+    def add(self, board_state: np.ndarray, stone_id: int, move: tuple[int, int],
+            win_rounds: float, total_rounds: int):
+        """
+        Add results of stone_id playing move on board_state, win_rounds from the view of stone_id.
+        """
+        if board_state.shape[0] != self.board_size:
+            raise ValueError(f"board of size {board_state.shape[0]} added to a book of size {self.board_size}")
+        key, transform = canonical_key(board_state, stone_id)
+        entry = self.stats.setdefault((key, to_canonical(move, transform, self.board_size)), [0.0, 0])
+        entry[0] += win_rounds
+        entry[1] += total_rounds
+
+    def add_search(self, board_state: np.ndarray, stone_id: int, tree):
+        """
+        Add statistics of root children of a py_MCTS tree searched from board_state.
+        """
+        for ch in tree.GetRootChildren():
+            if ch.total_rounds > 0:
+                self.add(board_state, stone_id, ch.from_moving, ch.win_rounds, ch.total_rounds)
+
+    def add_game(self, moves: list[tuple[int, int]], winner: int, max_moves: int):
+        """
+        Add the first max_moves moves of a game, black moves first. winner: stone id, 0 for a draw.
+        """
+        board = np.zeros((self.board_size, self.board_size), dtype=np.int8)
+        for i, move in enumerate(moves[:max_moves]):
+            stone_id = 1 + i % 2
+            result = 0.5 if winner == 0 else float(winner == stone_id)
+            self.add(board, stone_id, tuple(move), result, 1)
+            board[move[0], move[1]] = stone_id
+
+    def write(self, path: str):
+        items = sorted(self.stats.items(), key=lambda it: (it[0][0], -it[1][1]))
+        n = len(items)
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header["magic"] = MAGIC
+        header["version"] = VERSION
+        header["board_size"] = self.board_size
+        header["num_entries"] = n
+        with open(path, "wb") as f:
+            f.write(header.tobytes())
+            f.write(np.array([k for (k, _), _ in items], dtype="<u8").tobytes())
+            f.write(np.array([v[1] for _, v in items], dtype="<u4").tobytes())
+            f.write(np.array([v[0] for _, v in items], dtype="<f4").tobytes())
+            f.write(np.array([m for (_, m), _ in items], dtype=np.uint8).reshape(n, 2).tobytes())
+
+
+class OpeningBook:
+    """
+    Memory-mapped book file written by OpeningBookBuilder.
+    """
+    def __init__(self, path: str) -> None:
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if len(header) == 0 or header["magic"][0] != MAGIC or header["version"][0] != VERSION:
+            raise ValueError(f"{path} is not an opening book of version {VERSION}")
+        self.board_size = int(header["board_size"][0])
+        n = int(header["num_entries"][0])
+        offset = HEADER_DTYPE.itemsize
+        def section(dtype, shape):
+            nonlocal offset
+            if n == 0:
+                return np.zeros(shape, dtype=dtype)
+            array = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+            offset += array.nbytes
+            return array
+        self.keys = section("<u8", (n,))
+        self.total_rounds = section("<u4", (n,))
+        self.win_rounds = section("<f4", (n,))
+        self.moves = section(np.uint8, (n, 2))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, board_state: np.ndarray, stone_id: int):
+        """
+        Return: list of (move, win_rounds, total_rounds) of stone_id on board_state, most visited first.
+        """
+        if board_state.shape[0] != self.board_size:
+            return []
+        key, transform = canonical_key(board_state, stone_id)
+        key = np.uint64(key)
+        begin = int(np.searchsorted(self.keys, key, side="left"))
+        end = int(np.searchsorted(self.keys, key, side="right"))
+        return [(from_canonical((int(self.moves[i, 0]), int(self.moves[i, 1])), transform, self.board_size),
+                 float(self.win_rounds[i]), int(self.total_rounds[i])) for i in range(begin, end)]
+
+    def best_move(self, board_state: np.ndarray, stone_id: int, min_visits: int = 1):
+        """
+        Return: most visited book move with at least min_visits visits on an empty place, None if there is none.
+        """
+        for move, _, total_rounds in self.lookup(board_state, stone_id):
+            if total_rounds < min_visits:
+                break
+            if board_state[move[0], move[1]] == 0:
+                return move
+        return None
+
+
+def build_from_search(board_size: int, depth: int, width: int, iter_steps: int, random_seed: int = 0):
+    """
+    Search the empty board, then the `width` most visited moves of every searched position,
+    down to `depth` stones.
+    Return: OpeningBookBuilder holding the root statistics of all searched positions.
+    """
+    import py_MCTS
+    builder = OpeningBookBuilder(board_size)
+    seen = set()
+    frontier = [np.zeros((board_size, board_size), dtype=np.int32)]
+    for ply in range(depth):
+        stone_id = 1 + ply % 2
+        next_frontier = []
+        for board in frontier:
+            key = canonical_key(board, stone_id)[0]
+            if key in seen:
+                continue
+            seen.add(key)
+            tree = py_MCTS.MonteCarloTreeSearch(board, stone_id)
+            tree.random_seed = random_seed
+            tree.SearchMove(iter_steps)
+            builder.add_search(board, stone_id, tree)
+            children = sorted(tree.GetRootChildren(), key=lambda ch: -ch.total_rounds)
+            for ch in children[:width]:
+                child_board = board.copy()
+                child_board[ch.from_moving] = stone_id
+                next_frontier.append(child_board)
+            print(f"ply {ply}: searched {len(seen)} positions", flush=True)
+        frontier = next_frontier
+    return builder
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an opening book.")
+    sub = parser.add_subparsers(dest="source", required=True)
+    search = sub.add_parser("search", help="search the most visited lines from the empty board")
+    search.add_argument("--depth", type=int, default=4, help="number of stones of the deepest positions")
+    search.add_argument("--width", type=int, default=3, help="moves followed from each position")
+    search.add_argument("--iter-steps", type=int, default=20000)
+    search.add_argument("--seed", type=int, default=0)
+    games = sub.add_parser("games", help="collect moves of games in arena JSON lines files")
+    games.add_argument("files", nargs="+")
+    games.add_argument("--max-moves", type=int, default=8, help="moves of each game added")
+    for p in (search, games):
+        p.add_argument("-o", "--output", default="opening_book.bin")
+        p.add_argument("--board-size", type=int, default=15)
+    args = parser.parse_args()
+
+    if args.source == "search":
+        builder = build_from_search(args.board_size, args.depth, args.width, args.iter_steps, args.seed)
+    else:
+        builder = OpeningBookBuilder(args.board_size)
+        for file in args.files:
+            with open(file) as f:
+                for line in f:
+                    game = json.loads(line)
+                    # engine A has stone 1 + who_first
+                    stone_a = 1 + game["who_first"]
+                    winner = {"A": stone_a, "B": 3 - stone_a}.get(game["winner"], 0)
+                    builder.add_game(game["moves"], winner, args.max_moves)
+    builder.write(args.output)
+    print(f"{len(builder.stats)} entries written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
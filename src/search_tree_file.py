@@ -0,0 +1,52 @@
+"""
+Read search tree files written by py_MCTS.MonteCarloTreeSearch.SaveTree without building a tree,
+e.g. for offline analysis of trees precomputed on other machines. Records are memory-mapped,
+see src/cpp/tree_file.h for the layout.
+
+    header, board, records = read_tree_file("tree.bin")
+    children, canonical = children_of(records, 0)
+    moves = records[["move_x", "move_y"]][children]
+    visits = records["total_rounds"][canonical]
+"""
+import numpy as np
+
+MAGIC = b"PFRTREE1"
+VERSION = 1
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("board_size", "<u4"), ("num_records", "<u4"),
+                         ("root_stone_id", "i1"), ("root_move_x", "i1"), ("root_move_y", "i1"), ("reserved", "i1")])
+RECORD_DTYPE = np.dtype([("win_rounds", "<f8"), ("total_rounds", "<i4"), ("first_child", "<i4"),
+                         ("num_children", "<i2"), ("move_x", "i1"), ("move_y", "i1"), ("stone_id", "i1"),
+                         ("expand_state", "u1"), ("reserved", "<u2")])
+ALIAS = 3
+
+
+def read_tree_file(path: str):
+    """
+    Return: (header dict, root board as (N, N) int8 array, records as memory-mapped structured array).
+    Record 0 is the root; an alias record (expand_state == ALIAS) keeps in first_child the record
+    holding its statistics.
+    """
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header["magic"][0] != MAGIC or header["version"][0] != VERSION:
+        raise ValueError(f"{path} is not a search tree file of version {VERSION}")
+    header = {name: header[name][0].item() for name in HEADER_DTYPE.names if name != "reserved"}
+    n = header["board_size"]
+    board = np.fromfile(path, dtype=np.int8, count=n * n, offset=HEADER_DTYPE.itemsize).reshape(n, n)
+    records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", shape=(header["num_records"],),
+                        offset=HEADER_DTYPE.itemsize + (n * n + 7) // 8 * 8)
+    return header, board, records
+
+
+def children_of(records: np.ndarray, index: int):
+    """
+    Return: (children, canonical), record indices of the children of record index, and of the
+    records holding their statistics, which differ for aliases.
+    """
+    rec = records[index]
+    if rec["expand_state"] == ALIAS:
+        rec = records[rec["first_child"]]
+    children = np.arange(rec["first_child"], rec["first_child"] + rec["num_children"])
+    canonical = children.copy()
+    aliases = records["expand_state"][children] == ALIAS
+    canonical[aliases] = records["first_child"][children[aliases]]
+    return children, canonical
@@ -0,0 +1,54 @@
+class TranspositionTable:
+    """
+    Bounded map from Zobrist hash of a position to the tree node holding its statistics,
+    python port of src/cpp/transposition_table.h.
+    Entries are grouped in buckets of BUCKET_SIZE by the hash. When the bucket of a new position
+    is full, the entry whose node has the fewest visits is replaced.
+    """
+    BUCKET_SIZE = 4
+
+    def __init__(self, capacity: int, visits=lambda node: node.total_rounds) -> None:
+        """
+        capacity: max number of entries, rounded down to a power of two, 0 disables the table.
+        visits: returns the visits of a stored node, the least visited entry of a full bucket is replaced.
+        """
+        self.visits = visits
+        n = self.BUCKET_SIZE if capacity >= self.BUCKET_SIZE else 0
+        while n != 0 and n * 2 <= capacity:
+            n *= 2
+        self.capacity = n
+        self.num_buckets = n // self.BUCKET_SIZE
+        self.keys = [0] * n
+        self.nodes: list = [None] * n
+        self.size = 0 # number of entries in use
+
+    def lookup(self, key: int):
+        """
+        Return: node stored for key, None if absent.
+        """
+        if self.num_buckets == 0:
+            return None
+        base = key % self.num_buckets * self.BUCKET_SIZE
+        for i in range(base, base + self.BUCKET_SIZE):
+            if self.nodes[i] is not None and self.keys[i] == key:
+                return self.nodes[i]
+        return None
+
+    def store(self, key: int, node):
+        """
+        Map key to node, replacing the entry of the least visited node if the bucket is full.
+        """
+        if self.num_buckets == 0:
+            return
+        base = key % self.num_buckets * self.BUCKET_SIZE
+        victim = base
+        for i in range(base, base + self.BUCKET_SIZE):
+            if self.nodes[i] is None or self.keys[i] == key:
+                victim = i
+                break
+            if self.visits(self.nodes[i]) < self.visits(self.nodes[victim]):
+                victim = i
+        if self.nodes[victim] is None:
+            self.size += 1
+        self.keys[victim] = key
+        self.nodes[victim] = node